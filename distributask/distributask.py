@@ -1,533 +1,5901 @@
 import os
 import json
+import asyncio
 import time
 import requests
 from tqdm import tqdm
 from typing import Dict, List
 import atexit
 import tempfile
-
-from celery import Celery
-from redis import ConnectionPool, Redis
+import shutil
+import itertools
+import base64
+import pickle
+import struct
+import hashlib
+import math
+import random
+import threading
+from bisect import bisect
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from uuid import uuid4
+
+from celery import Celery, states
+from celery.signals import worker_process_init, worker_process_shutdown
+from celery.utils.time import get_exponential_backoff_interval
+from celery.exceptions import TimeoutError as TaskTimeoutError
+from celery.result import AsyncResult
+from kombu.serialization import SerializerNotInstalled
+from kombu.serialization import dumps as serialize
+from kombu.serialization import loads as deserialize
+from kombu.serialization import prepare_accept_content
+from kombu.serialization import register as register_serializer
+from kombu.utils.encoding import bytes_to_str
+from kombu.utils.json import dumps as kombu_dumps
+from kombu.transport.redis import PRIORITY_STEPS
+from redis import BlockingConnectionPool, ConnectionPool, Redis
+from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis
 from omegaconf import OmegaConf
 from dotenv import load_dotenv
-from huggingface_hub import HfApi, Repository
+from huggingface_hub import (
+    CommitOperationAdd,
+    CommitOperationCopy,
+    CommitOperationDelete,
+    HfApi,
+    Repository,
+)
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
+from urllib3.exceptions import InvalidHeader, NewConnectionError
+from urllib3.util.retry import Retry
 from celery.utils.log import get_task_logger
 
 
-class Distributask:
-    """
-    The Distributask class contains the core features of distributask, including creating and
-    executing the task queue, managing workers using the Vast.ai API, and uploading files and directories
-    using the Hugging Face API.
+def pickle5_dumps(obj: any) -> bytes:
     """
+    Serialize obj with pickle protocol 5. Large buffers such as NumPy arrays are written out-of-band after the
+    pickle stream instead of being copied into it.
 
-    app: Celery = None
-    redis_client: Redis = None
-    registered_functions: dict = {}
-    pool: ConnectionPool = None
-
-    def __init__(
-        self,
-        hf_repo_id=os.getenv("HF_REPO_ID"),
-        hf_token=os.getenv("HF_TOKEN"),
-        vast_api_key=os.getenv("VAST_API_KEY"),
-        redis_host=os.getenv("REDIS_HOST", "localhost"),
-        redis_password=os.getenv("REDIS_PASSWORD", ""),
-        redis_port=os.getenv("REDIS_PORT", 6379),
-        redis_username=os.getenv("REDIS_USER", "default"),
-        broker_pool_limit=os.getenv("BROKER_POOL_LIMIT", 1),
-    ) -> None:
-        """
-        Initialize the Distributask object with the provided configuration parameters. Also sets some
-        default settings in Celery and handles cleanup of Celery queue and Redis server on exit.
-
-        Args:
-            hf_repo_id (str): Hugging Face repository ID.
-            hf_token (str): Hugging Face API token.
-            vast_api_key (str): Vast.ai API key.
-            redis_host (str): Redis host. Defaults to "localhost".
-            redis_password (str): Redis password. Defaults to an empty string.
-            redis_port (int): Redis port. Defaults to 6379.
-            redis_username (str): Redis username. Defaults to "default".
-            broker_pool_limit (int): Celery broker pool limit. Defaults to 1.
+    Args:
+        obj (any): The object to serialize.
 
-        Raises:
-            ValueError: If any of the required parameters (hf_repo_id, hf_token, vast_api_key) are not provided.
-        """
-        if hf_repo_id is None:
-            raise ValueError(
-                "HF_REPO_ID is not provided to the Distributask constructor"
-            )
+    Returns:
+        bytes: A header with the number and sizes of the out-of-band buffers, followed by the pickle stream and
+        the buffers.
+    """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raw_buffers = [buffer.raw() for buffer in buffers]
+    header = struct.pack(
+        f"!I{len(raw_buffers) + 1}Q",
+        len(raw_buffers),
+        len(data),
+        *[raw.nbytes for raw in raw_buffers],
+    )
+    return b"".join([header, data, *raw_buffers])
 
-        if hf_token is None:
-            raise ValueError("HF_TOKEN is not provided to the Distributask constructor")
 
-        if vast_api_key is None:
-            raise ValueError(
-                "VAST_API_KEY is not provided to the Distributask constructor"
-            )
+def pickle5_loads(data: bytes) -> any:
+    """
+    Deserialize data created by pickle5_dumps.
 
-        if redis_host == "localhost":
-            print(
-                "WARNING: Using default Redis host 'localhost'. This is not recommended for production use and won't work for distributed rendering."
-            )
+    Args:
+        data (bytes): The serialized data.
 
-        self.settings = {
-            "HF_REPO_ID": hf_repo_id,
-            "HF_TOKEN": hf_token,
-            "VAST_API_KEY": vast_api_key,
-            "REDIS_HOST": redis_host,
-            "REDIS_PASSWORD": redis_password,
-            "REDIS_PORT": redis_port,
-            "REDIS_USER": redis_username,
-            "BROKER_POOL_LIMIT": broker_pool_limit,
-        }
+    Returns:
+        any: The deserialized object.
+    """
+    view = memoryview(data)
+    (count,) = struct.unpack_from("!I", view)
+    sizes = struct.unpack_from(f"!{count + 1}Q", view, 4)
+    offset = 4 + 8 * (count + 1)
+
+    chunks = []
+    for size in sizes:
+        chunks.append(view[offset : offset + size])
+        offset += size
+    # copy the buffers so the deserialized arrays are writable
+    return pickle.loads(chunks[0], buffers=[bytearray(chunk) for chunk in chunks[1:]])
+
+
+# Only enable pickle based serializers when every producer of messages is trusted
+register_serializer(
+    "pickle5",
+    pickle5_dumps,
+    pickle5_loads,
+    content_type="application/x-distributask-pickle5",
+    content_encoding="binary",
+)
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    """
+    Nearest-rank percentile of values.
 
-        redis_url = self.get_redis_url()
-        # start Celery app instance
-        self.app = Celery("distributask", broker=redis_url, backend=redis_url)
-        self.app.conf.broker_pool_limit = self.settings["BROKER_POOL_LIMIT"]
+    Args:
+        values (List[float]): The values, sorted in ascending order.
+        percentile (float): The percentile, between 0 and 100.
 
-        def cleanup_redis():
-            """
-            Deletes keys in redis related to Celery tasks and closes the Redis connection on exit
-            """
-            patterns = ["celery-task*", "task_status*"]
-            redis_connection = self.get_redis_connection()
-            for pattern in patterns:
-                for key in redis_connection.scan_iter(match=pattern):
-                    redis_connection.delete(key)
-            print("Redis server cleared")
+    Returns:
+        float: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(percentile / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
 
-        def cleanup_celery():
-            """
-            Clears Celery task queue on exit
-            """
-            self.app.control.purge()
-            print("Celery queue cleared")
 
-        # At exit, close Celery instance, delete all previous task info from queue and Redis, and close Redis
-        atexit.register(self.app.close)
-        atexit.register(cleanup_redis)
-        atexit.register(cleanup_celery)
+class BlobStore:
+    """
+    Base class for the content-addressed stores that hold task arguments and results which are too large to be
+    sent through Redis. Blobs are identified by the SHA-256 digest of their content. Subclasses implement
+    put, get and delete, and must be reachable from the client and from every worker.
+    """
 
-        self.redis_client = self.get_redis_connection()
+    def put(self, data: bytes) -> str:
+        """
+        Store data and return its key.
 
-        # Tasks are acknowledged after they have been executed
-        self.app.conf.task_acks_late = True
-        self.call_function_task = self.app.task(
-            bind=True, name="call_function_task", max_retries=3, default_retry_delay=30
-        )(self.call_function_task)
+        Args:
+            data (bytes): The content to store.
 
-    def __del__(self):
-        """Destructor to clean up resources."""
-        if self.pool is not None:
-            self.pool.disconnect()
-        if self.redis_client is not None:
-            self.redis_client.close()
-        if self.app is not None:
-            self.app.close()
+        Returns:
+            str: The key of the blob.
+        """
+        raise NotImplementedError
 
-    def log(self, message: str, level: str = "info") -> None:
+    def get(self, key: str) -> bytes:
         """
-        Log a message with the specified level.
+        Return the content of the blob with the given key.
 
         Args:
-            message (str): The message to log.
-            level (str): The logging level. Defaults to "info".
-        """
-        logger = get_task_logger(__name__)
-        getattr(logger, level)(message)
+            key (str): The key of the blob.
 
-    def get_settings(self) -> str:
+        Returns:
+            bytes: The content of the blob.
         """
-        Return settings of distributask instance.
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
         """
-        return self.settings
+        Delete the blob with the given key. Deleting a missing blob is not an error.
 
-    def get_redis_url(self) -> str:
+        Args:
+            key (str): The key of the blob.
         """
-        Construct a Redis URL from the configuration settings.
+        raise NotImplementedError
 
-        Returns:
-            str: A Redis URL string.
 
-        Raises:
-            ValueError: If any required Redis connection parameter is missing.
+class LocalBlobStore(BlobStore):
+    """
+    BlobStore that keeps blobs as files in a local directory. Useful for testing and for workers that share a
+    filesystem with the client.
+    """
+
+    def __init__(self, root: str) -> None:
         """
-        host = self.settings["REDIS_HOST"]
-        password = self.settings["REDIS_PASSWORD"]
-        port = self.settings["REDIS_PORT"]
-        username = self.settings["REDIS_USER"]
+        Args:
+            root (str): Directory the blobs are written to. Created if it does not exist.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            # write to a temporary file first so readers never see a partial blob
+            with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, path)
+        return key
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(os.path.join(self.root, key))
+        except FileNotFoundError:
+            pass
 
-        if None in [host, password, port, username]:
-            raise ValueError("Missing required Redis configuration values")
 
-        redis_url = f"redis://{username}:{password}@{host}:{port}"
-        return redis_url
+class CommitBackend:
+    """
+    Base class for the backends that commit files to the dataset repository. Subclasses implement commit, which
+    applies a list of Hugging Face commit operations as a single commit, and get_revision and list_files, which
+    are used by the repository index.
+    """
 
-    def get_redis_connection(self, force_new: bool = False) -> Redis:
+    def commit(self, operations: List, message: str, parent_commit: str = None) -> str:
         """
-        Returns Redis connection. If it already exists, returns current connection.
-        If it does not exist, its create a new Redis connection using a connection pool.
+        Apply the operations to the repository in one commit.
 
         Args:
-            force_new (bool): Force the creation of a new connection if set to True. Defaults to False.
+            operations (list): CommitOperationAdd, CommitOperationDelete and CommitOperationCopy objects.
+            message (str): The commit message.
+            parent_commit (str): If set, the commit is rejected with a conflict (HTTP 412) unless parent_commit is
+            the latest commit of the repository. Defaults to None.
 
         Returns:
-            Redis: A Redis connection object.
+            str: The id of the commit.
         """
-        if self.redis_client is not None and not force_new:
-            return self.redis_client
-        else:
-            self.pool = ConnectionPool(host=self.settings["REDIS_HOST"], 
-                                       port=self.settings["REDIS_PORT"],
-                                       password=self.settings["REDIS_PASSWORD"], 
-                                       max_connections=1)
-            self.redis_client = Redis(connection_pool=self.pool)
-            atexit.register(self.pool.disconnect)
-
-        return self.redis_client
+        raise NotImplementedError
 
-    def get_env(self, key: str, default: any = None) -> any:
+    def is_conflict(self, exception: Exception) -> bool:
         """
-        Retrieve a value from the configuration or .env file, with an optional default if the key is not found.
+        Returns True if commit raised exception because the repository changed, e.g. parent_commit isn't the
+        latest commit anymore.
 
         Args:
-            key (str): The key to look for in the settings.
-            default (any): The default value to return if the key is not found. Defaults to None.
+            exception (Exception): The exception raised by commit.
+        """
+        response = getattr(exception, "response", None)
+        return response is not None and response.status_code in (409, 412)
 
-        Returns:
-            any: The value from the settings if the key exists, otherwise the default value.
+    def is_retryable(self, exception: Exception) -> bool:
         """
-        return self.settings.get(key, default)
+        Returns True if a commit that raised exception should be retried: after connection errors, timeouts,
+        conflicts with a concurrent commit (409, 412), rate limits (429) and server errors.
+
+        Args:
+            exception (Exception): The exception raised by commit.
+        """
+        if isinstance(exception, (requests.ConnectionError, requests.Timeout)):
+            return True
+        response = getattr(exception, "response", None)
+        return response is not None and response.status_code in (
+            409,
+            412,
+            429,
+            500,
+            502,
+            503,
+            504,
+        )
 
-    def call_function_task(self, func_name: str, args_json: str) -> any:
+    def commit_with_retries(
+        self,
+        operations: List,
+        message: str,
+        max_retries: int = 3,
+        retry_backoff: float = 1,
+        log=None,
+        parent_commit: str = None,
+    ) -> tuple:
         """
-        Creates Celery task that executes a registered function with provided JSON arguments.
+        Commit the operations, retrying with exponential backoff and full jitter while is_retryable returns True.
 
         Args:
-            func_name (str): The name of the registered function to execute.
-            args_json (str): JSON string representation of the arguments for the function.
+            operations (list): Commit operations, see commit.
+            message (str): The commit message.
+            max_retries (int): Maximum number of retries. Defaults to 3.
+            retry_backoff (float): The n-th retry waits a random time of up to retry_backoff * 2^(n-1) seconds,
+            at most 60. Defaults to 1.
+            log (callable): Called with a message and a log level for every attempt. Defaults to None.
+            parent_commit (str): The commit the operations are expected to follow. If the repository has moved on,
+            the operations are committed on top of its latest commit instead, without counting as a retry. Only
+            pass it if the caller needs to know the parent, every concurrent commit turns it into an extra
+            request. Defaults to None.
 
         Returns:
-            any: Celery.app.task object, represents result of the registered function
+            tuple: The id of the commit, and parent_commit if it is the parent of the commit, otherwise None.
 
         Raises:
-            ValueError: If the function name is not registered.
-            Exception: If an error occurs during the execution of the function. The task will retry in this case.
+            Exception: The exception of the last attempt.
         """
-        try:
-            if func_name not in self.registered_functions:
-                raise ValueError(f"Function '{func_name}' is not registered.")
-
-            func = self.registered_functions[func_name]
-            args = json.loads(args_json)
-            result = func(**args)
-            # self.update_function_status(self.call_function_task.request.id, "success")
+        log = log or (lambda message, level="info": None)
+        attempt = 0
+        while True:
+            try:
+                commit_id = self.commit(
+                    operations, message, parent_commit=parent_commit
+                )
+                log(f"Committed {len(operations)} operations in commit {commit_id}")
+                return commit_id, parent_commit
+            except Exception as e:
+                if parent_commit is not None and self.is_conflict(e):
+                    # the parent is only known when it is checked, commit without it
+                    parent_commit = None
+                    continue
+                if attempt >= max_retries or not self.is_retryable(e):
+                    log(f"Failed to commit {len(operations)} operations: {e}", "error")
+                    raise
+                delay = random.uniform(0, min(60, retry_backoff * 2**attempt))
+                attempt += 1
+                log(
+                    f"Failed to commit {len(operations)} operations, retrying in {delay:.1f}s: {e}",
+                    "warning",
+                )
+                time.sleep(delay)
 
-            return result
-        except Exception as e:
-            self.log(f"Error in call_function_task: {str(e)}", "error")
-            # self.call_function_task.retry(exc=e)
+    def get_revision(self) -> str:
+        """
+        Return the id of the latest commit of the repository.
 
+        Returns:
+            str: The commit id, or None if nothing has been committed.
+        """
+        raise NotImplementedError
 
-    def register_function(self, func: callable) -> callable:
+    def list_files(self, revision: str = None) -> List[str]:
         """
-        Decorator to register a function so that it can be invoked as a Celery task.
+        Return the paths of the files in the repository.
 
         Args:
-            func (callable): The function to register.
+            revision (str): The commit to list the files of. Defaults to the latest commit.
 
         Returns:
-            callable: The original function, now registered as a callable task.
+            list: The paths of the files.
         """
-        self.registered_functions[func.__name__] = func
-        return func
+        raise NotImplementedError
+
 
-    def execute_function(self, func_name: str, args: dict) -> Celery.AsyncResult:
+class HfCommitBackend(CommitBackend):
+    """
+    CommitBackend that commits to a Hugging Face dataset repository with HfApi.create_commit.
+    """
+
+    def __init__(self, repo_id: str, token: str, repo_type: str = "dataset") -> None:
         """
-        Execute a registered function as a Celery task with provided arguments.
+        Args:
+            repo_id (str): The ID of the repository.
+            token (str): Hugging Face API token.
+            repo_type (str): The type of the repository. Defaults to "dataset".
+        """
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.api = HfApi(token=token)
+
+    def commit(self, operations: List, message: str, parent_commit: str = None) -> str:
+        commit_info = self.api.create_commit(
+            repo_id=self.repo_id,
+            repo_type=self.repo_type,
+            operations=operations,
+            commit_message=message,
+            parent_commit=parent_commit,
+        )
+        return commit_info.oid
+
+    def get_revision(self) -> str:
+        return self.api.repo_info(
+            repo_id=self.repo_id, repo_type=self.repo_type, timeout=30
+        ).sha
+
+    def list_files(self, revision: str = None) -> List[str]:
+        return self.api.list_repo_files(
+            repo_id=self.repo_id, repo_type=self.repo_type, revision=revision
+        )
+
 
+class LocalCommitBackend(CommitBackend):
+    """
+    CommitBackend that writes the files to a local directory and records every commit in the commits list.
+    Useful for testing without the Hugging Face API.
+    """
+
+    def __init__(self, root: str) -> None:
+        """
         Args:
-            func_name (str): The name of the function to execute.
-            args (dict): Arguments to pass to the function.
+            root (str): Directory the files are written to. Created if it does not exist.
+        """
+        self.root = root
+        self.commits = []
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def commit(self, operations: List, message: str, parent_commit: str = None) -> str:
+        with self.lock:
+            head = self.commits[-1]["id"] if self.commits else None
+            if parent_commit is not None and parent_commit != head:
+                response = requests.Response()
+                response.status_code = 412
+                raise HTTPError(
+                    f"412 {parent_commit} is not the latest commit", response=response
+                )
+            self.check_operations(operations)
+            for operation in operations:
+                path = os.path.join(self.root, operation.path_in_repo)
+                if isinstance(operation, CommitOperationDelete):
+                    if operation.is_folder:
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    continue
+                if isinstance(operation, CommitOperationCopy):
+                    source = os.path.join(self.root, operation.src_path_in_repo)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    shutil.copyfile(source, path)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with operation.as_file() as source, tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(path), delete=False
+                ) as f:
+                    shutil.copyfileobj(source, f)
+                os.replace(f.name, path)
+            commit_id = uuid4().hex
+            self.commits.append(
+                {
+                    "id": commit_id,
+                    "message": message,
+                    "paths": [operation.path_in_repo for operation in operations],
+                }
+            )
+            return commit_id
 
-        Returns:
-            celery.result.AsyncResult: An object representing the asynchronous result of the task.
+    def check_operations(self, operations: List) -> None:
         """
-        args_json = json.dumps(args)
-        async_result = self.call_function_task.delay(func_name, args_json)
-        return async_result
+        Check that the operations can be applied, so a commit that fails changes nothing. Like the Hub, a delete or
+        copy of a path that doesn't exist is rejected with HTTP 404.
 
-    def update_function_status(self, task_id: str, status: str) -> None:
+        Args:
+            operations (list): Commit operations, see commit.
+
+        Raises:
+            HTTPError: If a deleted path or the source of a copy doesn't exist (status 404).
+            FileNotFoundError: If the file of a CommitOperationAdd can't be read.
+            ValueError: If an operation isn't an add, delete or copy.
         """
-        Update the status of a function task as a new Redis key.
+        added, deleted = set(), set()
+
+        def exists(path, is_folder=False):
+            if path in added:
+                return True
+            if path in deleted:
+                return False
+            path = os.path.join(self.root, path)
+            return os.path.isdir(path) if is_folder else os.path.isfile(path)
+
+        def not_found(path):
+            response = requests.Response()
+            response.status_code = 404
+            return HTTPError(f"404 {path} not found", response=response)
+
+        for operation in operations:
+            if isinstance(operation, CommitOperationDelete):
+                if not exists(operation.path_in_repo, operation.is_folder):
+                    raise not_found(operation.path_in_repo)
+                deleted.add(operation.path_in_repo)
+                added.discard(operation.path_in_repo)
+            elif isinstance(operation, CommitOperationCopy):
+                if not exists(operation.src_path_in_repo):
+                    raise not_found(operation.src_path_in_repo)
+                added.add(operation.path_in_repo)
+                deleted.discard(operation.path_in_repo)
+            elif isinstance(operation, CommitOperationAdd):
+                source = operation.path_or_fileobj
+                if isinstance(source, (str, os.PathLike)) and not os.access(
+                    source, os.R_OK
+                ):
+                    raise FileNotFoundError(f"Can't read {source}")
+                added.add(operation.path_in_repo)
+                deleted.discard(operation.path_in_repo)
+            else:
+                raise ValueError(f"Unsupported commit operation: {operation}")
+
+    def get_revision(self) -> str:
+        with self.lock:
+            return self.commits[-1]["id"] if self.commits else None
+
+    def list_files(self, revision: str = None) -> List[str]:
+        # the directory only holds the latest commit
+        paths = []
+        with self.lock:
+            for root, _, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.relpath(os.path.join(root, name), self.root)
+                    paths.append(path.replace(os.sep, "/"))
+        return sorted(paths)
+
+
+class UploadBuffer:
+    """
+    Collects files and commits them in the background, in batches, so many small uploads become a single commit.
+    A batch is committed when it holds max_files files or max_bytes bytes, when its oldest file has waited
+    max_delay seconds, or when flush or close is called. Batches are committed by a pool of threads and failed
+    commits are retried with exponential backoff. Every file gets a Future that resolves to the id of the commit
+    that contains it, or to the exception of the last attempt. Files larger than max_memory_bytes aren't read
+    into memory, they are committed from their path.
+    """
 
+    def __init__(
+        self,
+        backend: CommitBackend,
+        max_files: int = 100,
+        max_bytes: int = 67108864,
+        max_delay: float = 10,
+        max_queued_bytes: int = 268435456,
+        threads: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 1,
+        log=None,
+        on_commit=None,
+        max_memory_bytes: int = 8388608,
+    ) -> None:
+        """
         Args:
-            task_id (str): The ID of the task.
-            status (str): The new status to set.
+            backend (CommitBackend): Backend the batches are committed with.
+            max_files (int): Maximum number of files in a commit. Defaults to 100.
+            max_bytes (int): Number of buffered bytes that triggers a commit. Defaults to 67108864 (64 MB).
+            max_delay (float): Seconds a file waits for other files before it is committed. Defaults to 10.
+            max_queued_bytes (int): Number of bytes buffered or being committed above which add blocks until
+            commits finish. Defaults to 268435456 (256 MB).
+            threads (int): Number of commits made at the same time. Defaults to 4.
+            max_retries (int): Number of times a commit is retried after a connection error, a rate limit (429) or
+            a server error. Defaults to 3.
+            retry_backoff (float): The n-th retry waits a random time of up to retry_backoff * 2^(n-1) seconds,
+            at most 60. Defaults to 1.
+            log (callable): Called with a message and a log level when a commit succeeds or fails. Defaults to None.
+            on_commit (callable): Called with the operations and the commit id of every successful commit, before
+            the futures of its files resolve. Defaults to None.
+            max_memory_bytes (int): Files up to this size are read into memory by add, larger files are committed
+            from their path. Defaults to 8388608 (8 MB).
         """
-        redis_client = self.get_redis_connection()
-        redis_client.set(f"task_status:{task_id}", status)
+        self.backend = backend
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.max_queued_bytes = max_queued_bytes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.log = log or (lambda message, level="info": None)
+        self.on_commit = on_commit
+        self.max_memory_bytes = max_memory_bytes
+        # (operation, future, time added, size) of the files that are not being committed yet
+        self.pending = []
+        self.pending_bytes = 0
+        # bytes of the pending files and of the files being committed
+        self.queued_bytes = 0
+        # number of commits in progress for each path, a path is only in one commit at a time so the latest
+        # content wins
+        self.in_flight = {}
+        self.unresolved = set()
+        self.flushing = 0
+        # number of times each thread is inside producing, group flushes wait until all of them are waiting too
+        self.producers = {}
+        self.waiting = 0
+        self.waiting_producers = 0
+        self.blocked = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        # a buffer inherited by a forked process has no threads
+        self.pid = os.getpid()
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="distributask-upload"
+        )
+        self.thread = threading.Thread(
+            target=self.run, name="distributask-upload-buffer", daemon=True
+        )
+        self.thread.start()
 
-    def initialize_dataset(self, **kwargs) -> None:
+    def add(self, file_path: str, path_in_repo: str = None) -> Future:
         """
-        Initialize a Hugging Face repository if it doesn't exist. Reads Hugging Face info from config or .env
+        Add a file to the buffer. Blocks while more than max_queued_bytes bytes are queued. Files up to
+        max_memory_bytes are read immediately, so they can be changed or deleted as soon as add returns. Larger
+        files are read when they are committed, they must not be changed or deleted until the future resolves.
 
         Args:
-            kwargs: kwargs that can be passed into the HfApi.create_repo function.
+            file_path (str): The path of the file.
+            path_in_repo (str): The path of the file in the repository. Defaults to the file name.
+
+        Returns:
+            Future: Resolves to the id of the commit that contains the file.
 
         Raises:
-            HTTPError: If repo cannot be created due to connection error other than repo not existing
+            RuntimeError: If the buffer is closed.
         """
-        repo_id = self.settings.get("HF_REPO_ID")
-        hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
-
-        # creates new repo if desired repo is not found
-        try:
+        size = os.path.getsize(file_path)
+        if size <= self.max_memory_bytes:
+            with open(file_path, "rb") as f:
+                content = f.read()
+            size = len(content)
+        else:
+            content = file_path
+        operation = CommitOperationAdd(
+            path_in_repo=path_in_repo or os.path.basename(file_path),
+            path_or_fileobj=content,
+        )
+        future = Future()
+        with self.condition:
+            # a file larger than max_queued_bytes is accepted once the queue is empty
+            while (
+                not self.closed
+                and self.queued_bytes
+                and self.queued_bytes + size > self.max_queued_bytes
+            ):
+                self.blocked += 1
+                self.condition.notify_all()
+                self.condition.wait()
+                self.blocked -= 1
+            if self.closed:
+                raise RuntimeError("The upload buffer is closed")
+            self.pending.append((operation, future, time.monotonic(), size))
+            self.pending_bytes += size
+            self.queued_bytes += size
+            self.unresolved.add(future)
+            self.condition.notify_all()
+        return future
+
+    def is_due(self) -> bool:
+        """
+        Returns True if the pending files should be committed. Must be called with the condition held.
+        """
+        if not self.pending:
+            return False
+        return (
+            self.closed
+            or self.flushing > 0
+            or (self.waiting > 0 and len(self.producers) == self.waiting_producers)
+            or self.blocked > 0
+            or len(self.pending) >= self.max_files
+            or self.pending_bytes >= self.max_bytes
+            or time.monotonic() - self.pending[0][2] >= self.max_delay
+        )
+
+    def take_batch(self) -> List[tuple]:
+        """
+        Remove up to max_files pending files from the buffer, skipping files whose path is being committed. Must
+        be called with the condition held.
+
+        Returns:
+            list: (operation, future, time added, size) tuples.
+        """
+        batch, pending = [], []
+        for item in self.pending:
+            if (
+                len(batch) < self.max_files
+                and item[0].path_in_repo not in self.in_flight
+            ):
+                batch.append(item)
+            else:
+                pending.append(item)
+        self.pending = pending
+        self.pending_bytes -= sum(item[3] for item in batch)
+        for path in {item[0].path_in_repo for item in batch}:
+            self.in_flight[path] = self.in_flight.get(path, 0) + 1
+        return batch
+
+    def run(self) -> None:
+        """
+        Body of the dispatch thread, hands the pending files to the thread pool whenever they are due.
+        """
+        while True:
+            with self.condition:
+                while True:
+                    timeout = None
+                    if self.is_due():
+                        batch = self.take_batch()
+                        if batch:
+                            break
+                        # every due file waits for a commit of the same path to finish
+                    elif self.closed and not self.pending:
+                        return
+                    elif self.pending:
+                        timeout = max(
+                            0, self.pending[0][2] + self.max_delay - time.monotonic()
+                        )
+                    self.condition.wait(timeout)
+            self.executor.submit(self.commit, batch)
+
+    def commit(self, batch: List[tuple]) -> None:
+        """
+        Commit a batch of files, retrying on transient errors, and resolve their futures.
+
+        Args:
+            batch (list): (operation, future, time added, size) tuples.
+        """
+        # a file added twice is committed once, with its latest content
+        operations = {operation.path_in_repo: operation for operation, _, _, _ in batch}
+        commit_id, error = None, None
+        try:
+            commit_id, _ = self.backend.commit_with_retries(
+                list(operations.values()),
+                f"Upload {len(operations)} files",
+                max_retries=self.max_retries,
+                retry_backoff=self.retry_backoff,
+                log=self.log,
+            )
+        except Exception as e:
+            error = e
+
+        if error is None and self.on_commit is not None:
+            try:
+                self.on_commit(list(operations.values()), commit_id)
+            except Exception as e:
+                self.log(f"Error in on_commit: {e}", "error")
+
+        with self.condition:
+            for path in operations:
+                self.in_flight[path] -= 1
+                if not self.in_flight[path]:
+                    del self.in_flight[path]
+            self.queued_bytes -= sum(size for _, _, _, size in batch)
+            self.unresolved.difference_update(future for _, future, _, _ in batch)
+            self.condition.notify_all()
+        for _, future, _, _ in batch:
+            if error is None:
+                future.set_result(commit_id)
+            else:
+                future.set_exception(error)
+
+    @contextmanager
+    def producing(self):
+        """
+        Mark the current thread as one that may add files while the context is active, e.g. a running task. Group
+        flushes wait for these threads, so the files of concurrent tasks share a commit.
+        """
+        thread_id = threading.get_ident()
+        with self.condition:
+            self.producers[thread_id] = self.producers.get(thread_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.producers[thread_id] -= 1
+                if not self.producers[thread_id]:
+                    del self.producers[thread_id]
+                self.condition.notify_all()
+
+    def flush(self, futures: List[Future] = None, group: bool = False) -> None:
+        """
+        Commit the pending files now and wait until the given files are committed. Failed commits don't raise,
+        their exceptions are set on the futures.
+
+        Args:
+            futures (list): Futures returned by add. Defaults to every file added before the call.
+            group (bool): Commit the pending files once no thread is inside producing, instead of now, so the
+            files of other running tasks are committed together with them. The usual triggers (max_files,
+            max_bytes, max_delay) still apply. Defaults to False.
+        """
+        with self.condition:
+            # a producer that flushes can't add files meanwhile
+            producer = threading.get_ident() in self.producers
+            if futures is None:
+                futures = list(self.unresolved)
+            if group:
+                self.waiting += 1
+                self.waiting_producers += producer
+            else:
+                self.flushing += 1
+            self.condition.notify_all()
+        try:
+            wait(futures)
+        finally:
+            with self.condition:
+                if group:
+                    self.waiting -= 1
+                    self.waiting_producers -= producer
+                else:
+                    self.flushing -= 1
+
+    def close(self) -> None:
+        """
+        Commit the pending files, wait for every commit and stop the threads. Files can't be added after the
+        buffer is closed.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.pid == os.getpid():
+            self.thread.join()
+            self.executor.shutdown(wait=True)
+
+
+class ReapingConnectionPool(BlockingConnectionPool):
+    """
+    Thread-safe Redis connection pool that blocks while all of its connections are in use and closes
+    connections that have been idle for longer than idle_timeout seconds, so long-running processes don't
+    hold on to connection slots of the Redis server.
+    """
+
+    def __init__(self, idle_timeout: float = 300, **kwargs) -> None:
+        """
+        Args:
+            idle_timeout (float): Seconds a free connection is kept open. Defaults to 300.
+            kwargs: kwargs that can be passed into redis.BlockingConnectionPool.
+        """
+        self.idle_timeout = idle_timeout
+        self.last_reap = time.monotonic()
+        super().__init__(**kwargs)
+
+    def release(self, connection) -> None:
+        connection.last_released = time.monotonic()
+        super().release(connection)
+        if self.idle_timeout and time.monotonic() - self.last_reap >= self.idle_timeout:
+            self.reap_idle_connections()
+
+    def reap_idle_connections(self) -> int:
+        """
+        Disconnect the free connections that have been idle for longer than idle_timeout. The connections
+        stay in the pool and reconnect the next time they are used.
+
+        Returns:
+            int: The number of connections that were closed.
+        """
+        now = self.last_reap = time.monotonic()
+        reaped = 0
+        # holding the queue lock keeps other threads from taking a connection while it is closed
+        with self.pool.mutex:
+            for connection in self.pool.queue:
+                if connection is None:
+                    continue
+                if now - getattr(connection, "last_released", now) >= self.idle_timeout:
+                    connection.disconnect()
+                    reaped += 1
+        return reaped
+
+
+class TaskBatch:
+    """
+    Lightweight handle for a batch of tasks submitted with Distributask.execute_many. Only the task IDs are
+    kept in memory, AsyncResult objects are created on demand when the batch is iterated or indexed.
+    """
+
+    def __init__(
+        self, app: Celery, task_ids: List[str] = None, result_loader: callable = None
+    ) -> None:
+        """
+        Args:
+            app (Celery): The Celery app the tasks were submitted to.
+            task_ids (List[str]): IDs of the submitted tasks. Defaults to an empty list.
+            result_loader (callable): Applied to each result returned by results, used to resolve offloaded
+            results. Defaults to None.
+        """
+        self.app = app
+        self.task_ids = task_ids if task_ids is not None else []
+        self.result_loader = result_loader
+
+    def __len__(self) -> int:
+        return len(self.task_ids)
+
+    def __iter__(self):
+        for task_id in self.task_ids:
+            yield AsyncResult(task_id, app=self.app)
+
+    def __getitem__(self, index: int) -> AsyncResult:
+        return AsyncResult(self.task_ids[index], app=self.app)
+
+    def results(self, timeout: float = None) -> List:
+        """
+        Wait for every task in the batch and return their results in submission order.
+
+        Args:
+            timeout (float): Seconds to wait for each task. Defaults to None (wait forever).
+
+        Returns:
+            List: The results of the tasks.
+        """
+        results = [task.get(timeout=timeout) for task in self]
+        if self.result_loader is not None:
+            results = [self.result_loader(result) for result in results]
+        return results
+
+
+class ChunkedBatch(TaskBatch):
+    """
+    Handle for calls submitted with Distributask.execute_chunked. Each Celery task runs a chunk of calls, task_ids
+    holds the IDs of these tasks and iterating or indexing the batch yields a ChunkItemResult per call.
+    """
+
+    def __init__(
+        self,
+        app: Celery,
+        task_ids: List[str] = None,
+        chunk_lengths: List[int] = None,
+        result_loader: callable = None,
+    ) -> None:
+        """
+        Args:
+            app (Celery): The Celery app the tasks were submitted to.
+            task_ids (List[str]): IDs of the submitted chunk tasks. Defaults to an empty list.
+            chunk_lengths (List[int]): Number of calls in each chunk task. Defaults to an empty list.
+            result_loader (callable): Applied to the result of each chunk task, used to resolve offloaded
+            results. Defaults to None.
+        """
+        super().__init__(app, task_ids, result_loader)
+        self.chunk_lengths = chunk_lengths if chunk_lengths is not None else []
+        # unpacked results of finished chunk tasks, by task ID
+        self.outcomes = {}
+
+    def __len__(self) -> int:
+        return sum(self.chunk_lengths)
+
+    def __iter__(self):
+        for task_id, length in zip(self.task_ids, self.chunk_lengths):
+            chunk = AsyncResult(task_id, app=self.app)
+            for index in range(length):
+                yield ChunkItemResult(chunk, index, self)
+
+    def __getitem__(self, index: int) -> "ChunkItemResult":
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ChunkedBatch index out of range")
+        for task_id, length in zip(self.task_ids, self.chunk_lengths):
+            if index < length:
+                return ChunkItemResult(AsyncResult(task_id, app=self.app), index, self)
+            index -= length
+
+    def get_outcomes(self, chunk: AsyncResult, timeout: float = None) -> List[tuple]:
+        """
+        Wait for a chunk task and split its result into the outcomes of its calls.
+
+        Args:
+            chunk (AsyncResult): The chunk task.
+            timeout (float): Seconds to wait. Defaults to None (wait forever).
+
+        Returns:
+            List[tuple]: (succeeded, value) for every call, value is the exception raised by failed calls.
+        """
+        if chunk.id in self.outcomes:
+            return self.outcomes[chunk.id]
+
+        result = chunk.get(timeout=timeout)
+        if self.result_loader is not None:
+            result = self.result_loader(result)
+        self.outcomes[chunk.id] = [
+            (
+                (True, value)
+                if status == states.SUCCESS
+                else (False, self.app.backend.exception_to_python(value))
+            )
+            for status, value in result
+        ]
+        return self.outcomes[chunk.id]
+
+    def results(self, timeout: float = None) -> List:
+        """
+        Wait for every call in the batch and return their results in submission order. The chunk tasks are
+        fetched once each.
+
+        Args:
+            timeout (float): Seconds to wait for each chunk task. Defaults to None (wait forever).
+
+        Returns:
+            List: The results of the calls.
+
+        Raises:
+            Exception: The exception raised by the first call that failed.
+        """
+        results = []
+        for task_id in self.task_ids:
+            chunk = AsyncResult(task_id, app=self.app)
+            for succeeded, value in self.get_outcomes(chunk, timeout):
+                if not succeeded:
+                    raise value
+                results.append(value)
+        return results
+
+
+class ChunkItemResult:
+    """
+    Result of one call in a chunk task, with the parts of the AsyncResult interface that make sense for a
+    single call.
+    """
+
+    def __init__(self, chunk: AsyncResult, index: int, batch: ChunkedBatch) -> None:
+        """
+        Args:
+            chunk (AsyncResult): The chunk task that runs the call.
+            index (int): Position of the call in the chunk.
+            batch (ChunkedBatch): The batch the chunk belongs to, which unpacks its result.
+        """
+        self.chunk = chunk
+        self.index = index
+        self.batch = batch
+
+    @property
+    def id(self) -> str:
+        return f"{self.chunk.id}:{self.index}"
+
+    def ready(self) -> bool:
+        return self.chunk.ready()
+
+    def successful(self) -> bool:
+        return self.chunk.successful() and self.get_outcome()[0]
+
+    def failed(self) -> bool:
+        return self.chunk.failed() or (self.chunk.ready() and not self.get_outcome()[0])
+
+    def get_outcome(self, timeout: float = None) -> tuple:
+        """
+        Wait for the chunk task and return the outcome of this call.
+
+        Args:
+            timeout (float): Seconds to wait. Defaults to None (wait forever).
+
+        Returns:
+            tuple: (succeeded, value), value is the exception raised by the call if it failed.
+        """
+        return self.batch.get_outcomes(self.chunk, timeout)[self.index]
+
+    def get(self, timeout: float = None) -> any:
+        """
+        Wait for the call and return its result.
+
+        Args:
+            timeout (float): Seconds to wait. Defaults to None (wait forever).
+
+        Returns:
+            any: The result of the call.
+
+        Raises:
+            Exception: The exception raised by the call.
+        """
+        succeeded, value = self.get_outcome(timeout)
+        if not succeeded:
+            raise value
+        return value
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter. Tokens are added at a fixed rate up to capacity, and every call to
+    acquire takes one token, blocking until one is available. Used to keep concurrent Vast.ai API calls within
+    the API rate limit.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (int): Maximum number of tokens, i.e. the largest burst of calls. Defaults to 1.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the number of seconds until one is available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        """
+        Take one token, waiting until one is available.
+        """
+        while True:
+            wait_time = self.reserve()
+            if not wait_time:
+                return
+            time.sleep(wait_time)
+
+    async def acquire_async(self) -> None:
+        """
+        Take one token, waiting until one is available without blocking the event loop.
+        """
+        while True:
+            wait_time = self.reserve()
+            if not wait_time:
+                return
+            await asyncio.sleep(wait_time)
+
+
+class VastRetry(Retry):
+    """
+    Retry policy of the Vast.ai API clients, applied by Distributask.vast_request and
+    AsyncDistributask.vast_request so that every attempt goes through the rate limiter. Requests that were rate
+    limited (429) or failed with a server error are retried with exponential backoff, honouring Retry-After in
+    seconds or as an HTTP date. PUT requests create instances, so they are only retried when they were rate
+    limited or couldn't connect, which means they weren't processed. GET and DELETE requests are also retried
+    after a timeout or a dropped connection.
+    """
+
+    def is_retry(
+        self, method: str, status_code: int, has_retry_after: bool = False
+    ) -> bool:
+        if method == "PUT":
+            return status_code == 429 and bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def is_retryable_error(self, method: str, connect: bool) -> bool:
+        """
+        Whether a request that failed without a response can be retried.
+
+        Args:
+            method (str): The HTTP method.
+            connect (bool): True if no connection could be made, so the request wasn't sent.
+
+        Returns:
+            bool: True if the request can be retried.
+        """
+        return bool(self.total) and (connect or method.upper() in self.allowed_methods)
+
+    def get_wait_time(self, attempt: int, retry_after: str = None) -> float:
+        """
+        Seconds to wait before retrying a failed attempt.
+
+        Args:
+            attempt (int): Number of the attempt that failed, starting at 0.
+            retry_after (str): The Retry-After header of the response, if any. Defaults to None.
+
+        Returns:
+            float: Retry-After if it is valid, otherwise backoff_factor * 2^attempt.
+        """
+        if retry_after:
+            try:
+                return self.parse_retry_after(retry_after)
+            except InvalidHeader:
+                pass
+        return self.backoff_factor * 2**attempt
+
+
+class OfferScorer:
+    """
+    Base class for ranking Vast.ai offers in Distributask.rent_nodes. Subclasses implement score, higher scores
+    are rented first.
+    """
+
+    def score(self, offer: Dict) -> float:
+        """
+        Args:
+            offer (Dict): An offer returned by Distributask.search_offers.
+
+        Returns:
+            float: The score of the offer.
+        """
+        raise NotImplementedError
+
+    def rank(self, offers: List[Dict]) -> List[Dict]:
+        """
+        Args:
+            offers (List[Dict]): Offers returned by Distributask.search_offers.
+
+        Returns:
+            List[Dict]: The offers, highest score first.
+        """
+        return sorted(offers, key=self.score, reverse=True)
+
+
+class PriceScorer(OfferScorer):
+    """
+    Ranks offers by price, cheapest first.
+    """
+
+    def score(self, offer: Dict) -> float:
+        return -offer["dph_total"]
+
+
+class ThroughputPerDollarScorer(OfferScorer):
+    """
+    Ranks offers by expected tasks per dollar. The task rate of a GPU model is taken from measured task durations
+    when available. Other GPU models are estimated from their total_flops, calibrated against the measured models
+    when there are any. The rate is scaled by the reliability of the host and by its download bandwidth when that
+    is below min_bandwidth.
+    """
+
+    def __init__(
+        self, gpu_durations: Dict[str, float] = None, min_bandwidth: float = 100
+    ) -> None:
+        """
+        Args:
+            gpu_durations (Dict[str, float]): Average task duration in seconds per GPU model, as returned by
+            Distributask.get_gpu_durations. Defaults to None.
+            min_bandwidth (float): Download bandwidth in Mbps below which offers are penalized. Defaults to 100.
+        """
+        self.gpu_durations = gpu_durations or {}
+        self.min_bandwidth = min_bandwidth
+        self.flops_seconds = None
+
+    def rank(self, offers: List[Dict]) -> List[Dict]:
+        # the duration of a task is assumed to be inversely proportional to total_flops
+        calibration = [
+            self.gpu_durations[offer["gpu_name"]] * offer["total_flops"]
+            for offer in offers
+            if offer.get("gpu_name") in self.gpu_durations and offer.get("total_flops")
+        ]
+        self.flops_seconds = (
+            sum(calibration) / len(calibration) if calibration else None
+        )
+        return super().rank(offers)
+
+    def get_task_rate(self, offer: Dict) -> float:
+        """
+        Args:
+            offer (Dict): An offer returned by Distributask.search_offers.
+
+        Returns:
+            float: The expected number of tasks per second on the offer, or its total_flops when no task durations
+            have been measured.
+        """
+        duration = self.gpu_durations.get(offer.get("gpu_name"))
+        if duration:
+            return 1 / duration
+        flops = offer.get("total_flops") or 0
+        if self.flops_seconds:
+            return flops / self.flops_seconds
+        return flops
+
+    def score(self, offer: Dict) -> float:
+        rate = self.get_task_rate(offer)
+        reliability = offer.get("reliability2", offer.get("reliability", 1)) or 0
+        bandwidth = offer.get("inet_down")
+        if bandwidth is not None and self.min_bandwidth:
+            rate *= min(1, bandwidth / self.min_bandwidth)
+        return rate * reliability / max(offer["dph_total"], 1e-6)
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms, rendered in the Prometheus text exposition format. Updating a metric only
+    takes a lock, so it can be done for every task.
+    """
+
+    METRICS = {
+        "distributask_tasks_submitted_total": (
+            "counter",
+            "Tasks published by this process.",
+        ),
+        "distributask_tasks_succeeded_total": (
+            "counter",
+            "Tasks that succeeded in this process.",
+        ),
+        "distributask_tasks_failed_total": (
+            "counter",
+            "Tasks that failed in this process.",
+        ),
+        "distributask_tasks_retried_total": (
+            "counter",
+            "Task retries scheduled by this process.",
+        ),
+        "distributask_tasks_skipped_total": (
+            "counter",
+            "Tasks skipped by this process because their outputs exist.",
+        ),
+        "distributask_task_duration_seconds": (
+            "histogram",
+            "Execution time of registered functions in this process.",
+        ),
+    }
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, labels: Dict = None, value: float = 1) -> None:
+        """
+        Args:
+            name (str): The name of a counter in METRICS.
+            labels (Dict): Label names and values. Defaults to None.
+            value (float): Amount to add. Defaults to 1.
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict, value: float) -> None:
+        """
+        Args:
+            name (str): The name of a histogram in METRICS.
+            labels (Dict): Label names and values.
+            value (float): The observed value.
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.BUCKETS), 0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def format_labels(labels) -> str:
+        if not labels:
+            return ""
+        escaped = [
+            (
+                key,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for key, value in labels
+        ]
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    def render(self, gauges: Dict = None) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Args:
+            gauges (Dict): Gauges collected at scrape time, as {name: (help, {labels tuple: value})}.
+            Defaults to None.
+
+        Returns:
+            str: The metrics.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (list(buckets), total, count)
+                for key, (buckets, total, count) in self.histograms.items()
+            }
+
+        lines = []
+        for name, (metric_type, description) in self.METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                for (key_name, labels), value in counters.items():
+                    if key_name == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {value}")
+                continue
+            for (key_name, labels), (buckets, total, count) in histograms.items():
+                if key_name != name:
+                    continue
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    bucket_labels = labels + (("le", str(bound)),)
+                    lines.append(
+                        f"{name}_bucket{self.format_labels(bucket_labels)} {bucket_count}"
+                    )
+                lines.append(
+                    f"{name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {count}"
+                )
+                lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+
+        for name, (description, values) in (gauges or {}).items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values.items():
+                lines.append(f"{name}{self.format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Distributask:
+    """
+    The Distributask class contains the core features of distributask, including creating and
+    executing the task queue, managing workers using the Vast.ai API, and uploading files and directories
+    using the Hugging Face API.
+    """
+
+    app: Celery = None
+    redis_client: Redis = None
+    registered_functions: dict = {}
+    function_options: dict = {}
+    pool: ConnectionPool = None
+    blob_store: BlobStore = None
+    upload_buffer: UploadBuffer = None
+
+    def __init__(
+        self,
+        hf_repo_id=os.getenv("HF_REPO_ID"),
+        hf_token=os.getenv("HF_TOKEN"),
+        vast_api_key=os.getenv("VAST_API_KEY"),
+        redis_host=os.getenv("REDIS_HOST", "localhost"),
+        redis_password=os.getenv("REDIS_PASSWORD", ""),
+        redis_port=os.getenv("REDIS_PORT", 6379),
+        redis_username=os.getenv("REDIS_USER", "default"),
+        broker_pool_limit=os.getenv("BROKER_POOL_LIMIT", 1),
+        redis_pool_size=os.getenv("REDIS_POOL_SIZE", 10),
+        redis_pool_timeout=os.getenv("REDIS_POOL_TIMEOUT", 20),
+        redis_health_check_interval=os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30),
+        redis_idle_timeout=os.getenv("REDIS_IDLE_TIMEOUT", 300),
+        task_serializer=os.getenv("TASK_SERIALIZER", "json"),
+        payload_offload_threshold=os.getenv("PAYLOAD_OFFLOAD_THRESHOLD", 262144),
+        blob_store_path=os.getenv("BLOB_STORE_PATH"),
+        blob_store: BlobStore = None,
+        dedup_ttl=os.getenv("DEDUP_TTL", 86400),
+        vast_api_url=os.getenv("VAST_API_URL", "https://console.vast.ai/api/v0"),
+        vast_api_rate=os.getenv("VAST_API_RATE", 2),
+        vast_api_burst=os.getenv("VAST_API_BURST", 5),
+        vast_api_timeout=os.getenv("VAST_API_TIMEOUT", 30),
+        vast_api_retries=os.getenv("VAST_API_RETRIES", 3),
+        vast_api_backoff=os.getenv("VAST_API_BACKOFF", 0.5),
+        offer_cache_ttl=os.getenv("OFFER_CACHE_TTL", 30),
+        offer_scorer: OfferScorer = None,
+        telemetry=os.getenv("TELEMETRY", False),
+        telemetry_max_len=os.getenv("TELEMETRY_MAX_LEN", 100000),
+        metrics_port=os.getenv("METRICS_PORT"),
+        dead_letter_max_len=os.getenv("DEAD_LETTER_MAX_LEN", 10000),
+        upload_batch_files=os.getenv("UPLOAD_BATCH_FILES", 100),
+        upload_batch_bytes=os.getenv("UPLOAD_BATCH_BYTES", 67108864),
+        upload_batch_delay=os.getenv("UPLOAD_BATCH_DELAY", 10),
+        upload_queue_bytes=os.getenv("UPLOAD_QUEUE_BYTES", 268435456),
+        upload_memory_bytes=os.getenv("UPLOAD_MEMORY_BYTES", 8388608),
+        upload_threads=os.getenv("UPLOAD_THREADS", 4),
+        upload_retries=os.getenv("UPLOAD_RETRIES", 3),
+        upload_backoff=os.getenv("UPLOAD_BACKOFF", 1),
+        upload_wait=os.getenv("UPLOAD_WAIT", False),
+        repo_index_ttl=os.getenv("REPO_INDEX_TTL", 60),
+        commit_backend: CommitBackend = None,
+    ) -> None:
+        """
+        Initialize the Distributask object with the provided configuration parameters. Also sets some
+        default settings in Celery and handles cleanup of Celery queue and Redis server on exit.
+
+        Args:
+            hf_repo_id (str): Hugging Face repository ID.
+            hf_token (str): Hugging Face API token.
+            vast_api_key (str): Vast.ai API key.
+            redis_host (str): Redis host. Defaults to "localhost".
+            redis_password (str): Redis password. Defaults to an empty string.
+            redis_port (int): Redis port. Defaults to 6379.
+            redis_username (str): Redis username. Defaults to "default".
+            broker_pool_limit (int): Celery broker pool limit. Defaults to 1.
+            redis_pool_size (int): Maximum number of connections in each Redis connection pool. Defaults to 10.
+            redis_pool_timeout (float): Seconds to wait for a free connection in the pool. Defaults to 20.
+            redis_health_check_interval (int): Seconds a connection can be idle before it is checked with a
+            PING. Defaults to 30.
+            redis_idle_timeout (float): Seconds after which idle pooled connections are closed. Defaults to 300.
+            task_serializer (str): Serializer for task arguments and results, one of "json", "msgpack", "pickle"
+            or "pickle5". Pickle based serializers must only be used when every client is trusted. Defaults to "json".
+            payload_offload_threshold (int): Task arguments and results larger than this many bytes are written
+            to the blob store and sent by reference. Defaults to 262144 (256 KB).
+            blob_store_path (str): Directory of a LocalBlobStore used to offload large payloads. Defaults to None.
+            blob_store (BlobStore): Blob store used to offload large payloads, takes priority over
+            blob_store_path. Payloads are only offloaded when a blob store is configured. Defaults to None.
+            dedup_ttl (int): Seconds a deduplication key passed to execute_function is kept. Defaults to 86400.
+            vast_api_url (str): Base URL of the Vast.ai API. Defaults to "https://console.vast.ai/api/v0".
+            vast_api_rate (float): Vast.ai API calls allowed per second. Defaults to 2.
+            vast_api_burst (int): Vast.ai API calls allowed in a burst before vast_api_rate applies. Defaults to 5.
+            vast_api_timeout (float): Seconds to wait for a Vast.ai API response. Defaults to 30.
+            vast_api_retries (int): Number of times a Vast.ai API call is retried after a connection error, a
+            timeout, a rate limit (429) or a server error, see VastRetry. Defaults to 3.
+            vast_api_backoff (float): Backoff factor of the retries, the n-th retry waits vast_api_backoff * 2^(n-1)
+            seconds unless the API sends Retry-After. Defaults to 0.5.
+            offer_cache_ttl (float): Seconds search_offers results are cached. Defaults to 30.
+            offer_scorer (OfferScorer): Ranks the offers tried by rent_nodes. Defaults to a
+            ThroughputPerDollarScorer using the measured task durations.
+            telemetry (bool): Record the queue wait, execution time, payload sizes, node and outcome of every
+            task, with one Redis XADD per task. Needed by get_task_stats and Speculator. Defaults to False.
+            telemetry_max_len (int): Approximate number of tasks kept in the telemetry stream. Defaults to 100000.
+            metrics_port (int): If set, every worker process serves Prometheus metrics on this port plus the index
+            of the process. Use start_metrics_server to serve them from the driver process. Defaults to None.
+            dead_letter_max_len (int): Number of failed tasks kept in the dead-letter list, the oldest are dropped
+            first. Defaults to 10000.
+            upload_batch_files (int): Maximum number of files upload_file puts in one commit. Defaults to 100.
+            upload_batch_bytes (int): Number of bytes buffered by upload_file that triggers a commit. Defaults to
+            67108864 (64 MB).
+            upload_batch_delay (float): Seconds a file passed to upload_file waits for other files before it is
+            committed. Defaults to 10.
+            upload_queue_bytes (int): Number of bytes buffered or being committed above which upload_file blocks
+            until commits finish. Defaults to 268435456 (256 MB).
+            upload_memory_bytes (int): Files up to this size are read into memory by upload_file, larger files are
+            committed from their path. Defaults to 8388608 (8 MB).
+            upload_threads (int): Number of commits made at the same time by each process. Defaults to 4.
+            upload_retries (int): Number of times a commit is retried after a connection error, a rate limit (429)
+            or a server error. Defaults to 3.
+            upload_backoff (float): Backoff factor of the commit retries, in seconds. Defaults to 1.
+            upload_wait (bool): Tasks wait until the files they uploaded with upload_file(wait=False) are committed
+            before they return, so a task is only acknowledged once its outputs are stored. Only tasks running at
+            the same time in one process share a commit then (see wait_for_uploads), so a prefork worker makes one
+            commit per task. If False, tasks return as soon as the function returns and the files of consecutive
+            tasks are committed together in the background; the buffer is committed when the worker process
+            exits, files still buffered are lost if the worker is killed. Defaults to False.
+            repo_index_ttl (float): Seconds the repository index is used before the latest commit of the
+            repository is checked again. Defaults to 60.
+            commit_backend (CommitBackend): Backend upload_file commits with. Defaults to a HfCommitBackend for
+            the dataset repository.
+
+        Raises:
+            ValueError: If any of the required parameters (hf_repo_id, hf_token, vast_api_key) are not provided,
+            or if the task serializer is not available.
+        """
+        if hf_repo_id is None:
+            raise ValueError(
+                "HF_REPO_ID is not provided to the Distributask constructor"
+            )
+
+        if hf_token is None:
+            raise ValueError("HF_TOKEN is not provided to the Distributask constructor")
+
+        if vast_api_key is None:
+            raise ValueError(
+                "VAST_API_KEY is not provided to the Distributask constructor"
+            )
+
+        try:
+            serialize(None, serializer=task_serializer)
+        except SerializerNotInstalled as e:
+            raise ValueError(
+                f"Task serializer '{task_serializer}' is not available: {e}"
+            )
+
+        if redis_host == "localhost":
+            print(
+                "WARNING: Using default Redis host 'localhost'. This is not recommended for production use and won't work for distributed rendering."
+            )
+
+        self.settings = {
+            "HF_REPO_ID": hf_repo_id,
+            "HF_TOKEN": hf_token,
+            "VAST_API_KEY": vast_api_key,
+            "REDIS_HOST": redis_host,
+            "REDIS_PASSWORD": redis_password,
+            "REDIS_PORT": redis_port,
+            "REDIS_USER": redis_username,
+            "BROKER_POOL_LIMIT": broker_pool_limit,
+            "REDIS_POOL_SIZE": redis_pool_size,
+            "REDIS_POOL_TIMEOUT": redis_pool_timeout,
+            "REDIS_HEALTH_CHECK_INTERVAL": redis_health_check_interval,
+            "REDIS_IDLE_TIMEOUT": redis_idle_timeout,
+            "TASK_SERIALIZER": task_serializer,
+            "PAYLOAD_OFFLOAD_THRESHOLD": payload_offload_threshold,
+            "BLOB_STORE_PATH": blob_store_path,
+            "DEDUP_TTL": dedup_ttl,
+            "VAST_API_URL": vast_api_url,
+            "VAST_API_RATE": vast_api_rate,
+            "VAST_API_BURST": vast_api_burst,
+            "VAST_API_TIMEOUT": vast_api_timeout,
+            "VAST_API_RETRIES": vast_api_retries,
+            "VAST_API_BACKOFF": vast_api_backoff,
+            "OFFER_CACHE_TTL": offer_cache_ttl,
+            "TELEMETRY": str(telemetry).lower() not in ("0", "false", "no"),
+            "TELEMETRY_MAX_LEN": telemetry_max_len,
+            "METRICS_PORT": metrics_port,
+            "DEAD_LETTER_MAX_LEN": dead_letter_max_len,
+            "UPLOAD_BATCH_FILES": upload_batch_files,
+            "UPLOAD_BATCH_BYTES": upload_batch_bytes,
+            "UPLOAD_BATCH_DELAY": upload_batch_delay,
+            "UPLOAD_QUEUE_BYTES": upload_queue_bytes,
+            "UPLOAD_MEMORY_BYTES": upload_memory_bytes,
+            "UPLOAD_THREADS": upload_threads,
+            "UPLOAD_RETRIES": upload_retries,
+            "UPLOAD_BACKOFF": upload_backoff,
+            "UPLOAD_WAIT": str(upload_wait).lower() not in ("0", "false", "no"),
+            "REPO_INDEX_TTL": repo_index_ttl,
+        }
+        self.metrics = MetricsRegistry()
+        self.rented_nodes = {}
+        self.offer_scorer = offer_scorer
+        self.offer_cache = {}
+
+        # shared by every thread that calls the Vast.ai API
+        self.vast_rate_limiter = TokenBucket(float(vast_api_rate), int(vast_api_burst))
+        self.vast_session = None
+
+        if blob_store is None and blob_store_path:
+            blob_store = LocalBlobStore(blob_store_path)
+        self.blob_store = blob_store
+
+        if commit_backend is None:
+            commit_backend = HfCommitBackend(hf_repo_id, hf_token)
+        self.commit_backend = commit_backend
+        # files uploaded by the task running in the current thread, see track_uploads
+        self.task_uploads = threading.local()
+
+        redis_url = self.get_redis_url()
+        # start Celery app instance
+        self.app = Celery("distributask", broker=redis_url, backend=redis_url)
+        self.app.conf.broker_pool_limit = self.settings["BROKER_POOL_LIMIT"]
+
+        # arguments and results are encoded once, by Celery, with the configured serializer
+        self.app.conf.task_serializer = task_serializer
+        self.app.conf.result_serializer = task_serializer
+        self.app.conf.accept_content = ["json", task_serializer]
+        self.app.conf.result_accept_content = ["json", task_serializer]
+
+        # size the broker and result backend pools like the shared Redis pool
+        pool_size = int(self.settings["REDIS_POOL_SIZE"])
+        health_check_interval = int(self.settings["REDIS_HEALTH_CHECK_INTERVAL"])
+        self.app.conf.broker_transport_options = {
+            "max_connections": pool_size,
+            "health_check_interval": health_check_interval,
+            "socket_keepalive": True,
+            # one sub-queue per priority, 0 is the highest priority and the default
+            "priority_steps": list(range(10)),
+        }
+        self.app.conf.redis_max_connections = pool_size
+        self.app.conf.redis_backend_health_check_interval = health_check_interval
+        self.app.conf.redis_socket_keepalive = True
+
+        def cleanup_redis():
+            """
+            Deletes keys in redis related to Celery tasks and closes the Redis connection on exit
+            """
+            self.cleanup_payloads()
+            patterns = ["celery-task*", "task_status*", "distributask-dedup*"]
+            redis_connection = self.get_redis_connection()
+            for pattern in patterns:
+                for key in redis_connection.scan_iter(match=pattern):
+                    redis_connection.delete(key)
+            print("Redis server cleared")
+
+        def cleanup_celery():
+            """
+            Clears Celery task queue on exit
+            """
+            self.app.control.purge()
+            print("Celery queue cleared")
+
+        # At exit, close Celery instance, delete all previous task info from queue and Redis, and close Redis
+        atexit.register(self.app.close)
+        atexit.register(cleanup_redis)
+        atexit.register(cleanup_celery)
+
+        self.redis_client = self.get_redis_connection()
+
+        if metrics_port:
+            # worker processes are forked from the main worker process, each one serves its own metrics
+            def start_worker_metrics_server(**kwargs):
+                from billiard.process import current_process
+
+                index = getattr(current_process(), "index", 0) or 0
+                self.start_metrics_server(int(metrics_port) + index)
+
+            worker_process_init.connect(start_worker_metrics_server, weak=False)
+
+        # commit buffered uploads at exit, worker processes exit without running atexit handlers
+        def close_worker_upload_buffer(**kwargs):
+            self.close_upload_buffer()
+
+        atexit.register(self.close_upload_buffer)
+        worker_process_shutdown.connect(close_worker_upload_buffer, weak=False)
+
+        # Tasks are acknowledged after they have been executed
+        self.app.conf.task_acks_late = True
+        self.call_function_task = self.app.task(
+            bind=True, name="call_function_task", max_retries=3, default_retry_delay=30
+        )(self.call_function_task)
+        self.call_function_chunk_task = self.app.task(
+            bind=True, name="call_function_chunk_task"
+        )(self.call_function_chunk_task)
+
+    def __del__(self):
+        """Destructor to clean up resources."""
+        if self.pool is not None:
+            self.pool.disconnect()
+        if self.redis_client is not None:
+            self.redis_client.close()
+        if self.app is not None:
+            self.app.close()
+
+    def log(self, message: str, level: str = "info") -> None:
+        """
+        Log a message with the specified level.
+
+        Args:
+            message (str): The message to log.
+            level (str): The logging level. Defaults to "info".
+        """
+        logger = get_task_logger(__name__)
+        getattr(logger, level)(message)
+
+    def get_settings(self) -> str:
+        """
+        Return settings of distributask instance.
+        """
+        return self.settings
+
+    def get_redis_url(self) -> str:
+        """
+        Construct a Redis URL from the configuration settings.
+
+        Returns:
+            str: A Redis URL string.
+
+        Raises:
+            ValueError: If any required Redis connection parameter is missing.
+        """
+        host = self.settings["REDIS_HOST"]
+        password = self.settings["REDIS_PASSWORD"]
+        port = self.settings["REDIS_PORT"]
+        username = self.settings["REDIS_USER"]
+
+        if None in [host, password, port, username]:
+            raise ValueError("Missing required Redis configuration values")
+
+        redis_url = f"redis://{username}:{password}@{host}:{port}"
+        return redis_url
+
+    def get_redis_connection(self, force_new: bool = False) -> Redis:
+        """
+        Returns Redis connection. If it already exists, returns current connection.
+        If it does not exist, its create a new Redis connection using the shared connection pool.
+
+        The pool is created once per Distributask instance and is safe to use from multiple threads. Its size,
+        health checks and idle timeout are configured with the REDIS_POOL_SIZE, REDIS_POOL_TIMEOUT,
+        REDIS_HEALTH_CHECK_INTERVAL and REDIS_IDLE_TIMEOUT settings.
+
+        Args:
+            force_new (bool): Force the creation of a new client on the shared pool if set to True. Defaults to False.
+
+        Returns:
+            Redis: A Redis connection object.
+        """
+        if self.pool is None:
+            self.pool = ReapingConnectionPool(
+                host=self.settings["REDIS_HOST"],
+                port=self.settings["REDIS_PORT"],
+                password=self.settings["REDIS_PASSWORD"],
+                max_connections=int(self.settings["REDIS_POOL_SIZE"]),
+                timeout=float(self.settings["REDIS_POOL_TIMEOUT"]),
+                health_check_interval=int(self.settings["REDIS_HEALTH_CHECK_INTERVAL"]),
+                socket_keepalive=True,
+                idle_timeout=float(self.settings["REDIS_IDLE_TIMEOUT"]),
+            )
+            atexit.register(self.pool.disconnect)
+
+        if self.redis_client is None or force_new:
+            self.redis_client = Redis(connection_pool=self.pool)
+
+        return self.redis_client
+
+    def get_env(self, key: str, default: any = None) -> any:
+        """
+        Retrieve a value from the configuration or .env file, with an optional default if the key is not found.
+
+        Args:
+            key (str): The key to look for in the settings.
+            default (any): The default value to return if the key is not found. Defaults to None.
+
+        Returns:
+            any: The value from the settings if the key exists, otherwise the default value.
+        """
+        return self.settings.get(key, default)
+
+    def call_function_task(self, func_name: str, args: dict) -> any:
+        """
+        Creates Celery task that executes a registered function with provided arguments.
+
+        Args:
+            func_name (str): The name of the registered function to execute.
+            args (dict): Arguments for the function, decoded by Celery with the configured task serializer.
+            A JSON string is also accepted for messages sent by older clients.
+
+        Returns:
+            any: Celery.app.task object, represents result of the registered function. None if the task was
+            published with outputs that all exist, the function isn't called then.
+
+        Raises:
+            ValueError: If the function name is not registered.
+            celery.exceptions.Retry: If the function raised an exception listed in its retry_on option and
+            retries are left.
+            Exception: If an error occurs during the execution of the function or while committing the files it
+            uploaded, and the task is not retried. The task is added to the dead-letter list.
+        """
+        started_at = time.time()
+        start = time.monotonic()
+        try:
+            if func_name not in self.registered_functions:
+                raise ValueError(f"Function '{func_name}' is not registered.")
+
+            func = self.registered_functions[func_name]
+            if isinstance(args, str):
+                args = json.loads(args)
+            args = self.load_payload(args)
+            # the outputs may have been uploaded since the task was published
+            outputs = self.get_request_header("outputs")
+            if outputs and self.outputs_exist(outputs):
+                self.log(f"Skipping {func_name}, its outputs already exist")
+                self.metrics.inc(
+                    "distributask_tasks_skipped_total", {"function": func_name}
+                )
+                return None
+            start = time.monotonic()
+            with self.track_uploads() as uploads:
+                if self.function_options.get(func_name, {}).get("cache"):
+                    result = self.call_cached_function(func_name, args)
+                else:
+                    result = func(**args)
+            duration = time.monotonic() - start
+            # the task is acknowledged when it returns, its outputs must be stored by then
+            if self.settings["UPLOAD_WAIT"]:
+                self.wait_for_uploads(uploads)
+            self.metrics.inc(
+                "distributask_tasks_succeeded_total", {"function": func_name}
+            )
+            self.metrics.observe(
+                "distributask_task_duration_seconds", {"function": func_name}, duration
+            )
+            # nodes rented by rent_nodes know their GPU model, used to rank offers by measured speed
+            if os.getenv("GPU_NAME"):
+                self.record_gpu_duration(os.getenv("GPU_NAME"), duration)
+            result, result_bytes = self.offload_payload(
+                result, self.call_function_task.request.id
+            )
+            self.record_task_telemetry(
+                func_name, result_bytes, started_at, duration, "success"
+            )
+            # a speculative duplicate also finishes the original task, the backend ignores the result if the
+            # original succeeded first
+            original_id = self.get_request_header("speculative_of")
+            if original_id:
+                self.app.backend.store_result(original_id, result, states.SUCCESS)
+            # self.update_function_status(self.call_function_task.request.id, "success")
+
+            return result
+        except Exception as e:
+            self.log(f"Error in call_function_task: {str(e)}", "error")
+            request = self.call_function_task.request
+            options = self.function_options.get(func_name, {})
+            retries = request.retries or 0
+            if isinstance(e, options.get("retry_on", ())) and retries < options.get(
+                "max_retries", 0
+            ):
+                self.metrics.inc(
+                    "distributask_tasks_retried_total", {"function": func_name}
+                )
+                self.record_task_telemetry(
+                    func_name, 0, started_at, time.monotonic() - start, "retry"
+                )
+                countdown = get_exponential_backoff_interval(
+                    factor=options["retry_backoff"],
+                    retries=retries,
+                    maximum=options["retry_backoff_max"],
+                    full_jitter=options["retry_jitter"],
+                )
+                raise self.call_function_task.retry(
+                    exc=e, countdown=countdown, max_retries=options["max_retries"]
+                )
+
+            self.metrics.inc("distributask_tasks_failed_total", {"function": func_name})
+            self.record_task_telemetry(
+                func_name, 0, started_at, time.monotonic() - start, "failure"
+            )
+            self.add_dead_letter(func_name, args, e, retries)
+            raise
+
+    def call_function_chunk_task(
+        self, func_name: str, args_list: list, threads: int = 1
+    ) -> list:
+        """
+        Creates Celery task that executes a registered function once for every set of arguments in args_list,
+        submitted by execute_chunked. A failed call doesn't fail the other calls of the chunk, its exception is
+        returned in its place and it is added to the dead-letter list. A call also fails if a file it uploaded
+        can't be committed, the files of all calls are committed together before the task returns. Calls are not
+        retried, and they are counted in the Prometheus metrics but not recorded in the telemetry stream.
+
+        Args:
+            func_name (str): The name of the registered function to execute.
+            args_list (list): Arguments for each call, or a blob reference to them.
+            threads (int): Number of calls run at the same time in a thread pool. Defaults to 1.
+
+        Returns:
+            list: [state, value] for every call, where state is "SUCCESS" or "FAILURE" and value is the result or
+            the exception prepared by the result backend. The list is offloaded to the blob store if it is larger
+            than the PAYLOAD_OFFLOAD_THRESHOLD setting.
+
+        Raises:
+            ValueError: If the function name is not registered.
+        """
+        if func_name not in self.registered_functions:
+            raise ValueError(f"Function '{func_name}' is not registered.")
+
+        # the request is thread-local, read it before starting the thread pool
+        task_id = self.call_function_chunk_task.request.id
+        func = self.registered_functions[func_name]
+        cache = self.function_options.get(func_name, {}).get("cache")
+        args_list = self.load_payload(args_list)
+
+        def call(args):
+            start = time.monotonic()
+            with self.track_uploads() as uploads:
+                try:
+                    if cache:
+                        result = self.call_cached_function(func_name, args)
+                    else:
+                        result = func(**args)
+                except Exception as e:
+                    return states.FAILURE, e, 0, uploads
+            return states.SUCCESS, result, time.monotonic() - start, uploads
+
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                calls = list(executor.map(call, args_list))
+        else:
+            calls = [call(args) for args in args_list]
+
+        # the files uploaded by all calls are committed together, before the task is acknowledged
+        futures = [future for *_, uploads in calls for future in uploads]
+        if futures and self.settings["UPLOAD_WAIT"]:
+            self.get_upload_buffer().flush(futures)
+
+        outcomes, durations = [], []
+        for args, (state, result, duration, uploads) in zip(args_list, calls):
+            if state == states.SUCCESS and self.settings["UPLOAD_WAIT"]:
+                errors = [
+                    future.exception() for future in uploads if future.exception()
+                ]
+                if errors:
+                    state, result = states.FAILURE, errors[0]
+            if state == states.FAILURE:
+                self.log(f"Error in call_function_chunk_task: {str(result)}", "error")
+                self.metrics.inc(
+                    "distributask_tasks_failed_total", {"function": func_name}
+                )
+                self.add_dead_letter(func_name, args, result, 0, task_id=task_id)
+                outcomes.append(
+                    [states.FAILURE, self.app.backend.prepare_exception(result)]
+                )
+                continue
+            self.metrics.inc(
+                "distributask_tasks_succeeded_total", {"function": func_name}
+            )
+            self.metrics.observe(
+                "distributask_task_duration_seconds", {"function": func_name}, duration
+            )
+            outcomes.append([states.SUCCESS, result])
+            durations.append(duration)
+
+        if durations:
+            self.record_function_duration(func_name, sum(durations), len(durations))
+        return self.offload_payload(outcomes, task_id)[0]
+
+    def register_function(
+        self,
+        func: callable = None,
+        cache: bool = False,
+        ttl: int = None,
+        cache_max_bytes: int = 1048576,
+        cache_max_entries: int = 10000,
+        retry_on: tuple = (),
+        max_retries: int = 3,
+        retry_backoff: float = 30,
+        retry_backoff_max: float = 600,
+        retry_jitter: bool = True,
+        queue: str = None,
+        priority: int = None,
+    ) -> callable:
+        """
+        Decorator to register a function so that it can be invoked as a Celery task. Can be used as
+        @register_function or with options, as @register_function(cache=True, ttl=3600).
+
+        Failed tasks are retried when the exception is an instance of retry_on. Tasks that fail with another
+        exception, or that still fail after max_retries retries, are added to the dead-letter list, see
+        get_dead_letters and replay_dead_letters.
+
+        Args:
+            func (callable): The function to register.
+            cache (bool): Cache the results of the function in Redis, keyed on the function name and a hash of its
+            arguments. Only use for deterministic functions. Concurrent calls with identical arguments run the
+            function once. Defaults to False.
+            ttl (int): Seconds a cached result is kept. Defaults to None (until evicted).
+            cache_max_bytes (int): Results larger than this many bytes when serialized are not cached.
+            Defaults to 1048576 (1 MB).
+            cache_max_entries (int): Number of cached results kept for the function, the least recently used
+            results are evicted first. Defaults to 10000.
+            retry_on (tuple): Exception types that are retried. Defaults to () (no retries).
+            max_retries (int): Maximum number of retries. Defaults to 3.
+            retry_backoff (float): Seconds before the first retry, doubled for every later retry. Defaults to 30.
+            retry_backoff_max (float): Maximum number of seconds between retries. Defaults to 600.
+            retry_jitter (bool): Pick a random delay up to the backoff, so retries of tasks that failed at the same
+            time are spread out. Defaults to True.
+            queue (str): Queue the function's tasks are sent to, only workers started with this queue in their -Q
+            option execute them. Defaults to None (the default "celery" queue).
+            priority (int): Priority of the function's tasks, from 0 (highest) to 9 (lowest). Defaults to None
+            (0).
+
+        Returns:
+            callable: The original function, now registered as a callable task.
+        """
+        if func is None:
+            return lambda func: self.register_function(
+                func,
+                cache,
+                ttl,
+                cache_max_bytes,
+                cache_max_entries,
+                retry_on,
+                max_retries,
+                retry_backoff,
+                retry_backoff_max,
+                retry_jitter,
+                queue,
+                priority,
+            )
+
+        self.registered_functions[func.__name__] = func
+        self.function_options[func.__name__] = {
+            "cache": cache,
+            "ttl": ttl,
+            "cache_max_bytes": cache_max_bytes,
+            "cache_max_entries": cache_max_entries,
+            "retry_on": tuple(retry_on),
+            "max_retries": max_retries,
+            "retry_backoff": retry_backoff,
+            "retry_backoff_max": retry_backoff_max,
+            "retry_jitter": retry_jitter,
+            "queue": queue,
+            "priority": priority,
+        }
+        return func
+
+    def get_args_hash(self, args: dict) -> str:
+        """
+        Compute a canonical hash of function arguments, independent of key order.
+
+        Values JSON can't represent (e.g. NumPy arrays) are hashed by their full encoding with the configured
+        TASK_SERIALIZER, never by their repr, which large objects truncate.
+
+        Args:
+            args (dict): Arguments of a registered function.
+
+        Returns:
+            str: Hex SHA-256 digest of the arguments.
+
+        Raises:
+            TypeError: If an argument can't be encoded with TASK_SERIALIZER.
+        """
+        serializer = self.settings["TASK_SERIALIZER"]
+
+        def encode(value):
+            try:
+                _, _, data = serialize(value, serializer=serializer)
+            except Exception as e:
+                raise TypeError(
+                    f"Cannot hash argument of type {type(value).__name__} with the {serializer} serializer"
+                ) from e
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            return {
+                "__type__": type(value).__qualname__,
+                "__sha256__": hashlib.sha256(data).hexdigest(),
+            }
+
+        canonical = json.dumps(
+            args, sort_keys=True, separators=(",", ":"), default=encode
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def call_cached_function(
+        self,
+        func_name: str,
+        args: dict,
+        lock_timeout: int = 3600,
+        poll_interval: float = 0.5,
+    ) -> any:
+        """
+        Call a registered function through its result cache. On a cache miss the function runs and its result is
+        stored. If a call with the same arguments is already running on another worker, wait for its result
+        instead of running the function again.
+
+        Args:
+            func_name (str): The name of the registered function.
+            args (dict): Arguments to pass to the function.
+            lock_timeout (int): Seconds after which an in-flight call is presumed lost. Defaults to 3600.
+            poll_interval (float): Seconds between checks for the result of an in-flight call. Defaults to 0.5.
+
+        Returns:
+            any: The result of the function.
+        """
+        redis_client = self.get_redis_connection()
+        args_hash = self.get_args_hash(args)
+        key = f"distributask-cache:{func_name}:{args_hash}"
+        lock_key = f"distributask-cache-lock:{func_name}:{args_hash}"
+
+        while True:
+            hit, result = self.get_cached_result(func_name, args_hash)
+            if hit:
+                return result
+            if redis_client.set(lock_key, 1, nx=True, ex=lock_timeout):
+                break
+            # another worker is computing this result, wait until it is stored or the lock is released
+            while redis_client.exists(lock_key) and not redis_client.exists(key):
+                time.sleep(poll_interval)
+
+        try:
+            result = self.registered_functions[func_name](**args)
+            self.store_cached_result(func_name, args_hash, result)
+        finally:
+            redis_client.delete(lock_key)
+        return result
+
+    def get_cached_result(self, func_name: str, args_hash: str):
+        """
+        Look up a cached result and mark it as recently used.
+
+        Args:
+            func_name (str): The name of the registered function.
+            args_hash (str): Hash of the arguments, see get_args_hash.
+
+        Returns:
+            Tuple[bool, any]: Whether the result was cached, and the cached result.
+        """
+        redis_client = self.get_redis_connection()
+        entry = redis_client.hgetall(f"distributask-cache:{func_name}:{args_hash}")
+        if not entry:
+            return False, None
+
+        redis_client.zadd(
+            f"distributask-cache-index:{func_name}", {args_hash: time.time()}
+        )
+        result = deserialize(
+            entry[b"data"],
+            bytes_to_str(entry[b"content_type"]),
+            bytes_to_str(entry[b"content_encoding"]),
+            accept=prepare_accept_content(self.app.conf.accept_content),
+        )
+        return True, result
+
+    def store_cached_result(self, func_name: str, args_hash: str, result: any) -> bool:
+        """
+        Store a result in the cache of a registered function, then evict expired and least recently used
+        entries beyond the function's cache_max_entries.
+
+        Args:
+            func_name (str): The name of the registered function.
+            args_hash (str): Hash of the arguments, see get_args_hash.
+            result (any): The result to store.
+
+        Returns:
+            bool: True if the result was stored, False if it exceeds cache_max_bytes.
+        """
+        options = self.function_options[func_name]
+        content_type, content_encoding, data = serialize(
+            result, serializer=self.settings["TASK_SERIALIZER"]
+        )
+        if isinstance(data, str):
+            data = data.encode(content_encoding)
+        if len(data) > options["cache_max_bytes"]:
+            return False
+
+        redis_client = self.get_redis_connection()
+        key = f"distributask-cache:{func_name}:{args_hash}"
+        index_key = f"distributask-cache-index:{func_name}"
+        now = time.time()
+        with redis_client.pipeline() as pipe:
+            pipe.hset(
+                key,
+                mapping={
+                    "content_type": content_type,
+                    "content_encoding": content_encoding,
+                    "data": data,
+                },
+            )
+            if options["ttl"]:
+                pipe.expire(key, options["ttl"])
+                pipe.zremrangebyscore(index_key, "-inf", now - options["ttl"])
+            pipe.zadd(index_key, {args_hash: now})
+            pipe.zcard(index_key)
+            size = pipe.execute()[-1]
+
+        excess = size - options["cache_max_entries"]
+        if excess > 0:
+            evicted = redis_client.zpopmin(index_key, excess)
+            redis_client.delete(
+                *[
+                    f"distributask-cache:{func_name}:{bytes_to_str(member)}"
+                    for member, _ in evicted
+                ]
+            )
+        return True
+
+    def clear_cache(self, func_name: str) -> None:
+        """
+        Delete all cached results of a registered function.
+
+        Args:
+            func_name (str): The name of the registered function.
+        """
+        redis_client = self.get_redis_connection()
+        for key in redis_client.scan_iter(match=f"distributask-cache:{func_name}:*"):
+            redis_client.delete(key)
+        redis_client.delete(f"distributask-cache-index:{func_name}")
+
+    def execute_function(
+        self,
+        func_name: str,
+        args: dict,
+        dedup_key=None,
+        queue: str = None,
+        priority: int = None,
+        outputs: List[str] = None,
+    ) -> Celery.AsyncResult:
+        """
+        Execute a registered function as a Celery task with provided arguments.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            dedup_key (str | bool): If set, the task is only published if no task with the same key is queued,
+            running or finished, otherwise the existing task is returned. Pass True to use a hash of func_name
+            and args as the key. Tasks that failed can be submitted again. Defaults to None (no deduplication).
+            queue (str): Queue the task is sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the task, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+            outputs (list): Paths in the dataset repository the task uploads. If they all exist the task isn't
+            published and its result is None, the worker checks them again before it calls the function. Defaults
+            to None.
+
+        Returns:
+            celery.result.AsyncResult: An object representing the asynchronous result of the task.
+        """
+        if outputs and self.outputs_exist(outputs):
+            return self.skip_task(func_name)
+        headers = {"outputs": list(outputs)} if outputs else None
+        if dedup_key is None:
+            return self.send_task(
+                func_name, args, queue=queue, priority=priority, headers=headers
+            )
+
+        task_id = str(uuid4())
+        key = self.get_dedup_key(func_name, args, dedup_key)
+        owner = self.claim_dedup_keys([key], [task_id])[0]
+        if owner != task_id:
+            return AsyncResult(owner, app=self.app)
+        try:
+            async_result = self.send_task(
+                func_name,
+                args,
+                task_id=task_id,
+                queue=queue,
+                priority=priority,
+                headers=headers,
+            )
+        except BaseException:
+            # no task will ever finish under this key, let the next caller publish it
+            self.release_dedup_keys([key], [task_id])
+            raise
+        return async_result
+
+    def execute_many(
+        self,
+        func_name: str,
+        iterable_of_args,
+        chunk_size: int = 500,
+        dedup_key=None,
+        queue: str = None,
+        priority: int = None,
+        outputs: callable = None,
+    ) -> TaskBatch:
+        """
+        Execute a registered function once for every set of arguments in iterable_of_args. Messages are
+        published in chunks over a single producer connection, and the Redis commands of each chunk are sent
+        in one pipeline, so enqueueing costs one broker round trip per chunk instead of one per task.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            iterable_of_args (Iterable[dict]): Arguments for each task. Can be a generator, it is consumed
+            one chunk at a time.
+            chunk_size (int): Number of messages published per pipeline. Defaults to 500.
+            dedup_key (bool | callable): Deduplicate the tasks like execute_function does. Pass True to use a
+            hash of func_name and the arguments as the key, or a callable that returns the key for a set of
+            arguments. The keys of a chunk are claimed in one pipeline. Defaults to None (no deduplication).
+            queue (str): Queue the tasks are sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the tasks, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+            outputs (callable): Returns the paths in the dataset repository a task uploads, for a set of
+            arguments. Tasks whose outputs all exist are skipped like in execute_function, the outputs of a chunk
+            are checked with one Redis command. Defaults to None.
+
+        Returns:
+            TaskBatch: A handle containing the IDs of all submitted tasks. Deduplicated entries refer to the
+            existing task, skipped entries to a task that succeeded with the result None.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        batch = TaskBatch(self.app, result_loader=self.load_payload)
+        iterator = iter(iterable_of_args)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                break
+
+            chunk_outputs = [None] * len(chunk)
+            done = [False] * len(chunk)
+            if outputs is not None:
+                chunk_outputs = [list(outputs(args)) for args in chunk]
+                exist = iter(
+                    self.files_exist(
+                        [path for paths in chunk_outputs for path in paths]
+                    )
+                )
+                done = [
+                    bool(paths) and all([next(exist) for _ in paths])
+                    for paths in chunk_outputs
+                ]
+
+            task_ids = [str(uuid4()) for _ in chunk]
+            owners = list(task_ids)
+            pending = [i for i, is_done in enumerate(done) if not is_done]
+            keys = []
+            if dedup_key is not None and pending:
+                keys = [
+                    self.get_dedup_key(func_name, chunk[i], dedup_key) for i in pending
+                ]
+                claimed = self.claim_dedup_keys(keys, [task_ids[i] for i in pending])
+                for i, owner in zip(pending, claimed):
+                    owners[i] = owner
+
+            try:
+                with self.app.producer_or_acquire() as producer:
+                    with self._pipelined_publish(producer):
+                        for args, task_id, owner, paths, is_done in zip(
+                            chunk, task_ids, owners, chunk_outputs, done
+                        ):
+                            if is_done:
+                                owner = self.skip_task(func_name, task_id).id
+                            elif owner == task_id:
+                                self.send_task(
+                                    func_name,
+                                    args,
+                                    task_id=task_id,
+                                    producer=producer,
+                                    queue=queue,
+                                    priority=priority,
+                                    headers={"outputs": paths} if paths else None,
+                                )
+                            batch.task_ids.append(owner)
+            except BaseException:
+                # the pipeline may not have been sent, release the keys this chunk claimed
+                self.release_dedup_keys(keys, [task_ids[i] for i in pending])
+                raise
+        return batch
+
+    def execute_chunked(
+        self,
+        func_name: str,
+        iterable_of_args,
+        chunk_size: int = None,
+        threads: int = 1,
+        target_seconds: float = 1.0,
+        max_chunk_size: int = 1000,
+        queue: str = None,
+        priority: int = None,
+    ) -> ChunkedBatch:
+        """
+        Execute a registered function once for every set of arguments in iterable_of_args, packing chunk_size
+        calls into each Celery task. For functions that only take milliseconds this removes most of the
+        per-message overhead of the broker and result backend. Messages are published like execute_many does.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            iterable_of_args (Iterable[dict]): Arguments for each call. Can be a generator, it is consumed one
+            chunk at a time.
+            chunk_size (int): Number of calls per task. Defaults to None (chosen by get_chunk_size).
+            threads (int): Number of calls of a chunk the worker runs at the same time. Defaults to 1.
+            target_seconds (float): Execution time per task aimed for when the chunk size is chosen
+            automatically. Defaults to 1.0.
+            max_chunk_size (int): Largest chunk size chosen automatically. Defaults to 1000.
+            queue (str): Queue the tasks are sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the tasks, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+
+        Returns:
+            ChunkedBatch: A handle with a result per call.
+        """
+        if chunk_size is None:
+            chunk_size = self.get_chunk_size(
+                func_name, target_seconds * max(1, threads), max_chunk_size
+            )
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        options = self.get_routing_options(
+            func_name, {"queue": queue, "priority": priority}
+        )
+        batch = ChunkedBatch(self.app, result_loader=self.load_payload)
+        iterator = iter(iterable_of_args)
+        while True:
+            # publish up to 500 chunk tasks per pipeline, like execute_many
+            chunks = []
+            while len(chunks) < 500:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            if not chunks:
+                break
+
+            with self.app.producer_or_acquire() as producer:
+                with self._pipelined_publish(producer):
+                    for chunk in chunks:
+                        task_id = str(uuid4())
+                        payload, _ = self.offload_payload(chunk, task_id)
+                        self.call_function_chunk_task.apply_async(
+                            (func_name, payload, threads),
+                            task_id=task_id,
+                            producer=producer,
+                            headers={"sent_at": time.time()},
+                            **options,
+                        )
+                        batch.task_ids.append(task_id)
+                        batch.chunk_lengths.append(len(chunk))
+            self.metrics.inc(
+                "distributask_tasks_submitted_total",
+                {"function": func_name},
+                sum(len(chunk) for chunk in chunks),
+            )
+        return batch
+
+    def get_chunk_size(
+        self, func_name: str, target_seconds: float = 1.0, max_chunk_size: int = 1000
+    ) -> int:
+        """
+        Choose the number of calls per task for execute_chunked from the average duration of the function's
+        calls in earlier chunk tasks.
+
+        Args:
+            func_name (str): The name of the function.
+            target_seconds (float): Execution time per task aimed for. Defaults to 1.0.
+            max_chunk_size (int): Largest chunk size returned. Defaults to 1000.
+
+        Returns:
+            int: The chunk size, 100 (at most max_chunk_size) if no duration has been recorded yet.
+        """
+        duration = self.get_function_duration(func_name)
+        if duration is None:
+            return min(100, max_chunk_size)
+        return max(1, min(max_chunk_size, int(target_seconds / max(duration, 1e-6))))
+
+    def record_function_duration(
+        self, func_name: str, seconds: float, calls: int
+    ) -> None:
+        """
+        Record the total execution time of calls of a function, used to choose chunk sizes.
+
+        Args:
+            func_name (str): The name of the function.
+            seconds (float): Total execution time of the calls in seconds.
+            calls (int): Number of calls.
+        """
+        pipe = self.get_redis_connection().pipeline(transaction=False)
+        pipe.hincrbyfloat(
+            "distributask-function-durations", f"{func_name}:seconds", seconds
+        )
+        pipe.hincrby("distributask-function-durations", f"{func_name}:calls", calls)
+        pipe.execute()
+
+    def get_function_duration(self, func_name: str) -> float:
+        """
+        Get the average recorded execution time of a function.
+
+        Args:
+            func_name (str): The name of the function.
+
+        Returns:
+            float: Average execution time in seconds, None if no call has been recorded.
+        """
+        seconds, calls = self.get_redis_connection().hmget(
+            "distributask-function-durations",
+            f"{func_name}:seconds",
+            f"{func_name}:calls",
+        )
+        if not calls or int(calls) == 0:
+            return None
+        return float(seconds) / int(calls)
+
+    def get_dedup_key(self, func_name: str, args: dict, dedup_key) -> str:
+        """
+        Resolve the dedup_key argument of execute_function and execute_many for one task.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            dedup_key (str | bool | callable): True for a hash of func_name and args, a callable that returns
+            the key for args, or the key itself.
+
+        Returns:
+            str: The deduplication key.
+        """
+        if dedup_key is True:
+            return f"{func_name}:{self.get_args_hash(args)}"
+        if callable(dedup_key):
+            return str(dedup_key(args))
+        return str(dedup_key)
+
+    def claim_dedup_keys(self, dedup_keys: List[str], task_ids: List[str]) -> List[str]:
+        """
+        Atomically claim deduplication keys for new tasks with SET NX, in a single pipeline. A key that belongs
+        to a task which failed or was revoked is handed over to the new task.
+
+        Args:
+            dedup_keys (List[str]): The keys to claim.
+            task_ids (List[str]): The ID of the new task for each key.
+
+        Returns:
+            List[str]: The ID of the task that owns each key. Equal to the new task's ID where the claim succeeded.
+        """
+        redis_client = self.get_redis_connection()
+        ttl = int(self.settings["DEDUP_TTL"])
+        with redis_client.pipeline() as pipe:
+            for key, task_id in zip(dedup_keys, task_ids):
+                pipe.set(f"distributask-dedup:{key}", task_id, nx=True, ex=ttl)
+                pipe.get(f"distributask-dedup:{key}")
+            owners = [bytes_to_str(owner) for owner in pipe.execute()[1::2]]
+
+        taken = {owner for owner, task_id in zip(owners, task_ids) if owner != task_id}
+        failed = {
+            owner
+            for owner, meta in self.get_ready_task_meta(taken).items()
+            if meta["status"] != states.SUCCESS
+        }
+        if failed:
+            # compare and set, so only one of several clients replacing the same failed task wins
+            takeover = redis_client.register_script("""
+                local owner = redis.call('GET', KEYS[1])
+                if owner == ARGV[1] or not owner then
+                    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+                    return ARGV[2]
+                end
+                return owner
+                """)
+            replaced = [i for i, owner in enumerate(owners) if owner in failed]
+            with redis_client.pipeline() as pipe:
+                for i in replaced:
+                    takeover(
+                        keys=[f"distributask-dedup:{dedup_keys[i]}"],
+                        args=[owners[i], task_ids[i], ttl],
+                        client=pipe,
+                    )
+                for i, owner in zip(replaced, pipe.execute()):
+                    owners[i] = bytes_to_str(owner)
+        return owners
+
+    def release_dedup_keys(self, dedup_keys: List[str], task_ids: List[str]) -> None:
+        """
+        Delete deduplication keys that are still owned by the given tasks, used when publishing them failed. A
+        client that dies between claiming a key and publishing its task leaves the key until DEDUP_TTL expires.
+
+        Args:
+            dedup_keys (List[str]): The keys to release.
+            task_ids (List[str]): The ID of the task that claimed each key.
+        """
+        if not dedup_keys:
+            return
+        redis_client = self.get_redis_connection()
+        release = redis_client.register_script("""
+            if redis.call('GET', KEYS[1]) == ARGV[1] then
+                return redis.call('DEL', KEYS[1])
+            end
+            return 0
+            """)
+        with redis_client.pipeline() as pipe:
+            for key, task_id in zip(dedup_keys, task_ids):
+                release(keys=[f"distributask-dedup:{key}"], args=[task_id], client=pipe)
+            pipe.execute()
+
+    def send_task(
+        self, func_name: str, args: dict, task_id: str = None, **options
+    ) -> AsyncResult:
+        """
+        Publish a call_function_task message for a registered function. Arguments larger than the
+        PAYLOAD_OFFLOAD_THRESHOLD setting are written to the blob store and sent by reference. The queue and
+        priority passed to register_function are used unless options sets them.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            task_id (str): ID of the task. Defaults to None (a new ID is generated).
+            options: kwargs that can be passed into Celery's Task.apply_async.
+
+        Returns:
+            celery.result.AsyncResult: An object representing the asynchronous result of the task.
+        """
+        task_id = task_id or str(uuid4())
+        options = self.get_routing_options(func_name, options)
+        args, args_bytes = self.offload_payload(args, task_id)
+        # the send time lets the worker measure how long the task waited in the queue, the size is only known
+        # if the arguments were serialized to decide whether to offload them
+        headers = dict(options.pop("headers", None) or {}, sent_at=time.time())
+        if args_bytes >= 0:
+            headers["args_bytes"] = args_bytes
+        async_result = self.call_function_task.apply_async(
+            (func_name, args), task_id=task_id, headers=headers, **options
+        )
+        self.metrics.inc("distributask_tasks_submitted_total", {"function": func_name})
+        return async_result
+
+    def skip_task(self, func_name: str, task_id: str = None) -> AsyncResult:
+        """
+        Record a task that isn't published because its outputs exist as succeeded, with the result None.
+
+        Args:
+            func_name (str): The name of the function.
+            task_id (str): ID of the task. Defaults to None (a new ID is generated).
+
+        Returns:
+            celery.result.AsyncResult: The result of the skipped task.
+        """
+        task_id = task_id or str(uuid4())
+        self.app.backend.store_result(task_id, None, states.SUCCESS)
+        self.metrics.inc("distributask_tasks_skipped_total", {"function": func_name})
+        return AsyncResult(task_id, app=self.app)
+
+    def get_routing_options(self, func_name: str, options: Dict) -> Dict:
+        """
+        Fill in the queue and priority passed to register_function where options doesn't set them.
+
+        Args:
+            func_name (str): The name of the function.
+            options (Dict): kwargs for Celery's Task.apply_async.
+
+        Returns:
+            Dict: A copy of options.
+        """
+        options = dict(options)
+        for option in ("queue", "priority"):
+            if options.get(option) is None:
+                options.pop(option, None)
+                default = self.function_options.get(func_name, {}).get(option)
+                if default is not None:
+                    options[option] = default
+        return options
+
+    def offload_payload(self, payload: any, task_id: str) -> any:
+        """
+        Write payload to the blob store if its serialized size exceeds the PAYLOAD_OFFLOAD_THRESHOLD setting,
+        and return a reference to it. The blob is recorded under the task so it is deleted together with the
+        task's keys in Redis.
+
+        Args:
+            payload (any): Task arguments or result.
+            task_id (str): The ID of the task the payload belongs to.
+
+        Returns:
+            Tuple[any, int]: A blob reference if the payload was offloaded, otherwise payload unchanged, and the
+            serialized size of payload in bytes, -1 if it wasn't serialized because no blob store is configured.
+        """
+        reference, size = self.store_payload(payload)
+        if reference is None:
+            return payload, size
+
+        self.get_redis_connection().sadd(
+            f"distributask-blob:{task_id}", reference["__distributask_blob__"]
+        )
+        return reference, size
+
+    def store_payload(self, payload: any) -> Dict:
+        """
+        Write payload to the blob store if its serialized size exceeds the PAYLOAD_OFFLOAD_THRESHOLD setting.
+        Used by offload_payload, which also records the blob under its task.
+
+        Args:
+            payload (any): Task arguments or result.
+
+        Returns:
+            Tuple[Dict, int]: A blob reference, or None if the payload is small enough to be sent as is, and the
+            serialized size of payload in bytes, -1 if it wasn't serialized.
+        """
+        if payload is None:
+            return None, 0
+        if self.blob_store is None:
+            return None, -1
+
+        content_type, content_encoding, data = serialize(
+            payload, serializer=self.settings["TASK_SERIALIZER"]
+        )
+        # the json serializer returns a str, the threshold is in bytes
+        if isinstance(data, str):
+            data = data.encode(content_encoding)
+        if len(data) <= int(self.settings["PAYLOAD_OFFLOAD_THRESHOLD"]):
+            return None, len(data)
+
+        reference = {
+            "__distributask_blob__": self.blob_store.put(data),
+            "content_type": content_type,
+            "content_encoding": content_encoding,
+        }
+        return reference, len(data)
+
+    def load_payload(self, payload: any) -> any:
+        """
+        Resolve a blob reference created by offload_payload. Other values are returned unchanged.
+
+        Args:
+            payload (any): Task arguments or result, possibly a blob reference.
+
+        Returns:
+            any: The original payload.
+
+        Raises:
+            ValueError: If payload is a blob reference and BLOB_STORE_PATH is not set.
+        """
+        if not isinstance(payload, dict) or "__distributask_blob__" not in payload:
+            return payload
+
+        if self.blob_store is None:
+            raise ValueError(
+                "Received an offloaded payload but BLOB_STORE_PATH is not set, "
+                "workers need the blob store of the driver"
+            )
+        data = self.blob_store.get(payload["__distributask_blob__"])
+        return deserialize(
+            data,
+            payload["content_type"],
+            payload["content_encoding"],
+            accept=prepare_accept_content(self.app.conf.accept_content),
+        )
+
+    def add_dead_letter(
+        self,
+        func_name: str,
+        args: any,
+        exception: Exception,
+        retries: int,
+        task_id: str = None,
+    ) -> None:
+        """
+        Add a failed task to the dead-letter list, a Redis list capped at DEAD_LETTER_MAX_LEN entries. Called by
+        call_function_task when a task fails without being retried, and by call_function_chunk_task for every
+        call that fails. The arguments are stored in full, so the
+        task can be replayed after the blob store was cleaned up. Errors are logged, they don't hide the task's
+        own exception.
+
+        Args:
+            func_name (str): The name of the function.
+            args (any): The arguments of the function.
+            exception (Exception): The exception raised by the function.
+            retries (int): Number of times the task was retried.
+            task_id (str): The ID of the task. Defaults to None (the ID of the current call_function_task).
+        """
+        try:
+            content_type, content_encoding, data = serialize(
+                args, serializer=self.settings["TASK_SERIALIZER"]
+            )
+            if isinstance(data, str):
+                data = data.encode(content_encoding)
+            entry = {
+                "task_id": task_id or self.call_function_task.request.id,
+                "function": func_name,
+                "exception": repr(exception),
+                "retries": retries,
+                "failed_at": time.time(),
+                "content_type": content_type,
+                "content_encoding": content_encoding,
+                "args": base64.b64encode(data).decode("ascii"),
+            }
+            with self.get_redis_connection().pipeline() as pipe:
+                pipe.rpush("distributask-dead-letter", json.dumps(entry))
+                pipe.ltrim(
+                    "distributask-dead-letter",
+                    -int(self.settings["DEAD_LETTER_MAX_LEN"]),
+                    -1,
+                )
+                pipe.execute()
+        except Exception as e:
+            self.log(f"Error adding task to the dead-letter list: {str(e)}", "warning")
+
+    def decode_dead_letter(self, entry: any) -> Dict:
+        """
+        Decode an entry of the dead-letter list.
+
+        Args:
+            entry (any): The raw entry, as stored by add_dead_letter.
+
+        Returns:
+            Dict: The entry, with its arguments deserialized.
+        """
+        entry = json.loads(bytes_to_str(entry))
+        entry["args"] = deserialize(
+            base64.b64decode(entry["args"]),
+            entry.pop("content_type"),
+            entry.pop("content_encoding"),
+            accept=prepare_accept_content(self.app.conf.accept_content),
+        )
+        return entry
+
+    def get_dead_letters(self, start: int = 0, end: int = -1) -> List[Dict]:
+        """
+        Get failed tasks from the dead-letter list, oldest first.
+
+        Args:
+            start (int): Index of the first entry. Defaults to 0.
+            end (int): Index of the last entry, inclusive. Defaults to -1 (the newest entry).
+
+        Returns:
+            List[Dict]: For every task, its ID, function name, arguments, the repr of the exception, the number
+            of retries and the time it failed.
+        """
+        entries = self.get_redis_connection().lrange(
+            "distributask-dead-letter", start, end
+        )
+        return [self.decode_dead_letter(entry) for entry in entries]
+
+    def replay_dead_letters(
+        self, func_name: str = None, count: int = None, chunk_size: int = 500
+    ) -> TaskBatch:
+        """
+        Submit failed tasks from the dead-letter list again, as new tasks, and remove them from the list. An
+        entry is only replayed by the client that removed it, so concurrent replays don't submit a task twice. If
+        publishing a chunk fails, its entries are put back at the head of the list before the error is raised.
+
+        Args:
+            func_name (str): Only replay tasks of this function. Defaults to None (every function).
+            count (int): Maximum number of tasks replayed, oldest first. Defaults to None (no limit).
+            chunk_size (int): Number of messages published per pipeline. Defaults to 500.
+
+        Returns:
+            TaskBatch: A handle containing the IDs of the new tasks.
+
+        Raises:
+            Exception: If publishing fails, the entries that weren't published are back in the list.
+        """
+        redis_client = self.get_redis_connection()
+        batch = TaskBatch(self.app, result_loader=self.load_payload)
+        selected = []
+        for entry in redis_client.lrange("distributask-dead-letter", 0, -1):
+            if count is not None and len(selected) >= count:
+                break
+            decoded = self.decode_dead_letter(entry)
+            if func_name is None or decoded["function"] == func_name:
+                selected.append((entry, decoded))
+
+        for i in range(0, len(selected), chunk_size):
+            chunk = selected[i : i + chunk_size]
+            with redis_client.pipeline() as pipe:
+                for entry, _ in chunk:
+                    pipe.lrem("distributask-dead-letter", 1, entry)
+                removed = pipe.execute()
+            claimed = [
+                (entry, decoded)
+                for (entry, decoded), was_removed in zip(chunk, removed)
+                if was_removed
+            ]
+
+            task_ids = []
+            try:
+                with self.app.producer_or_acquire() as producer:
+                    with self._pipelined_publish(producer):
+                        for _, decoded in claimed:
+                            async_result = self.send_task(
+                                decoded["function"], decoded["args"], producer=producer
+                            )
+                            task_ids.append(async_result.id)
+            except Exception as e:
+                # pipelined messages are only sent when the whole chunk is, give every claimed entry back
+                self.log(f"Failed to replay {len(claimed)} dead letters: {e}", "error")
+                if claimed:
+                    redis_client.lpush(
+                        "distributask-dead-letter",
+                        *reversed([entry for entry, _ in claimed]),
+                    )
+                raise
+            batch.task_ids.extend(task_ids)
+        return batch
+
+    def clear_dead_letters(self) -> None:
+        """
+        Delete all failed tasks from the dead-letter list.
+        """
+        self.get_redis_connection().delete("distributask-dead-letter")
+
+    def cleanup_payloads(self) -> None:
+        """
+        Delete the offloaded payloads of all tasks from the blob store, along with the Redis keys that track them.
+        """
+        redis_connection = self.get_redis_connection()
+        for key in redis_connection.scan_iter(match="distributask-blob*"):
+            if self.blob_store is not None:
+                for blob_key in redis_connection.smembers(key):
+                    self.blob_store.delete(bytes_to_str(blob_key))
+            redis_connection.delete(key)
+
+    @contextmanager
+    def _pipelined_publish(self, producer):
+        """
+        Buffer the messages published through producer in a Redis pipeline and send them when the context
+        exits. Queue lookups for the exchange are cached for the lifetime of the context. Producers that are
+        not backed by the Redis transport publish normally.
+
+        Args:
+            producer (kombu.Producer): The producer used to publish the messages.
+        """
+        channel = producer.channel
+        if not all(
+            hasattr(channel, attr)
+            for attr in ("_put", "_lookup", "_q_for_pri", "client")
+        ):
+            yield producer
+            return
+
+        pipe = channel.client.pipeline(transaction=False)
+        lookup = channel._lookup
+        routes = {}
+
+        def _lookup(exchange, routing_key, default=None):
+            if (exchange, routing_key) not in routes:
+                routes[(exchange, routing_key)] = lookup(exchange, routing_key, default)
+            return routes[(exchange, routing_key)]
+
+        def _put(queue, message, **kwargs):
+            priority = channel._get_message_priority(message, reverse=False)
+            pipe.lpush(channel._q_for_pri(queue, priority), kombu_dumps(message))
+
+        channel._lookup = _lookup
+        channel._put = _put
+        try:
+            yield producer
+        finally:
+            del channel._lookup
+            del channel._put
+        pipe.execute()
+
+    def update_function_status(self, task_id: str, status: str) -> None:
+        """
+        Update the status of a function task as a new Redis key.
+
+        Args:
+            task_id (str): The ID of the task.
+            status (str): The new status to set.
+        """
+        redis_client = self.get_redis_connection()
+        redis_client.set(f"task_status:{task_id}", status)
+
+    def get_queue_length(self, queue: str = "celery") -> int:
+        """
+        Get the number of tasks waiting in a queue, including its priority sub-queues.
+
+        Args:
+            queue (str): The name of the queue. Defaults to "celery".
+
+        Returns:
+            int: The number of waiting tasks.
+        """
+        priority_steps = self.app.conf.broker_transport_options.get(
+            "priority_steps", PRIORITY_STEPS
+        )
+        pipe = self.get_redis_connection().pipeline(transaction=False)
+        for priority in priority_steps:
+            pipe.llen(self.get_queue_key(queue, priority))
+        return sum(pipe.execute())
+
+    def get_queue_key(self, queue: str, priority: int = None) -> str:
+        """
+        Get the Redis list that holds the messages of a queue with a priority, like the Redis transport does.
+
+        Args:
+            queue (str): The name of the queue.
+            priority (int): The priority of the messages. Defaults to None (0).
+
+        Returns:
+            str: The Redis key.
+        """
+        transport_options = self.app.conf.broker_transport_options
+        sep = transport_options.get("sep", "\x06\x16")
+        priority_steps = transport_options.get("priority_steps", PRIORITY_STEPS)
+        # the highest step that isn't above the priority
+        step = priority_steps[max(0, bisect(priority_steps, priority or 0) - 1)]
+        return f"{queue}{sep}{step}" if step else queue
+
+    def get_in_flight_count(self) -> int:
+        """
+        Get the number of tasks that have been delivered to workers but not acknowledged yet, across all queues.
+        Tasks are acknowledged after they have been executed, so this counts running and prefetched tasks.
+
+        Returns:
+            int: The number of in-flight tasks.
+        """
+        unacked_key = self.app.conf.broker_transport_options.get(
+            "unacked_key", "unacked"
+        )
+        return self.get_redis_connection().hlen(unacked_key)
+
+    def get_running_tasks(self, task_ids=None) -> Dict[str, Dict]:
+        """
+        Get the tasks that have been delivered to workers and not acknowledged yet, read from the broker's unacked
+        messages. Workers started by create_instance prefetch a single task, so these are the running tasks.
+
+        Args:
+            task_ids (Iterable[str]): Only return these tasks. Defaults to None (all tasks).
+
+        Returns:
+            Dict[str, Dict]: Maps task IDs to the raw message, under "message", and the time the task was
+            delivered, under "delivered_at".
+        """
+        transport_options = self.app.conf.broker_transport_options
+        unacked_key = transport_options.get("unacked_key", "unacked")
+        index_key = transport_options.get("unacked_index_key", "unacked_index")
+        task_ids = set(task_ids) if task_ids is not None else None
+
+        redis_client = self.get_redis_connection()
+        delivered = redis_client.zrange(index_key, 0, -1, withscores=True)
+        if not delivered:
+            return {}
+        values = redis_client.hmget(unacked_key, [tag for tag, _ in delivered])
+
+        running = {}
+        for (_, delivered_at), value in zip(delivered, values):
+            if value is None:
+                continue
+            message = json.loads(value)[0]
+            headers = message.get("headers") or {}
+            if headers.get("task") != "call_function_task":
+                continue
+            if task_ids is not None and headers.get("id") not in task_ids:
+                continue
+            running[headers["id"]] = {"message": message, "delivered_at": delivered_at}
+        return running
+
+    def get_message_args(self, message: Dict) -> tuple:
+        """
+        Decode the function name and arguments of a raw call_function_task message.
+
+        Args:
+            message (Dict): A raw message, as returned by get_running_tasks.
+
+        Returns:
+            tuple: The function name and its arguments.
+        """
+        body = message["body"]
+        if message.get("properties", {}).get("body_encoding") == "base64":
+            body = base64.b64decode(body)
+        args, kwargs, embed = deserialize(
+            body,
+            message["content-type"],
+            message["content-encoding"],
+            accept=prepare_accept_content(self.app.conf.accept_content),
+        )
+        func_name, func_args = args
+        return func_name, func_args
+
+    def get_request_header(self, name: str) -> any:
+        """
+        Get a custom message header of the task that is being executed by call_function_task.
+
+        Args:
+            name (str): The name of the header.
+
+        Returns:
+            any: The value of the header, or None if the message doesn't have it.
+        """
+        request = self.call_function_task.request
+        # custom headers are request attributes on workers, and in request.headers for eager tasks
+        value = getattr(request, name, None)
+        if value is None:
+            value = (request.headers or {}).get(name)
+        return value
+
+    def record_task_telemetry(
+        self,
+        func_name: str,
+        result_bytes: int,
+        started_at: float,
+        duration: float,
+        outcome: str,
+    ) -> None:
+        """
+        Add a task to the telemetry stream, a Redis stream capped at about TELEMETRY_MAX_LEN entries. Called by
+        call_function_task for every task when the TELEMETRY setting is enabled. Errors are logged, they don't
+        fail the task. Payload sizes are those measured anyway: the arguments by the client that sent them and
+        the result by offload_payload, so they are -1 (not measured) when no blob store is configured, except for
+        arguments sent by AsyncDistributask.
+
+        Args:
+            func_name (str): The name of the function.
+            result_bytes (int): Serialized size of the result, 0 if the function failed.
+            started_at (float): Time the worker started the task, as returned by time.time().
+            duration (float): Execution time of the function in seconds.
+            outcome (str): "success", "retry" (failed and retried) or "failure".
+        """
+        if not self.settings["TELEMETRY"]:
+            return
+
+        request = self.call_function_task.request
+        sent_at = self.get_request_header("sent_at")
+        args_bytes = self.get_request_header("args_bytes")
+        fields = {
+            "function": func_name,
+            "node": request.hostname or "",
+            # set by Vast.ai in every instance
+            "instance": os.getenv("CONTAINER_ID", ""),
+            "wait": max(0.0, started_at - float(sent_at)) if sent_at else -1,
+            "execution": duration,
+            "args_bytes": args_bytes if args_bytes is not None else -1,
+            "result_bytes": result_bytes,
+            "outcome": outcome,
+        }
+        try:
+            self.get_redis_connection().xadd(
+                "distributask-telemetry",
+                fields,
+                maxlen=int(self.settings["TELEMETRY_MAX_LEN"]),
+                approximate=True,
+            )
+        except Exception as e:
+            self.log(f"Error recording task telemetry: {str(e)}", "warning")
+
+    def get_task_stats(
+        self, since: float = None, group_by: str = "function", chunk_size: int = 10000
+    ) -> Dict[str, Dict]:
+        """
+        Aggregate the telemetry stream per function, node or instance, to spot slow nodes and size the fleet.
+
+        Args:
+            since (float): Only include tasks finished after this time, as returned by time.time(). Defaults to
+            None (every recorded task).
+            group_by (str): "function", "node" (the Celery worker name) or "instance" (the Vast.ai instance ID).
+            Defaults to "function".
+            chunk_size (int): Number of stream entries read per request. Defaults to 10000.
+
+        Returns:
+            Dict[str, Dict]: For every group, the number of tasks and failures, tasks per second over the time
+            window, p50/p95/p99 of the queue wait and execution time in seconds, and the mean argument and result
+            sizes in bytes, None if no size was measured (see record_task_telemetry).
+        """
+        redis_client = self.get_redis_connection()
+        start = f"{int(since * 1000)}-0" if since is not None else "-"
+        groups = {}
+        first_timestamp = None
+        while True:
+            entries = redis_client.xrange(
+                "distributask-telemetry", min=start, count=chunk_size
+            )
+            for entry_id, fields in entries:
+                fields = {
+                    bytes_to_str(key): bytes_to_str(value)
+                    for key, value in fields.items()
+                }
+                if first_timestamp is None:
+                    first_timestamp = int(bytes_to_str(entry_id).split("-")[0]) / 1000
+                group = groups.setdefault(
+                    fields[group_by],
+                    {
+                        "wait": [],
+                        "execution": [],
+                        "args_bytes": [],
+                        "result_bytes": [],
+                        "failures": 0,
+                    },
+                )
+                group["execution"].append(float(fields["execution"]))
+                # -1 marks values that couldn't be measured
+                for metric in ("wait", "args_bytes", "result_bytes"):
+                    if float(fields[metric]) >= 0:
+                        group[metric].append(float(fields[metric]))
+                if fields["outcome"] != "success":
+                    group["failures"] += 1
+            if len(entries) < chunk_size:
+                break
+            # continue after the last entry
+            start = "(" + bytes_to_str(entries[-1][0])
+
+        window = time.time() - (since if since is not None else first_timestamp or 0)
+        stats = {}
+        for name, group in groups.items():
+            tasks = len(group["execution"])
+            stats[name] = {
+                "tasks": tasks,
+                "failures": group["failures"],
+                "tasks_per_second": tasks / window if window > 0 else 0,
+            }
+            for metric in ("args_bytes", "result_bytes"):
+                values = group[metric]
+                stats[name][metric] = sum(values) / len(values) if values else None
+            for metric in ("wait", "execution"):
+                values = sorted(group[metric])
+                for percentile in (50, 95, 99):
+                    stats[name][f"{metric}_p{percentile}"] = get_percentile(
+                        values, percentile
+                    )
+        return stats
+
+    def get_metrics(self) -> str:
+        """
+        Get the metrics of this process in the Prometheus text exposition format: task counters and execution time
+        histograms per function, and gauges for the queue length, in-flight tasks, Redis round-trip latency and the
+        number and hourly cost of the nodes rented by this process. Collecting the gauges costs a PING, one
+        pipeline of LLEN commands and an HLEN, never a key scan.
+
+        Returns:
+            str: The metrics.
+        """
+        nodes = list(self.rented_nodes.values())
+        gauges = {
+            "distributask_rented_nodes": (
+                "Vast.ai nodes rented by this process.",
+                {(): len(nodes)},
+            ),
+            "distributask_rented_nodes_hourly_cost": (
+                "Total price per hour of the Vast.ai nodes rented by this process.",
+                {(): sum(node.get("dph_total") or 0 for node in nodes)},
+            ),
+        }
+        try:
+            start = time.perf_counter()
+            self.get_redis_connection().ping()
+            latency = time.perf_counter() - start
+            # the default queue and the queues of the registered functions
+            queues = {self.app.conf.task_default_queue} | {
+                options["queue"]
+                for options in self.function_options.values()
+                if options.get("queue")
+            }
+            gauges["distributask_redis_latency_seconds"] = (
+                "Round-trip time of a Redis PING.",
+                {(): latency},
+            )
+            gauges["distributask_queue_length"] = (
+                "Tasks waiting in the queue.",
+                {
+                    (("queue", queue),): self.get_queue_length(queue)
+                    for queue in sorted(queues)
+                },
+            )
+            gauges["distributask_tasks_in_flight"] = (
+                "Tasks delivered to workers and not acknowledged yet.",
+                {(): self.get_in_flight_count()},
+            )
+            redis_up = 1
+        except Exception as e:
+            self.log(f"Error collecting Redis metrics: {str(e)}", "warning")
+            redis_up = 0
+        gauges["distributask_redis_up"] = (
+            "Whether Redis could be reached.",
+            {(): redis_up},
+        )
+        return self.metrics.render(gauges)
+
+    def start_metrics_server(
+        self, port: int = None, host: str = "0.0.0.0"
+    ) -> ThreadingHTTPServer:
+        """
+        Serve get_metrics on /metrics from a background thread, for Prometheus to scrape.
+
+        Args:
+            port (int): The port to listen on. Defaults to the METRICS_PORT setting.
+            host (str): The address to listen on. Defaults to "0.0.0.0".
+
+        Returns:
+            ThreadingHTTPServer: The server, call shutdown on it to stop serving.
+        """
+        distributask = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                data = distributask.get_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        if port is None:
+            port = int(self.settings["METRICS_PORT"])
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def initialize_dataset(self, **kwargs) -> None:
+        """
+        Initialize a Hugging Face repository if it doesn't exist. Reads Hugging Face info from config or .env
+
+        Args:
+            kwargs: kwargs that can be passed into the HfApi.create_repo function.
+
+        Raises:
+            HTTPError: If repo cannot be created due to connection error other than repo not existing
+        """
+        repo_id = self.settings.get("HF_REPO_ID")
+        hf_token = self.settings.get("HF_TOKEN")
+        api = HfApi(token=hf_token)
+
+        # creates new repo if desired repo is not found
+        try:
             repo_info = api.repo_info(repo_id=repo_id, repo_type="dataset", timeout=30)
         except HTTPError as e:
             if e.response.status_code == 404:
                 self.log(
-                    f"Repository {repo_id} does not exist. Creating a new repository.",
-                    "warn",
+                    f"Repository {repo_id} does not exist. Creating a new repository.",
+                    "warn",
+                )
+                api.create_repo(
+                    repo_id=repo_id, token=hf_token, repo_type="dataset", **kwargs
+                )
+            else:
+                raise e
+
+        # Create config.json file
+        config = {
+            "data_loader_name": "custom",
+            "data_loader_kwargs": {
+                "path": repo_id,
+                "format": "files",
+                "fields": ["file_path", "text"],
+            },
+        }
+
+        # apply config.json to created repo
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with Repository(
+                local_dir=temp_dir,
+                clone_from=repo_id,
+                repo_type="dataset",
+                use_auth_token=hf_token,
+            ).commit(commit_message="Add config.json"):
+                with open(os.path.join(temp_dir, "config.json"), "w") as f:
+                    json.dump(config, f, indent=2)
+
+        self.log(f"Initialized repository {repo_id}.")
+
+    def get_upload_buffer(self) -> UploadBuffer:
+        """
+        Returns the UploadBuffer of this process, created on first use with the UPLOAD_* settings. Buffered files
+        are committed when the process exits, see close_upload_buffer.
+
+        Returns:
+            UploadBuffer: The upload buffer.
+        """
+        # a forked worker process creates its own buffer, the flush thread isn't copied by fork
+        if self.upload_buffer is None or self.upload_buffer.pid != os.getpid():
+            self.upload_buffer = UploadBuffer(
+                self.commit_backend,
+                max_files=int(self.settings["UPLOAD_BATCH_FILES"]),
+                max_bytes=int(self.settings["UPLOAD_BATCH_BYTES"]),
+                max_delay=float(self.settings["UPLOAD_BATCH_DELAY"]),
+                max_queued_bytes=int(self.settings["UPLOAD_QUEUE_BYTES"]),
+                max_memory_bytes=int(self.settings["UPLOAD_MEMORY_BYTES"]),
+                threads=int(self.settings["UPLOAD_THREADS"]),
+                max_retries=int(self.settings["UPLOAD_RETRIES"]),
+                retry_backoff=float(self.settings["UPLOAD_BACKOFF"]),
+                log=self.log,
+                on_commit=self.update_repo_index,
+            )
+        return self.upload_buffer
+
+    def flush_uploads(self) -> None:
+        """
+        Commit the files buffered by upload_file now and wait until they are committed.
+        """
+        if self.upload_buffer is not None and self.upload_buffer.pid == os.getpid():
+            self.upload_buffer.flush()
+
+    @contextmanager
+    def track_uploads(self):
+        """
+        Collect the futures of the files uploaded by the current thread while the context is active. Used by the
+        tasks to wait for the outputs of the function before they return. wait_for_uploads holds its commit while
+        other threads of the process are inside track_uploads.
+
+        Yields:
+            list: The futures returned by upload_file and upload_directory.
+        """
+        previous = getattr(self.task_uploads, "futures", None)
+        self.task_uploads.futures = []
+        try:
+            with self.get_upload_buffer().producing():
+                yield self.task_uploads.futures
+        finally:
+            self.task_uploads.futures = previous
+
+    def wait_for_uploads(self, futures: List[Future]) -> None:
+        """
+        Wait until the given uploads are committed. The buffered files are committed as soon as no other task of
+        this process is running (see track_uploads), so tasks that run concurrently in a thread pool share a
+        commit, or earlier when a batch is full or UPLOAD_BATCH_DELAY has passed. A prefork worker runs one task
+        at a time per process, so with UPLOAD_WAIT enabled each of its tasks makes its own commit. With the
+        default UPLOAD_WAIT=false, or across the calls of an execute_chunked chunk, files are batched across
+        tasks.
+
+        Args:
+            futures (list): Futures returned by upload_file and upload_directory.
+
+        Raises:
+            Exception: The exception of the first failed upload.
+        """
+        if futures:
+            self.get_upload_buffer().flush(futures, group=True)
+        for future in futures:
+            future.result()
+
+    def close_upload_buffer(self) -> None:
+        """
+        Commit the files buffered by upload_file and stop the upload buffer, waiting for its commits, retries
+        included. Called when the process exits. The next upload_file call creates a new buffer, with the current
+        settings.
+        """
+        upload_buffer, self.upload_buffer = self.upload_buffer, None
+        if upload_buffer is not None and upload_buffer.pid == os.getpid():
+            upload_buffer.close()
+
+    def upload_file(
+        self, file_path: str, path_in_repo: str = None, wait: bool = True
+    ) -> Future:
+        """
+        Upload a file to the dataset repository. The file is buffered and committed together with other uploaded
+        files, see get_upload_buffer, so many small files don't need one commit each. By default the call waits
+        until the file is committed and logs errors instead of raising them. With wait=False it returns once the
+        file is buffered, blocking only while more than UPLOAD_QUEUE_BYTES bytes wait to be committed; tasks
+        wait for these files before they return if the UPLOAD_WAIT setting is enabled. Files larger than
+        UPLOAD_MEMORY_BYTES are read when they are committed, they must not be changed or deleted until the
+        future resolves.
+
+        Args:
+            file_path (str): The path of the file to upload.
+            path_in_repo (str): The path of the file in the repository. Defaults to the file name.
+            wait (bool): Wait until the file is committed. Defaults to True.
+
+        Returns:
+            Future: With wait=False, resolves to the id of the commit once the file is committed, or raises the
+            exception of a failed commit. None with wait=True.
+
+        Raises:
+            FileNotFoundError: With wait=False, if the file doesn't exist.
+        """
+        repo_id = self.settings.get("HF_REPO_ID")
+        self.log(f"Uploading {file_path} to Hugging Face repo {repo_id}")
+        if wait:
+            try:
+                self.wait_for_uploads(
+                    [self.get_upload_buffer().add(file_path, path_in_repo)]
+                )
+                self.log(f"Uploaded {file_path} to Hugging Face repo {repo_id}")
+            except Exception as e:
+                self.log(
+                    f"Failed to upload {file_path} to Hugging Face repo {repo_id}: {e}",
+                    "error",
+                )
+            return None
+
+        future = self.get_upload_buffer().add(file_path, path_in_repo)
+        if getattr(self.task_uploads, "futures", None) is not None:
+            self.task_uploads.futures.append(future)
+        return future
+
+    def upload_directory(
+        self, dir_path: str, path_in_repo: str = "", wait: bool = True
+    ) -> List[Future]:
+        """
+        Upload the files of a directory to the dataset repository, like upload_file. The files are committed in
+        commits of at most UPLOAD_BATCH_FILES files.
+
+        Args:
+            dir_path (str): The path of the directory to upload.
+            path_in_repo (str): The directory of the repository the files are uploaded to. Defaults to the root.
+            wait (bool): Wait until the files are committed, errors are logged. Defaults to True.
+
+        Returns:
+            list: With wait=False, a Future for every file, see upload_file. None with wait=True.
+        """
+        repo_id = self.settings.get("HF_REPO_ID")
+        futures = []
+        try:
+            for root, _, files in os.walk(dir_path):
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    relative_path = os.path.relpath(file_path, dir_path).replace(
+                        os.sep, "/"
+                    )
+                    if path_in_repo.strip("/"):
+                        relative_path = f"{path_in_repo.strip('/')}/{relative_path}"
+                    futures.append(
+                        self.upload_file(file_path, relative_path, wait=False)
+                    )
+            if not wait:
+                return futures
+            self.wait_for_uploads(futures)
+            self.log(f"Uploaded {dir_path} to Hugging Face repo {repo_id}")
+        except Exception as e:
+            if not wait:
+                raise
+            self.log(
+                f"Failed to upload {dir_path} to Hugging Face repo {repo_id}: {e}",
+                "error",
+            )
+        return None
+
+    def get_repo_index_key(self) -> str:
+        """
+        Returns the key of the Redis set that holds the paths of the files in the dataset repository. The commit
+        the set was listed at and the time it was last checked are stored in the hash at the key plus ":info".
+        """
+        return f"distributask-repo-index:{self.settings['HF_REPO_ID']}"
+
+    def refresh_repo_index(self, force: bool = False) -> str:
+        """
+        Make sure the repository index is up to date. The index is used for REPO_INDEX_TTL seconds, then the latest
+        commit of the repository is looked up and the files are listed again only if it changed. Files committed
+        by upload_file, delete_file and batch_operations are added to and removed from the index as soon as they
+        are committed, and their commits are recorded, so if the latest commit is one of them the index moves on
+        to it without a new listing. A commit made by another tool is seen once it is the latest commit; if
+        distributask commits on top of it within REPO_INDEX_TTL seconds, it is only seen at the next listing, call
+        refresh_repo_index(force=True) after committing to the repository with other tools. An update applied
+        while the files are being listed can be overwritten by the new listing. The repository has moved past the
+        listed commit then, so the index is listed again at the next check, at most REPO_INDEX_TTL seconds later.
+
+        Args:
+            force (bool): List the files even if the index is up to date. Defaults to False.
+
+        Returns:
+            str: The commit the index was listed at.
+        """
+        redis_connection = self.get_redis_connection()
+        key = self.get_repo_index_key()
+        info = {
+            bytes_to_str(field): bytes_to_str(value)
+            for field, value in redis_connection.hgetall(f"{key}:info").items()
+        }
+        ttl = float(self.settings["REPO_INDEX_TTL"])
+        if (
+            not force
+            and "sha" in info
+            and time.time() - float(info.get("checked_at", 0)) < ttl
+        ):
+            return info["sha"]
+
+        # one process refreshes the index at a time, the others use the index they have
+        locked = redis_connection.set(f"{key}:lock", 1, nx=True, ex=300)
+        if not locked and "sha" in info and not force:
+            return info["sha"]
+        try:
+            revision = self.commit_backend.get_revision() or ""
+            if (
+                not force
+                and "sha" in info
+                and info["sha"] != revision
+                and redis_connection.sismember(f"{key}:commits", revision)
+            ):
+                # the latest commit was made by distributask, its files are already in the index
+                pipe = redis_connection.pipeline(transaction=True)
+                pipe.hset(
+                    f"{key}:info", mapping={"sha": revision, "checked_at": time.time()}
+                )
+                pipe.delete(f"{key}:commits")
+                pipe.execute()
+            elif force or info.get("sha") != revision:
+                files = self.commit_backend.list_files(revision or None)
+                # build the new index next to the old one, so readers never see a partial index
+                temp_key = f"{key}:{uuid4().hex}"
+                pipe = redis_connection.pipeline(transaction=True)
+                for i in range(0, len(files), 10000):
+                    pipe.sadd(temp_key, *files[i : i + 10000])
+                if files:
+                    pipe.rename(temp_key, key)
+                else:
+                    pipe.delete(key)
+                pipe.hset(
+                    f"{key}:info", mapping={"sha": revision, "checked_at": time.time()}
+                )
+                pipe.delete(f"{key}:commits")
+                pipe.execute()
+                self.log(f"Indexed {len(files)} files of commit {revision}")
+            else:
+                redis_connection.hset(f"{key}:info", "checked_at", time.time())
+            return revision
+        finally:
+            if locked:
+                redis_connection.delete(f"{key}:lock")
+
+    def update_repo_index(self, operations: List, commit_id: str = None) -> None:
+        """
+        Apply committed operations to the repository index, and record the commit as one whose files are in the
+        index, so refresh_repo_index moves the index on to it instead of listing the files again.
+
+        Args:
+            operations (list): CommitOperationAdd, CommitOperationDelete and CommitOperationCopy objects.
+            commit_id (str): The id of the commit. Defaults to None.
+        """
+        redis_connection = self.get_redis_connection()
+        key = self.get_repo_index_key()
+        # atomic, so a refresh of the index sees either none or all of the commit
+        pipe = redis_connection.pipeline(transaction=True)
+        folder_deleted = False
+        for operation in operations:
+            if isinstance(operation, (CommitOperationAdd, CommitOperationCopy)):
+                pipe.sadd(key, operation.path_in_repo)
+            elif operation.is_folder:
+                # list the files again instead of searching the set for the files of the folder
+                pipe.hdel(f"{key}:info", "sha")
+                folder_deleted = True
+            else:
+                pipe.srem(key, operation.path_in_repo)
+        if commit_id and not folder_deleted:
+            pipe.sadd(f"{key}:commits", commit_id)
+        pipe.execute()
+
+    def delete_file(self, repo_id: str, path_in_repo: str) -> None:
+        """
+        Delete a file from a Hugging Face repository.
+
+        Args:
+            repo_id (str): The ID of the repository.
+            path_in_repo (str): The path of the file to delete within the repository.
+
+        Raises:
+            Exception: If an error occurs during the deletion process.
+
+        """
+        hf_token = self.settings.get("HF_TOKEN")
+        api = HfApi(token=hf_token)
+
+        try:
+            if repo_id == self.settings["HF_REPO_ID"]:
+                operation = CommitOperationDelete(path_in_repo=path_in_repo)
+                commit_id, _ = self.commit_backend.commit_with_retries(
+                    [operation], f"Delete {path_in_repo}", max_retries=0
+                )
+                self.update_repo_index([operation], commit_id)
+            else:
+                api.delete_file(
+                    repo_id=repo_id,
+                    path_in_repo=path_in_repo,
+                    repo_type="dataset",
+                    token=hf_token,
+                )
+            self.log(f"Deleted {path_in_repo} from Hugging Face repo {repo_id}")
+        except Exception as e:
+            self.log(
+                f"Failed to delete {path_in_repo} from Hugging Face repo {repo_id}: {e}",
+                "error",
+            )
+
+    def batch_operations(
+        self,
+        operations: List,
+        chunk_size: int = 1000,
+        concurrency: int = 1,
+        dry_run: bool = False,
+        message: str = "Batch operations",
+    ) -> List[Dict]:
+        """
+        Apply commit operations to the dataset repository in commits of at most chunk_size operations, instead of
+        one commit per file. Commits are retried like the commits of upload_file, with the UPLOAD_RETRIES and
+        UPLOAD_BACKOFF settings, and the repository index is updated after each one. A failed commit doesn't stop
+        the others. The Hub rejects a whole commit if it deletes or copies a file that doesn't exist, so those
+        operations are left out and logged: if paths are missing from the repository index, the files are listed
+        again and the paths that are still missing are dropped before committing, and if a commit is still
+        rejected (HTTP 404), the files are listed again and the commit is retried once without the missing paths. With concurrency above 1, chunks are committed in parallel, so operations that depend on
+        each other, like a copy of a file added in an earlier chunk, may fail.
+
+        Args:
+            operations (list): CommitOperationAdd, CommitOperationDelete and CommitOperationCopy objects from
+            huggingface_hub.
+            chunk_size (int): Maximum number of operations in a commit. Defaults to 1000.
+            concurrency (int): Number of commits made at the same time. Defaults to 1.
+            dry_run (bool): Only log the commits that would be made. Defaults to False.
+            message (str): Commit message, the number of the commit is appended. Defaults to "Batch operations".
+
+        Returns:
+            list: A dict for every commit, with the paths of its "add", "delete" and "copy" operations (a
+            (source, destination) tuple for copies), "missing", the deleted and copied paths that were left out
+            because they don't exist, and "commit", the id of the commit. "commit" is None in a dry run and if no
+            operations were left to commit, and if the commit failed, "error" holds its exception.
+
+        Raises:
+            ValueError: If chunk_size is less than 1.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        operations = list(operations)
+        # files added in the same call are only in the index once they are committed
+        added = {
+            operation.path_in_repo
+            for operation in operations
+            if isinstance(operation, CommitOperationAdd)
+        }
+
+        def find_missing(chunk, force=False):
+            # folders are not in the index
+            sources = [
+                path
+                for operation in chunk
+                if isinstance(operation, (CommitOperationDelete, CommitOperationCopy))
+                for path in [
+                    getattr(operation, "src_path_in_repo", operation.path_in_repo)
+                ]
+                if not path.endswith("/") and path not in added
+            ]
+            if not sources:
+                return []
+            try:
+                self.refresh_repo_index(force=force)
+                exist = self.get_redis_connection().smismember(
+                    self.get_repo_index_key(), sources
+                )
+            except Exception as e:
+                # commit everything, the Hub checks the paths anyway
+                self.log(f"Failed to check if {len(sources)} files exist: {e}", "error")
+                return []
+            return [path for path, exists in zip(sources, exist) if not exists]
+
+        def leave_out(i, missing):
+            if missing:
+                self.log(
+                    f"Leaving out {len(missing)} operations on files that don't exist: {', '.join(missing)}",
+                    "warning",
+                )
+            missing_paths = set(missing)
+            chunks[i] = [
+                operation
+                for operation in chunks[i]
+                if getattr(operation, "src_path_in_repo", operation.path_in_repo)
+                not in missing_paths
+                or isinstance(operation, CommitOperationAdd)
+            ]
+            summary = {"add": [], "delete": [], "copy": []}
+            for operation in chunks[i]:
+                if isinstance(operation, CommitOperationAdd):
+                    summary["add"].append(operation.path_in_repo)
+                elif isinstance(operation, CommitOperationDelete):
+                    summary["delete"].append(operation.path_in_repo)
+                else:
+                    summary["copy"].append(
+                        (operation.src_path_in_repo, operation.path_in_repo)
+                    )
+            summary["missing"] = summaries[i]["missing"] + missing
+            summary["commit"] = None
+            summaries[i] = summary
+
+        chunks = [
+            operations[i : i + chunk_size]
+            for i in range(0, len(operations), chunk_size)
+        ]
+        summaries = [{"missing": []} for _ in chunks]
+        missing = [find_missing(chunk) for chunk in chunks]
+        if any(missing):
+            # the index may be out of date, only leave out paths that are still missing once the files are listed
+            try:
+                self.refresh_repo_index(force=True)
+                missing = [
+                    find_missing(chunk) if paths else []
+                    for chunk, paths in zip(chunks, missing)
+                ]
+            except Exception as e:
+                self.log(f"Failed to list the repository files: {e}", "error")
+                missing = [[] for _ in chunks]
+        for i, paths in enumerate(missing):
+            leave_out(i, paths)
+
+        if dry_run:
+            for i, summary in enumerate(summaries):
+                self.log(
+                    f"Dry run, commit {i + 1}/{len(chunks)}: {len(summary['add'])} adds, "
+                    f"{len(summary['delete'])} deletes, {len(summary['copy'])} copies, "
+                    f"{len(summary['missing'])} missing"
+                )
+            return summaries
+
+        refresh_lock = threading.Lock()
+        refreshed = []
+
+        def commit(i):
+            for attempt in range(2):
+                if not chunks[i]:
+                    return
+                try:
+                    commit_id, _ = self.commit_backend.commit_with_retries(
+                        chunks[i],
+                        f"{message} ({i + 1}/{len(chunks)})",
+                        max_retries=int(self.settings["UPLOAD_RETRIES"]),
+                        retry_backoff=float(self.settings["UPLOAD_BACKOFF"]),
+                        log=self.log,
+                    )
+                    break
+                except Exception as e:
+                    response = getattr(e, "response", None)
+                    if (
+                        attempt == 0
+                        and response is not None
+                        and response.status_code == 404
+                    ):
+                        # the index was out of date, list the files once for all chunks
+                        with refresh_lock:
+                            missing = find_missing(chunks[i], force=not refreshed)
+                            refreshed.append(True)
+                        if missing:
+                            leave_out(i, missing)
+                            continue
+                    summaries[i]["error"] = e
+                    return
+            summaries[i]["commit"] = commit_id
+            try:
+                self.update_repo_index(chunks[i], commit_id)
+            except Exception as e:
+                self.log(f"Failed to update the repository index: {e}", "error")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(commit, range(len(chunks))))
+        return summaries
+
+    def delete_files(
+        self,
+        paths: List[str],
+        chunk_size: int = 1000,
+        concurrency: int = 1,
+        dry_run: bool = False,
+    ) -> List[Dict]:
+        """
+        Delete files from the dataset repository in commits of at most chunk_size files, see batch_operations.
+
+        Args:
+            paths (list): The paths of the files within the repository. Paths ending with "/" delete a folder.
+            chunk_size (int): Maximum number of files deleted in a commit. Defaults to 1000.
+            concurrency (int): Number of commits made at the same time. Defaults to 1.
+            dry_run (bool): Only log the commits that would be made. Defaults to False.
+
+        Returns:
+            list: A dict for every commit, see batch_operations.
+        """
+        return self.batch_operations(
+            [CommitOperationDelete(path_in_repo=path) for path in paths],
+            chunk_size=chunk_size,
+            concurrency=concurrency,
+            dry_run=dry_run,
+            message="Delete files",
+        )
+
+    def file_exists(self, repo_id: str, path_in_repo: str) -> bool:
+        """
+        Check if a file exists in a Hugging Face repository. The dataset repository is checked in the repository
+        index, see refresh_repo_index, other repositories are listed on every call.
+
+        Args:
+            repo_id (str): The ID of the repository.
+            path_in_repo (str): The path of the file to check within the repository.
+
+        Returns:
+            bool: True if the file exists in the repository, False otherwise.
+
+        Raises:
+            Exception: If an error occurs while checking the existence of the file.
+        """
+        hf_token = self.settings.get("HF_TOKEN")
+        api = HfApi(token=hf_token)
+
+        try:
+            if repo_id == self.settings["HF_REPO_ID"]:
+                self.refresh_repo_index()
+                return bool(
+                    self.get_redis_connection().sismember(
+                        self.get_repo_index_key(), path_in_repo
+                    )
+                )
+            repo_files = api.list_repo_files(
+                repo_id=repo_id, repo_type="dataset", token=hf_token
+            )
+            return path_in_repo in repo_files
+        except Exception as e:
+            self.log(
+                f"Failed to check if {path_in_repo} exists in Hugging Face repo {repo_id}: {e}",
+                "error",
+            )
+            return False
+
+    def files_exist(self, paths: List[str]) -> List[bool]:
+        """
+        Check if files exist in the dataset repository, with one lookup in the repository index.
+
+        Args:
+            paths (list): The paths of the files within the repository.
+
+        Returns:
+            list: True for every path that exists. All False if the index can't be read.
+        """
+        if not paths:
+            return []
+        try:
+            self.refresh_repo_index()
+            exist = self.get_redis_connection().smismember(
+                self.get_repo_index_key(), paths
+            )
+            return [bool(value) for value in exist]
+        except Exception as e:
+            self.log(f"Failed to check if {len(paths)} files exist: {e}", "error")
+            return [False] * len(paths)
+
+    def outputs_exist(self, outputs: List[str]) -> bool:
+        """
+        Check if all outputs of a task exist in the dataset repository.
+
+        Args:
+            outputs (list): The paths of the outputs within the repository.
+
+        Returns:
+            bool: True if there are outputs and they all exist.
+        """
+        return bool(outputs) and all(self.files_exist(list(outputs)))
+
+    def list_files(self, repo_id: str) -> list:
+        """
+        Get a list of files from a Hugging Face repository. The files of the dataset repository are read from the
+        repository index, see refresh_repo_index.
+
+        Args:
+            repo_id (str): The ID of the repository.
+
+        Returns:
+            list: A list of file paths in the repository.
+
+        Raises:
+            Exception: If an error occurs while retrieving the list of files.
+        """
+        hf_token = self.settings.get("HF_TOKEN")
+        api = HfApi(token=hf_token)
+
+        try:
+            if repo_id == self.settings["HF_REPO_ID"]:
+                self.refresh_repo_index()
+                return sorted(
+                    bytes_to_str(path)
+                    for path in self.get_redis_connection().smembers(
+                        self.get_repo_index_key()
+                    )
+                )
+            repo_files = api.list_repo_files(
+                repo_id=repo_id, repo_type="dataset", token=hf_token
+            )
+            return repo_files
+        except Exception as e:
+            self.log(
+                f"Failed to get the list of files from Hugging Face repo {repo_id}: {e}",
+                "error",
+            )
+            return []
+
+    def get_vast_retry(self) -> VastRetry:
+        """
+        Returns the retry policy of Vast.ai API calls, set by the VAST_API_RETRIES and VAST_API_BACKOFF settings.
+
+        Returns:
+            VastRetry: The retry policy.
+        """
+        return VastRetry(
+            total=int(self.settings["VAST_API_RETRIES"]),
+            backoff_factor=float(self.settings["VAST_API_BACKOFF"]),
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET", "DELETE"),
+        )
+
+    def get_vast_session(self) -> requests.Session:
+        """
+        Returns the HTTP session shared by all Vast.ai API calls. Connections are kept alive and pooled. The
+        session doesn't retry, vast_request does, so that retries are rate limited too.
+
+        Returns:
+            requests.Session: The session.
+        """
+        if self.vast_session is None:
+            # enough connections for the default concurrency of rent_nodes and terminate_nodes
+            adapter = HTTPAdapter(pool_maxsize=16, max_retries=0)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            atexit.register(session.close)
+            self.vast_session = session
+        return self.vast_session
+
+    def vast_request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Call the Vast.ai API with the shared session, with the timeout set by VAST_API_TIMEOUT. Failed calls are
+        retried as described by VastRetry, and every attempt waits for the rate limit set by the VAST_API_RATE
+        and VAST_API_BURST settings.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            kwargs: Passed to requests.Session.request.
+
+        Returns:
+            requests.Response: The response, the last one if the retries are used up.
+
+        Raises:
+            requests.exceptions.RequestException: If the API can't be reached.
+        """
+        kwargs.setdefault("timeout", float(self.settings["VAST_API_TIMEOUT"]))
+        session = self.get_vast_session()
+        retry = self.get_vast_retry()
+        for attempt in range(retry.total + 1):
+            if attempt > 0:
+                time.sleep(wait_time)
+            self.vast_rate_limiter.acquire()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = getattr(e.args[0], "reason", None) if e.args else None
+                connect = isinstance(e, requests.exceptions.ConnectTimeout) or (
+                    isinstance(reason, NewConnectionError)
+                )
+                if attempt == retry.total or not retry.is_retryable_error(
+                    method, connect
+                ):
+                    raise
+                wait_time = retry.get_wait_time(attempt)
+                continue
+
+            if attempt < retry.total and retry.is_retry(method, response.status_code):
+                wait_time = retry.get_wait_time(
+                    attempt, response.headers.get("Retry-After")
+                )
+                response.close()
+                continue
+            return response
+
+    def search_offers(
+        self,
+        max_price: float,
+        min_gpu_ram: float = 4,
+        regions: List[str] = None,
+        min_cuda: float = None,
+        filters: Dict = None,
+        use_cache: bool = True,
+    ) -> List[Dict]:
+        """
+        Search for available offers to rent a node as an instance on the Vast.ai platform. Results are cached for
+        OFFER_CACHE_TTL seconds.
+
+        Args:
+            max_price (float): The maximum price per hour for the instance.
+            min_gpu_ram (float): The minimum GPU RAM in GB. Defaults to 4.
+            regions (List[str]): Country codes the instance must be located in (example: ["US", "CA"]).
+            Defaults to None (any region).
+            min_cuda (float): The minimum CUDA version supported by the host. Defaults to None.
+            filters (Dict): Additional Vast.ai search filters, for example {"reliability2": {"gte": 0.98}}.
+            Defaults to None.
+            use_cache (bool): Return cached results of the same search if they are recent enough. Defaults to True.
+
+        Returns:
+            List[Dict]: A list of dictionaries representing the available offers.
+
+        Raises:
+            requests.exceptions.RequestException: If there is an error while making the API request.
+        """
+        api_key = self.get_env("VAST_API_KEY")
+        base_url = f"{self.settings['VAST_API_URL']}/bundles/"
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        }
+        query = self.get_offer_query(max_price, min_gpu_ram, regions, min_cuda, filters)
+        params = {"q": json.dumps(query, sort_keys=True)}
+
+        cache_key = (base_url, params["q"])
+        cached = self.offer_cache.get(cache_key)
+        ttl = float(self.settings["OFFER_CACHE_TTL"])
+        if use_cache and cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+
+        try:
+            response = None
+            response = self.vast_request(
+                "GET", base_url, params=params, headers=headers
+            )
+            response.raise_for_status()
+            json_response = response.json()
+            self.offer_cache[cache_key] = (time.monotonic(), json_response["offers"])
+            return json_response["offers"]
+
+        except requests.exceptions.RequestException as e:
+            self.log(
+                f"Error: {e}\nResponse: {response.text if response is not None else 'No response'}"
+            )
+            raise
+
+    def get_offer_query(
+        self,
+        max_price: float,
+        min_gpu_ram: float = 4,
+        regions: List[str] = None,
+        min_cuda: float = None,
+        filters: Dict = None,
+    ) -> Dict:
+        """
+        Build the Vast.ai search query used by search_offers.
+
+        Args:
+            max_price (float): The maximum price per hour for the instance.
+            min_gpu_ram (float): The minimum GPU RAM in GB. Defaults to 4.
+            regions (List[str]): Country codes the instance must be located in. Defaults to None (any region).
+            min_cuda (float): The minimum CUDA version supported by the host. Defaults to None.
+            filters (Dict): Additional Vast.ai search filters. Defaults to None.
+
+        Returns:
+            Dict: The query.
+        """
+        query = {
+            # the offer API reports GPU RAM in MB
+            "gpu_ram": {"gte": min_gpu_ram * 1024},
+            "rentable": {"eq": True},
+            "dph_total": {"lte": max_price},
+            "order": [["dlperf_per_dphtotal", "desc"]],
+        }
+        if regions:
+            query["geolocation"] = {"in": list(regions)}
+        if min_cuda is not None:
+            query["cuda_max_good"] = {"gte": min_cuda}
+        query.update(filters or {})
+        return query
+
+    def rank_offers(
+        self, offers: List[Dict], gpu_durations: Dict[str, float] = None
+    ) -> List[Dict]:
+        """
+        Rank offers with the offer scorer, by default by expected throughput per dollar.
+
+        Args:
+            offers (List[Dict]): Offers returned by search_offers.
+            gpu_durations (Dict[str, float]): Average task duration per GPU model used by the default scorer.
+            Defaults to None (read with get_gpu_durations).
+
+        Returns:
+            List[Dict]: The offers, best first.
+        """
+        scorer = self.offer_scorer
+        if scorer is None:
+            if gpu_durations is None:
+                gpu_durations = self.get_gpu_durations()
+            scorer = ThroughputPerDollarScorer(gpu_durations)
+        return scorer.rank(offers)
+
+    def record_gpu_duration(self, gpu_name: str, duration: float) -> None:
+        """
+        Record the duration of a task that ran on a GPU model, used to rank offers.
+
+        Args:
+            gpu_name (str): The GPU model (example: "RTX 4090").
+            duration (float): The duration of the task in seconds.
+        """
+        pipe = self.get_redis_connection().pipeline(transaction=False)
+        pipe.hincrbyfloat("distributask-gpu-durations", f"{gpu_name}:seconds", duration)
+        pipe.hincrby("distributask-gpu-durations", f"{gpu_name}:tasks", 1)
+        pipe.execute()
+
+    def get_gpu_durations(self) -> Dict[str, float]:
+        """
+        Get the average measured task duration per GPU model.
+
+        Returns:
+            Dict[str, float]: Average task duration in seconds per GPU model.
+        """
+        return self.average_gpu_durations(
+            self.get_redis_connection().hgetall("distributask-gpu-durations")
+        )
+
+    @staticmethod
+    def average_gpu_durations(stats: Dict) -> Dict[str, float]:
+        """
+        Args:
+            stats (Dict): The hash written by record_gpu_duration.
+
+        Returns:
+            Dict[str, float]: Average task duration in seconds per GPU model.
+        """
+        stats = {bytes_to_str(key): float(value) for key, value in stats.items()}
+        durations = {}
+        for key, tasks in stats.items():
+            gpu_name, field = key.rsplit(":", 1)
+            if field == "tasks" and tasks > 0:
+                durations[gpu_name] = stats.get(f"{gpu_name}:seconds", 0) / tasks
+        return durations
+
+    def create_instance(
+        self,
+        offer_id: str,
+        image: str,
+        module_name: str,
+        env_settings: Dict,
+        command: str,
+        queues: List[str] = None,
+    ) -> Dict:
+        """
+        Create an instance on the Vast.ai platform. Passes in some useful Celery settings by default.
+
+        Args:
+            offer_id (str): The ID of the offer to create the instance from.
+            image (str): The image to use for the instance. (example: RaccoonResearch/distributask-test-worker)
+            module_name (str): The name of the module to run on the instance, configured to be a docker file (example: distributask.example.worker)
+            command (str): Command that initializes celery worker. Has default command with specific settings if not passed in. These settings have
+            been found to be beneficial to the stability and simplicity of a Distributask run.
+            env_settings (Dict): Used to pass in environment variables to the Vast.ai instance. This is a dictionary with keys of the
+            environment variable name and values of the desired value of the environment variable.
+            queues (List[str]): Queues the worker started by the default command consumes. Defaults to None (the
+            default "celery" queue).
+
+        Returns:
+            Dict: A dictionary representing the created instance.
+
+        Raises:
+            ValueError: If the Vast.ai API key is not set in the environment.
+            Exception: If there is an error while creating the instance.
+        """
+        json_blob = self.get_instance_request(
+            offer_id, image, module_name, env_settings, command, queues
+        )
+        url = f"{self.settings['VAST_API_URL']}/asks/{offer_id}/?api_key={self.get_env('VAST_API_KEY')}"
+        headers = {"Authorization": f"Bearer {self.get_env('VAST_API_KEY')}"}
+        response = self.vast_request("PUT", url, headers=headers, json=json_blob)
+
+        if response.status_code != 200:
+            self.log(f"Failed to create instance: {response.text}", "error")
+            raise Exception(f"Failed to create instance: {response.text}")
+
+        return response.json()
+
+    def get_instance_request(
+        self,
+        offer_id: str,
+        image: str,
+        module_name: str,
+        env_settings: Dict,
+        command: str,
+        queues: List[str] = None,
+    ) -> Dict:
+        """
+        Build the request body used by create_instance.
+
+        Args:
+            offer_id (str): The ID of the offer, used to name the worker.
+            image (str): The image to use for the instance.
+            module_name (str): The name of the module to run on the instance.
+            env_settings (Dict): Environment variables passed to the instance, see get_node_env. Defaults to the
+            settings if None.
+            command (str): Command that starts the Celery worker. Defaults to the default command if None.
+            queues (List[str]): Queues the worker started by the default command consumes. Defaults to None.
+
+        Returns:
+            Dict: The request body.
+
+        Raises:
+            ValueError: If the Vast.ai API key is not set in the environment.
+        """
+        if self.get_env("VAST_API_KEY") is None:
+            self.log("VAST_API_KEY is not set in the environment", "error")
+            raise ValueError("VAST_API_KEY is not set in the environment")
+
+        if command is None:
+            command = f"celery -A {module_name} worker --loglevel=info --concurrency=1 --without-heartbeat --prefetch-multiplier=1 --hostname={self.get_worker_name(offer_id)}"
+            if queues:
+                command += f" -Q {','.join(queues)}"
+
+        if env_settings is None:
+            env_settings = self.settings
+
+        return {
+            "client_id": "me",
+            "image": image,
+            "env": self.get_node_env(env_settings),
+            "disk": 32,  # Set a non-zero value for disk
+            "onstart": f"export PATH=$PATH:/ && cd ../ && {command}",
+            "runtype": "ssh ssh_proxy",
+        }
+
+    def get_node_env(self, env_settings: Dict) -> Dict[str, str]:
+        """
+        Convert settings to the environment variables of a node. Unset settings are left out, so the worker uses
+        its defaults instead of the string "None", and booleans become "true" or "false".
+
+        Args:
+            env_settings (Dict): The settings, or other environment variables.
+
+        Returns:
+            Dict[str, str]: The environment variables.
+        """
+        env = {}
+        for key, value in env_settings.items():
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            env[key] = str(value)
+        return env
+
+    def destroy_instance(self, instance_id: str) -> Dict:
+        """
+        Destroy an instance on the Vast.ai platform.
+
+        Args:
+            instance_id (str): The ID of the instance to destroy.
+
+        Returns:
+            Dict: A dictionary representing the result of the destroy operation.
+        """
+        api_key = self.get_env("VAST_API_KEY")
+        headers = {"Authorization": f"Bearer {api_key}"}
+        url = f"{self.settings['VAST_API_URL']}/instances/{instance_id}/?api_key={api_key}"
+        response = self.vast_request("DELETE", url, headers=headers)
+        return response
+
+    def get_instance(self, instance_id: str) -> Dict:
+        """
+        Get an instance on the Vast.ai platform.
+
+        Args:
+            instance_id (str): The ID of the instance.
+
+        Returns:
+            Dict: A dictionary representing the instance, or None if the instance doesn't exist.
+
+        Raises:
+            requests.exceptions.RequestException: If there is an error while making the API request.
+        """
+        api_key = self.get_env("VAST_API_KEY")
+        headers = {"Authorization": f"Bearer {api_key}"}
+        url = f"{self.settings['VAST_API_URL']}/instances/{instance_id}/?api_key={api_key}"
+        response = self.vast_request("GET", url, headers=headers)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json().get("instances") or None
+
+    def rent_nodes(
+        self,
+        max_price: float,
+        max_nodes: int,
+        image: str,
+        module_name: str,
+        env_settings: Dict = None,
+        command: str = None,
+        concurrency: int = 8,
+        queues: List[str] = None,
+        **search_options,
+    ) -> List[Dict]:
+        """
+        Rent nodes as an instance on the Vast.ai platform. Offers are ranked with rank_offers and tried best
+        first, up to concurrency at the same time, and renting stops as soon as max_nodes instances have been
+        created. Calls to the Vast.ai API are rate limited by the VAST_API_RATE and VAST_API_BURST settings.
+
+        Args:
+            max_price (float): The maximum price per hour for the nodes.
+            max_nodes (int): The maximum number of nodes to rent.
+            image (str): The image to use for the nodes.
+            module_name (str): The name of the module to run on the nodes.
+            env_settings (Dict): Environment variables passed to the nodes. Defaults to the settings.
+            command (str): Command that starts the Celery worker. Defaults to the command of create_instance.
+            concurrency (int): Maximum number of offers tried at the same time. Defaults to 8.
+            queues (List[str]): Queues the workers consume, see create_instance. Defaults to None (the default
+            "celery" queue).
+            search_options: Filters passed to search_offers (min_gpu_ram, regions, min_cuda, filters).
+
+        Returns:
+            List[Dict]: A list of dictionaries representing the rented nodes. If an offer can't be rented, the
+            next offer is tried, and new offers are searched for when all offers have been tried.
+        """
+        rented_nodes: List[Dict] = []
+        tried_offers = set()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            while len(rented_nodes) < max_nodes:
+                offers = []
+                search_retries = 10
+                while search_retries > 0:
+                    try:
+                        # cached offers are fine for the first search, later searches look for new offers
+                        offers = self.search_offers(
+                            max_price, use_cache=not tried_offers, **search_options
+                        )
+                        break
+                    except Exception as e:
+                        self.log(
+                            f"Error searching for offers: {str(e)} - retrying in 10 seconds...",
+                            "error",
+                        )
+                        search_retries -= 1
+                        # sleep for 10 seconds before retrying
+                        time.sleep(10)
+                        continue
+
+                offers = self.rank_offers(
+                    [offer for offer in offers if offer["id"] not in tried_offers]
+                )
+                if not offers:
+                    self.log(
+                        "No more offers available - stopping node rental", "warning"
+                    )
+                    break
+
+                offers = iter(offers)
+                pending = {}
+                try:
+                    while len(rented_nodes) < max_nodes:
+                        # only try as many offers as there are nodes left to rent
+                        needed = max_nodes - len(rented_nodes)
+                        while len(pending) < min(concurrency, needed):
+                            offer = next(offers, None)
+                            if offer is None:
+                                break
+                            tried_offers.add(offer["id"])
+                            # the GPU model lets workers record task durations per model
+                            node_env = dict(
+                                env_settings
+                                if env_settings is not None
+                                else self.settings
+                            )
+                            if offer.get("gpu_name"):
+                                node_env["GPU_NAME"] = offer["gpu_name"]
+                            future = executor.submit(
+                                self.create_instance,
+                                offer["id"],
+                                image,
+                                module_name,
+                                env_settings=node_env,
+                                command=command,
+                                queues=queues,
+                            )
+                            pending[future] = offer
+                        if not pending:
+                            break  # all offers have been tried, search for new ones
+
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            node = self.get_rented_node(
+                                pending.pop(future), future, command
+                            )
+                            if node is None:
+                                continue
+                            if len(rented_nodes) < max_nodes:
+                                rented_nodes.append(node)
+                                self.rented_nodes[node["instance_id"]] = node
+                            else:
+                                self.destroy_instance(node["instance_id"])
+                finally:
+                    # cancel the offers that haven't been tried and destroy surplus instances
+                    for future in pending:
+                        future.cancel()
+                    for future, offer in pending.items():
+                        if not future.cancelled():
+                            node = self.get_rented_node(offer, future, command)
+                            if node is not None:
+                                self.destroy_instance(node["instance_id"])
+
+        atexit.register(self.terminate_nodes, rented_nodes)
+        return rented_nodes
+
+    def get_rented_node(self, offer: Dict, future, command: str = None) -> Dict:
+        """
+        Wait for a create_instance call made by rent_nodes and describe the rented node.
+
+        Args:
+            offer (Dict): The offer the instance was created from.
+            future (concurrent.futures.Future): The future of the create_instance call.
+            command (str): The command passed to create_instance. Defaults to None.
+
+        Returns:
+            Dict: The offer ID, instance ID and price per hour of the rented node, and the Celery worker name
+            when the default worker command is used. None if the offer couldn't be rented.
+        """
+        try:
+            instance = future.result()
+        except Exception as e:
+            self.log(f"Error renting node from offer {offer['id']}: {str(e)}", "error")
+            return None
+        return self.get_node(offer, instance, command)
+
+    def get_node(self, offer: Dict, instance: Dict, command: str = None) -> Dict:
+        """
+        Describe a node rented from an offer.
+
+        Args:
+            offer (Dict): The offer the instance was created from.
+            instance (Dict): The response of create_instance.
+            command (str): The command passed to create_instance. Defaults to None.
+
+        Returns:
+            Dict: The offer ID, instance ID and price per hour of the rented node, and the Celery worker name
+            when the default worker command is used.
+        """
+        node = {
+            "offer_id": offer["id"],
+            "instance_id": instance["new_contract"],
+            "dph_total": offer.get("dph_total"),
+        }
+        if command is None:
+            node["worker"] = self.get_worker_name(offer["id"])
+        return node
+
+    def get_worker_name(self, offer_id: str) -> str:
+        """
+        Get the name of the Celery worker started by create_instance with the default command.
+
+        Args:
+            offer_id (str): The ID of the offer the instance was created from.
+
+        Returns:
+            str: The Celery worker name.
+        """
+        return f"celery@vast-{offer_id}"
+
+    def get_node_log(self, node: Dict, wait_time: int = 2):
+        """
+        Get the log of the Vast.ai instance that is passed in. Makes an api call to tell the instance to send the log,
+        and another one to actually retrive the log
+        Args:
+            node (Dict): the node that corresponds to the Vast.ai instance you want the log from
+            wait_time (int): how long to wait in between the two api calls described above
+
+        Returns:
+            str: the log of the instance requested. If anything else other than a code 200 is received, return None
+        """
+        node_id = node["instance_id"]
+        url = f"{self.settings['VAST_API_URL']}/instances/request_logs/{node_id}/"
+
+        payload = {"tail": "1000"}
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.settings['VAST_API_KEY']}",
+        }
+
+        response = self.vast_request("PUT", url, headers=headers, json=payload)
+
+        if response.status_code == 200:
+            log_url = response.json()["result_url"]
+            time.sleep(wait_time)
+            log_response = self.get_vast_session().get(
+                log_url, timeout=float(self.settings["VAST_API_TIMEOUT"])
+            )
+            if log_response.status_code == 200:
+                return log_response
+            else:
+                return None
+        else:
+            return None
+
+    def terminate_nodes(
+        self,
+        nodes: List[Dict],
+        concurrency: int = 8,
+        max_retries: int = 4,
+        backoff: float = 1.0,
+    ) -> List[Dict]:
+        """
+        Terminate the instances of rented nodes on Vast.ai. Instances are destroyed concurrently, within the
+        Vast.ai API rate limit, and each one is checked to be gone afterwards. Failed or unconfirmed destroys are
+        retried with exponential backoff.
+
+        Args:
+            nodes (List[Dict]): A list of dictionaries representing the rented nodes.
+            concurrency (int): Maximum number of instances destroyed at the same time. Defaults to 8.
+            max_retries (int): Number of times a destroy is retried. Defaults to 4.
+            backoff (float): Seconds to wait before the first retry, doubled for every later retry. Defaults to 1.
+
+        Returns:
+            List[Dict]: A report for every node, in the order of nodes, with the instance_id, whether the
+            instance was confirmed terminated, the number of attempts and the last error.
+        """
+        print("Terminating nodes...")
+        if not nodes:
+            return []
+
+        # plain threads over a shared queue, unlike a ThreadPoolExecutor they can still be started in an atexit
+        # hook, which is where terminate_nodes usually runs
+        jobs = Queue()
+        for index, node in enumerate(nodes):
+            jobs.put((index, node))
+        reports = [None] * len(nodes)
+
+        def work():
+            while True:
+                try:
+                    index, node = jobs.get_nowait()
+                except Empty:
+                    return
+                reports[index] = self.terminate_node(node, max_retries, backoff)
+
+        workers = []
+        for _ in range(min(concurrency, len(nodes)) - 1):
+            worker = threading.Thread(target=work, name="distributask-terminate")
+            try:
+                worker.start()
+            except RuntimeError:
+                # the interpreter is finalizing, the calling thread works through the queue alone
+                break
+            workers.append(worker)
+        work()
+        for worker in workers:
+            worker.join()
+
+        for report in reports:
+            if not report["terminated"]:
+                self.log(
+                    f"Error terminating node: {report['instance_id']}, {report['error']}",
+                    "error",
+                )
+        return reports
+
+    def terminate_node(
+        self, node: Dict, max_retries: int = 4, backoff: float = 1.0
+    ) -> Dict:
+        """
+        Destroy the instance of a rented node and confirm that it is gone, retrying with exponential backoff.
+
+        Args:
+            node (Dict): The rented node.
+            max_retries (int): Number of times the destroy is retried. Defaults to 4.
+            backoff (float): Seconds to wait before the first retry, doubled for every later retry. Defaults to 1.
+
+        Returns:
+            Dict: The instance_id, whether the instance was confirmed terminated, the number of attempts and the
+            last error.
+        """
+        instance_id = node["instance_id"]
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                response = self.destroy_instance(instance_id)
+                # 404 means the instance is already gone
+                if response.status_code not in (200, 404):
+                    raise Exception(
+                        f"destroy returned {response.status_code}: {response.text}"
+                    )
+                if self.get_instance(instance_id) is None:
+                    self.rented_nodes.pop(instance_id, None)
+                    return {
+                        "instance_id": instance_id,
+                        "terminated": True,
+                        "attempts": attempt + 1,
+                        "error": None,
+                    }
+                error = "instance still exists after destroy"
+            except Exception as e:
+                error = str(e)
+
+        return {
+            "instance_id": instance_id,
+            "terminated": False,
+            "attempts": max_retries + 1,
+            "error": error,
+        }
+
+    def get_task_ids(self, tasks) -> List[str]:
+        """
+        Get the IDs of the tasks returned by execute_function or execute_many.
+
+        Args:
+            tasks (List | TaskBatch): A list of AsyncResult objects or a TaskBatch.
+
+        Returns:
+            List[str]: The task IDs.
+        """
+        if isinstance(tasks, TaskBatch):
+            return list(tasks.task_ids)
+        return [task.id for task in tasks]
+
+    def get_ready_task_meta(self, task_ids, chunk_size: int = 1000) -> Dict[str, Dict]:
+        """
+        Look up the result metadata of the given tasks with pipelined MGET calls and return the tasks that
+        have finished.
+
+        Args:
+            task_ids (Iterable[str]): The IDs of the tasks to check.
+            chunk_size (int): Number of keys requested per MGET. Defaults to 1000.
+
+        Returns:
+            Dict[str, Dict]: Maps the ID of every finished task to its decoded result metadata.
+        """
+        backend = self.app.backend
+        task_ids = list(task_ids)
+        ready = {}
+        with self.get_redis_connection().pipeline(transaction=False) as pipe:
+            for i in range(0, len(task_ids), chunk_size):
+                pipe.mget(
+                    [
+                        backend.get_key_for_task(task_id)
+                        for task_id in task_ids[i : i + chunk_size]
+                    ]
+                )
+            values = itertools.chain.from_iterable(pipe.execute())
+
+        for task_id, value in zip(task_ids, values):
+            if value is None:
+                continue
+            meta = backend.decode_result(value)
+            if meta["status"] in states.READY_STATES:
+                ready[task_id] = meta
+        return ready
+
+    def iter_ready_tasks(
+        self,
+        task_ids,
+        update_interval: float = 1,
+        resync_interval: float = 30,
+        speculator: "Speculator" = None,
+    ):
+        """
+        Track a set of tasks until all of them have finished, yielding the tasks that finished during each
+        update interval. Completions are received from the result backend's pub/sub channel, so each update
+        costs O(completions) instead of a Redis lookup per task. The unfinished tasks are re-checked with
+        pipelined MGET calls once at the start and then every resync_interval seconds, in case a message was
+        missed.
+
+        Args:
+            task_ids (Iterable[str]): The IDs of the tasks to track.
+            update_interval (float): Seconds between yields. Defaults to 1.
+            resync_interval (float): Seconds between MGET checks of the unfinished tasks. Defaults to 30.
+            speculator (Speculator): Duplicates stragglers once the queue is empty. Defaults to None (no
+            speculative execution).
+
+        Yields:
+            Dict[str, Dict]: Maps the ID of every task that finished since the previous yield to its decoded
+            result metadata. Can be empty.
+        """
+        backend = self.app.backend
+        prefix = backend.task_keyprefix
+        pending = set(task_ids)
+
+        # subscribe before the first check so no completion falls in between
+        pubsub = self.get_redis_connection().pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(prefix + backend.key_t("*"))
+        try:
+            ready = self.get_ready_task_meta(pending)
+            pending.difference_update(ready)
+            last_resync = time.monotonic()
+            yield ready
+
+            while pending:
+                ready = {}
+                deadline = time.monotonic() + update_interval
+                while pending and time.monotonic() < deadline:
+                    message = pubsub.get_message(timeout=deadline - time.monotonic())
+                    if message is None:
+                        continue
+                    task_id = bytes_to_str(
+                        backend.key_t(message["channel"])[len(prefix) :]
+                    )
+                    if task_id not in pending:
+                        continue
+                    meta = backend.decode_result(message["data"])
+                    if meta["status"] in states.READY_STATES:
+                        ready[task_id] = meta
+                        pending.discard(task_id)
+
+                if pending and time.monotonic() - last_resync >= resync_interval:
+                    missed = self.get_ready_task_meta(pending)
+                    pending.difference_update(missed)
+                    ready.update(missed)
+                    last_resync = time.monotonic()
+                if speculator is not None:
+                    speculator.resolve(ready)
+                    if pending:
+                        speculator.check(pending)
+                yield ready
+        finally:
+            pubsub.close()
+
+    def as_completed(
+        self,
+        tasks,
+        timeout: float = None,
+        update_interval: float = 0.1,
+        speculate=False,
+    ):
+        """
+        Yield the result of each task as soon as it finishes, in order of completion. Builds on
+        iter_ready_tasks, so tasks are not polled one by one.
+
+        Args:
+            tasks (List | TaskBatch): The tasks to wait for. Should be a list of the results of
+            execute_function or the TaskBatch returned by execute_many.
+            timeout (float): Seconds to wait for all tasks to finish. Defaults to None (wait forever).
+            update_interval (float): Maximum number of seconds a finished task waits before it is yielded.
+            Defaults to 0.1.
+            speculate (bool | Speculator): Re-execute stragglers once the queue is empty, pass a Speculator to
+            tune when. Defaults to False.
+
+        Yields:
+            Tuple[str, any]: The task ID and the return value of the task, or the exception it raised.
+
+        Raises:
+            celery.exceptions.TimeoutError: If the tasks have not all finished within timeout seconds.
+        """
+        task_ids = set(self.get_task_ids(tasks))
+        completed = 0
+        start = time.monotonic()
+
+        speculator = Speculator(self) if speculate is True else speculate or None
+        for ready in self.iter_ready_tasks(
+            task_ids, update_interval, speculator=speculator
+        ):
+            for task_id, meta in ready.items():
+                completed += 1
+                yield task_id, self.load_payload(meta["result"])
+
+            if (
+                timeout is not None
+                and completed < len(task_ids)
+                and time.monotonic() - start >= timeout
+            ):
+                raise TaskTimeoutError(
+                    f"{len(task_ids) - completed} tasks did not finish within {timeout} seconds"
                 )
-                api.create_repo(
-                    repo_id=repo_id, token=hf_token, repo_type="dataset", **kwargs
+
+    def monitor_tasks(
+        self,
+        tasks,
+        update_interval=1,
+        show_time_left=True,
+        print_statements=True,
+        resync_interval=30,
+        speculate=False,
+    ):
+        """
+        Monitor the status of the tasks on the Vast.ai nodes.
+
+        Args:
+            tasks (List | TaskBatch): The tasks to monitor. Should be a list of the results of execute_function
+            or the TaskBatch returned by execute_many.
+            update_interval (bool): Number of seconds the status of tasks are updated.
+            show_time_left (bool): Show the estimated time left to complete tasks using the tqdm progress bar
+            print_statments (bool): Allow printing of status of task queue
+            resync_interval (float): Number of seconds between full checks of the unfinished tasks, see
+            iter_ready_tasks.
+            speculate (bool | Speculator): Re-execute stragglers once the queue is empty, pass a Speculator to
+            tune when. Defaults to False.
+
+        Raises:
+            Exception: If error in the process of executing the tasks
+        """
+        task_ids = set(self.get_task_ids(tasks))
+        completed = 0
+
+        try:
+            # Wait for the tasks to complete
+            if print_statements:
+                print("Tasks submitted to queue. Starting queue...")
+                print("Elapsed time<Estimated time to completion")
+            with tqdm(total=len(task_ids), unit="task") as pbar:
+                speculator = (
+                    Speculator(self) if speculate is True else speculate or None
                 )
-            else:
-                raise e
+                for ready in self.iter_ready_tasks(
+                    task_ids, update_interval, resync_interval, speculator
+                ):
+                    completed += len(ready)
+                    pbar.update(len(ready))
+        except Exception as e:
+            self.log(f"Error in executing tasks on nodes, {str(e)}")
 
-        # Create config.json file
-        config = {
-            "data_loader_name": "custom",
-            "data_loader_kwargs": {
-                "path": repo_id,
-                "format": "files",
-                "fields": ["file_path", "text"],
-            },
+        if completed == len(task_ids):
+            print("All tasks completed.")
+
+
+class Autoscaler:
+    """
+    Rents and releases Vast.ai nodes to keep the backlog, the number of queued and in-flight tasks, per node near
+    a target. Nodes are rented with Distributask.rent_nodes. A node that is no longer needed first stops consuming
+    from the queue, and is destroyed once its worker has finished its tasks or drain_timeout has passed.
+    """
+
+    def __init__(
+        self,
+        distributask: "Distributask",
+        max_price: float,
+        image: str,
+        module_name: str,
+        min_nodes: int = 0,
+        max_nodes: int = 10,
+        target_backlog: int = 10,
+        max_hourly_cost: float = None,
+        queue: str = "celery",
+        scale_down_delay: float = 60,
+        drain_timeout: float = 600,
+        inspect_timeout: float = 1.0,
+        env_settings: Dict = None,
+        command: str = None,
+        nodes: List[Dict] = None,
+    ) -> None:
+        """
+        Args:
+            distributask (Distributask): The Distributask object used to read the queue and manage nodes.
+            max_price (float): The maximum price per hour for a node.
+            image (str): The image to use for the nodes.
+            module_name (str): The name of the module to run on the nodes.
+            min_nodes (int): Nodes kept even when the queue is empty. Defaults to 0.
+            max_nodes (int): Maximum number of nodes. Defaults to 10.
+            target_backlog (int): Queued and in-flight tasks per node to aim for. Defaults to 10.
+            max_hourly_cost (float): Maximum total price per hour of all nodes. Defaults to None (no limit).
+            queue (str): The queue to watch. Defaults to "celery".
+            scale_down_delay (float): Seconds fewer nodes must be needed before nodes are released. Defaults to 60.
+            drain_timeout (float): Seconds a released node is given to finish its tasks. Defaults to 600.
+            inspect_timeout (float): Seconds to wait for workers to reply when checking if they are idle.
+            Defaults to 1.
+            env_settings (Dict): Environment variables passed to the nodes. Defaults to the settings.
+            command (str): Command that starts the Celery worker. Nodes started with a custom command can't be
+            drained individually, they are only destroyed when no task is in flight. Defaults to None.
+            nodes (List[Dict]): Already rented nodes to manage. Defaults to None.
+        """
+        self.distributask = distributask
+        self.max_price = max_price
+        self.image = image
+        self.module_name = module_name
+        self.min_nodes = min_nodes
+        self.max_nodes = max_nodes
+        self.target_backlog = target_backlog
+        self.max_hourly_cost = max_hourly_cost
+        self.queue = queue
+        self.scale_down_delay = scale_down_delay
+        self.drain_timeout = drain_timeout
+        self.inspect_timeout = inspect_timeout
+        self.env_settings = env_settings
+        self.command = command
+        self.nodes = list(nodes) if nodes is not None else []
+        self.draining: List[Dict] = []
+        self.scale_down_since = None
+        self.stopped = threading.Event()
+
+    def get_desired_nodes(self, backlog: int) -> int:
+        """
+        Get the number of nodes needed for a backlog, within min_nodes and max_nodes.
+
+        Args:
+            backlog (int): The number of queued and in-flight tasks.
+
+        Returns:
+            int: The number of nodes.
+        """
+        desired = math.ceil(backlog / self.target_backlog)
+        return max(self.min_nodes, min(self.max_nodes, desired))
+
+    def get_hourly_cost(self) -> float:
+        """
+        Returns:
+            float: The total price per hour of the managed nodes, including nodes that are draining.
+        """
+        return sum(
+            node.get("dph_total") or self.max_price
+            for node in self.nodes + self.draining
+        )
+
+    def step(self) -> Dict:
+        """
+        Read the queue, destroy drained nodes, and rent or release nodes once.
+
+        Returns:
+            Dict: The number of queued and in-flight tasks, the desired number of nodes, and the number of active
+            and draining nodes after the step.
+        """
+        queued = self.distributask.get_queue_length(self.queue)
+        in_flight = self.distributask.get_in_flight_count()
+        desired = self.get_desired_nodes(queued + in_flight)
+
+        self.destroy_drained_nodes(in_flight)
+
+        if desired > len(self.nodes):
+            self.scale_down_since = None
+            self.scale_up(desired - len(self.nodes))
+        elif desired < len(self.nodes):
+            now = time.monotonic()
+            if self.scale_down_since is None:
+                self.scale_down_since = now
+            if now - self.scale_down_since >= self.scale_down_delay:
+                self.scale_down(len(self.nodes) - desired)
+                self.scale_down_since = None
+        else:
+            self.scale_down_since = None
+
+        return {
+            "queued": queued,
+            "in_flight": in_flight,
+            "desired": desired,
+            "nodes": len(self.nodes),
+            "draining": len(self.draining),
         }
 
-        # apply config.json to created repo
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with Repository(
-                local_dir=temp_dir,
-                clone_from=repo_id,
-                repo_type="dataset",
-                use_auth_token=hf_token,
-            ).commit(commit_message="Add config.json"):
-                with open(os.path.join(temp_dir, "config.json"), "w") as f:
-                    json.dump(config, f, indent=2)
+    def scale_up(self, count: int) -> None:
+        """
+        Rent up to count nodes, within max_hourly_cost.
 
-        self.log(f"Initialized repository {repo_id}.")
+        Args:
+            count (int): The number of nodes to rent.
+        """
+        if self.max_hourly_cost is not None:
+            budget = self.max_hourly_cost - self.get_hourly_cost()
+            count = min(count, math.floor(budget / self.max_price))
+        if count <= 0:
+            return
+
+        self.distributask.log(f"Autoscaler renting {count} nodes")
+        self.nodes.extend(
+            self.distributask.rent_nodes(
+                self.max_price,
+                count,
+                self.image,
+                self.module_name,
+                env_settings=self.env_settings,
+                command=self.command,
+                queues=[self.queue],
+            )
+        )
 
-    # upload a single file to the Hugging Face repository
-    def upload_file(self, file_path: str) -> None:
+    def scale_down(self, count: int) -> None:
         """
-        Upload a file to a Hugging Face repository.
+        Stop the most expensive nodes from taking new tasks and start draining them.
 
         Args:
-            file_path (str): The path of the file to upload.
+            count (int): The number of nodes to release.
+        """
+        self.nodes.sort(key=lambda node: node.get("dph_total") or 0)
+        released, self.nodes = self.nodes[-count:], self.nodes[:-count]
+        deadline = time.monotonic() + self.drain_timeout
+        workers = [node["worker"] for node in released if "worker" in node]
+        if workers:
+            # with a broker pool limit of 1, broadcasting on a pooled connection would deadlock with the producer
+            with self.distributask.app.connection_for_write() as connection:
+                self.distributask.app.control.cancel_consumer(
+                    self.queue, destination=workers, connection=connection
+                )
+        for node in released:
+            node["drain_deadline"] = deadline
+        self.draining.extend(released)
+        self.distributask.log(f"Autoscaler draining {len(released)} nodes")
+
+    def destroy_drained_nodes(self, in_flight: int) -> None:
+        """
+        Destroy the draining nodes whose worker has no active or reserved tasks left, or whose drain_timeout
+        has passed. Workers that don't reply are considered drained.
+
+        Args:
+            in_flight (int): The number of in-flight tasks, used for nodes whose worker name isn't known.
+        """
+        if not self.draining:
+            return
+
+        workers = [node["worker"] for node in self.draining if "worker" in node]
+        busy = set()
+        if workers:
+            with self.distributask.app.connection_for_write() as connection:
+                inspector = self.distributask.app.control.inspect(
+                    destination=workers,
+                    timeout=self.inspect_timeout,
+                    connection=connection,
+                )
+                for replies in (inspector.active() or {}, inspector.reserved() or {}):
+                    busy.update(worker for worker, tasks in replies.items() if tasks)
+
+        now = time.monotonic()
+        drained = [
+            node
+            for node in self.draining
+            if now >= node["drain_deadline"]
+            or ("worker" in node and node["worker"] not in busy)
+            or ("worker" not in node and in_flight == 0)
+        ]
+        for node in drained:
+            self.draining.remove(node)
+            report = self.distributask.terminate_node(node)
+            if not report["terminated"]:
+                self.distributask.log(
+                    f"Error terminating node: {report['instance_id']}, {report['error']}",
+                    "error",
+                )
+
+    def run(self, interval: float = 30) -> None:
+        """
+        Scale the nodes every interval seconds until stop is called, then terminate every managed node.
+
+        Args:
+            interval (float): Seconds between two steps. Defaults to 30.
+        """
+        try:
+            while not self.stopped.is_set():
+                self.step()
+                self.stopped.wait(interval)
+        finally:
+            self.distributask.terminate_nodes(self.nodes + self.draining)
+            self.nodes, self.draining = [], []
+
+    def stop(self) -> None:
+        """
+        Stop a running autoscaler. Can be called from another thread.
+        """
+        self.stopped.set()
+
+
+class Speculator:
+    """
+    Speculative execution of stragglers for the monitoring loop of Distributask.iter_ready_tasks. Once the queue
+    is empty, every tracked task that has been running for much longer than the usual duration of its function
+    gets a duplicate. The duplicate stores its result on the original task, so whichever finishes first wins, and
+    the other one is revoked. Task durations are read from the telemetry stream, so TELEMETRY must be enabled on
+    the workers.
+    """
+
+    def __init__(
+        self,
+        distributask: "Distributask",
+        multiplier: float = 3.0,
+        percentile: float = 95,
+        min_samples: int = 5,
+        min_runtime: float = 10,
+        interval: float = 5,
+        queue: str = "celery",
+        max_samples: int = 1000,
+    ) -> None:
+        """
+        Args:
+            distributask (Distributask): The Distributask object the tasks were submitted with.
+            multiplier (float): A task is a straggler once it has been running for multiplier times the
+            percentile of the durations of its function. Defaults to 3.
+            percentile (float): The percentile of the durations used for the threshold. Defaults to 95.
+            min_samples (int): Durations of a function needed before its tasks are duplicated. Defaults to 5.
+            min_runtime (float): Tasks that have been running for less than this many seconds are never
+            duplicated. Defaults to 10.
+            interval (float): Seconds between two checks for stragglers. Defaults to 5.
+            queue (str): The queue that must be empty before tasks are duplicated. Defaults to "celery".
+            max_samples (int): Most recent durations kept per function. Defaults to 1000.
+        """
+        self.distributask = distributask
+        self.multiplier = multiplier
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_runtime = min_runtime
+        self.interval = interval
+        self.queue = queue
+        self.max_samples = max_samples
+        self.durations: Dict[str, deque] = {}
+        self.duplicates: Dict[str, str] = {}
+        self.last_entry = "-"
+        self.last_check = 0
+
+    def update_durations(self, chunk_size: int = 10000) -> None:
+        """
+        Read the durations of successful tasks added to the telemetry stream since the previous update.
+
+        Args:
+            chunk_size (int): Number of stream entries read per request. Defaults to 10000.
+        """
+        redis_client = self.distributask.get_redis_connection()
+        while True:
+            entries = redis_client.xrange(
+                "distributask-telemetry", min=self.last_entry, count=chunk_size
+            )
+            for entry_id, fields in entries:
+                fields = {
+                    bytes_to_str(key): bytes_to_str(value)
+                    for key, value in fields.items()
+                }
+                if fields["outcome"] == "success":
+                    self.durations.setdefault(
+                        fields["function"], deque(maxlen=self.max_samples)
+                    ).append(float(fields["execution"]))
+            if entries:
+                self.last_entry = "(" + bytes_to_str(entries[-1][0])
+            if len(entries) < chunk_size:
+                break
+
+    def get_threshold(self, func_name: str) -> float:
+        """
+        Args:
+            func_name (str): The name of the function.
+
+        Returns:
+            float: Seconds after which a task of the function is a straggler, or None if too few durations have
+            been recorded.
+        """
+        durations = self.durations.get(func_name, ())
+        if len(durations) < self.min_samples:
+            return None
+        usual = get_percentile(sorted(durations), self.percentile)
+        return max(self.min_runtime, self.multiplier * usual)
+
+    def check(self, pending) -> Dict[str, str]:
+        """
+        Duplicate the stragglers among the pending tasks, at most once every interval seconds.
+
+        Args:
+            pending (Iterable[str]): IDs of the tracked tasks that haven't finished.
+
+        Returns:
+            Dict[str, str]: Maps the ID of every task that was duplicated by this call to the ID of its duplicate.
+        """
+        if time.monotonic() - self.last_check < self.interval:
+            return {}
+        self.last_check = time.monotonic()
+        if self.distributask.get_queue_length(self.queue) > 0:
+            return {}
+
+        self.update_durations()
+        running = self.distributask.get_running_tasks(pending)
+        now = time.time()
+        duplicated = {}
+        for task_id, task in running.items():
+            if task_id in self.duplicates:
+                continue
+            func_name, args = self.distributask.get_message_args(task["message"])
+            threshold = self.get_threshold(func_name)
+            if threshold is None or now - task["delivered_at"] < threshold:
+                continue
+            duplicate = self.distributask.send_task(
+                func_name, args, headers={"speculative_of": task_id}
+            )
+            self.duplicates[task_id] = duplicated[task_id] = duplicate.id
+            self.distributask.log(
+                f"Task {task_id} has been running for {now - task['delivered_at']:.0f}s, started duplicate {duplicate.id}"
+            )
+        return duplicated
+
+    def resolve(self, ready) -> None:
+        """
+        Revoke the original and the duplicate of every finished task that was duplicated. One of them has finished
+        and revoking it has no effect, the other one is stopped.
+
+        Args:
+            ready (Iterable[str]): IDs of tasks that have finished.
+        """
+        revoked = []
+        for task_id in ready:
+            duplicate_id = self.duplicates.pop(task_id, None)
+            if duplicate_id is not None:
+                revoked += [task_id, duplicate_id]
+        if not revoked:
+            return
+        # with a broker pool limit of 1, broadcasting on a pooled connection would deadlock with the producer
+        with self.distributask.app.connection_for_write() as connection:
+            self.distributask.app.control.revoke(
+                revoked, terminate=True, connection=connection
+            )
+
+
+class AsyncDistributask:
+    """
+    asyncio client for a Distributask object, for orchestrators that run in an event loop. Tasks are published and
+    awaited with redis.asyncio and the Vast.ai API is called with an aiohttp session, so submission, result
+    awaiting, offer search, rental and teardown run concurrently in one thread. Completions are received by a single
+    pub/sub listener that hands them to every coroutine awaiting the task, so any number of results can be awaited
+    at once with one Redis connection. Use it as an async context manager, or call close, to release the
+    connection pools. Requires the aiohttp package.
+    """
+
+    def __init__(
+        self, distributask: "Distributask", http_connections: int = 16
+    ) -> None:
+        """
+        Args:
+            distributask (Distributask): Provides the settings, registered functions, Celery app and rate limiter.
+            http_connections (int): Maximum number of open connections to the Vast.ai API. Defaults to 16.
+        """
+        self.distributask = distributask
+        self.http_connections = http_connections
+        self.redis_client = None
+        self.http_session = None
+        # the pub/sub listener, and the queues of the coroutines waiting for each task ID
+        self.listener = None
+        self.listener_subscribed = None
+        self.waiters = {}
+
+    async def __aenter__(self) -> "AsyncDistributask":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """
+        Close the HTTP session, the pub/sub listener and the Redis connection pool.
+        """
+        await self.stop_listener()
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+        if self.redis_client is not None:
+            await self.redis_client.aclose()
+            await self.redis_client.connection_pool.disconnect()
+            self.redis_client = None
+
+    def get_redis_connection(self) -> AsyncRedis:
+        """
+        Returns the asyncio Redis client, on a connection pool configured like Distributask.get_redis_connection.
+
+        Returns:
+            redis.asyncio.Redis: A Redis client.
+        """
+        if self.redis_client is None:
+            settings = self.distributask.settings
+            pool = AsyncBlockingConnectionPool(
+                host=settings["REDIS_HOST"],
+                port=settings["REDIS_PORT"],
+                password=settings["REDIS_PASSWORD"],
+                max_connections=int(settings["REDIS_POOL_SIZE"]),
+                timeout=float(settings["REDIS_POOL_TIMEOUT"]),
+                health_check_interval=int(settings["REDIS_HEALTH_CHECK_INTERVAL"]),
+                socket_keepalive=True,
+            )
+            self.redis_client = AsyncRedis(connection_pool=pool)
+        return self.redis_client
+
+    def get_http_session(self):
+        """
+        Returns the aiohttp session shared by all Vast.ai API calls.
+
+        Returns:
+            aiohttp.ClientSession: The session.
 
         Raises:
-            Exception: If an error occurs during the upload process.
+            ImportError: If aiohttp is not installed.
+        """
+        if self.http_session is None:
+            try:
+                import aiohttp
+            except ImportError as e:
+                raise ImportError(
+                    "AsyncDistributask requires aiohttp, install it with pip install aiohttp"
+                ) from e
+
+            self.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.http_connections),
+                timeout=aiohttp.ClientTimeout(
+                    total=float(self.distributask.settings["VAST_API_TIMEOUT"])
+                ),
+            )
+        return self.http_session
+
+    def encode_task(
+        self,
+        func_name: str,
+        args: dict,
+        task_id: str,
+        queue: str = None,
+        priority: int = None,
+    ) -> tuple:
+        """
+        Build a call_function_task message like Celery's apply_async and the Redis transport do, so workers can't
+        tell the difference. Serializes the arguments and may write them to the blob store, so add_task and
+        execute_many run it in a worker thread.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            task_id (str): ID of the task.
+            queue (str): Queue the task is sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the task, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+
+        Returns:
+            tuple: The Redis key of the queue, the encoded message, and the key of the blob the arguments were
+            offloaded to or None.
+        """
+        distributask = self.distributask
+        app = distributask.app
+        options = distributask.get_routing_options(
+            func_name, {"queue": queue, "priority": priority}
+        )
+        queue = options.get("queue", app.conf.task_default_queue)
+        priority = options.get("priority")
+
+        reference, args_bytes = distributask.store_payload(args)
+        if reference is not None:
+            args = reference
+
+        headers, properties, body, _ = app.amqp.as_task_v2(
+            task_id,
+            distributask.call_function_task.name,
+            args=(func_name, args),
+            kwargs={},
+            reply_to=app.thread_oid,
+        )
+        # the send time lets the worker measure how long the task waited in the queue
+        headers["sent_at"] = time.time()
+        content_type, content_encoding, data = serialize(
+            body, serializer=app.conf.task_serializer
+        )
+        if isinstance(data, str):
+            data = data.encode(content_encoding)
+        # the body holds little more than the arguments unless they were offloaded
+        headers["args_bytes"] = args_bytes if args_bytes >= 0 else len(data)
+        properties.update(
+            delivery_mode=2,
+            delivery_info={"exchange": "", "routing_key": queue},
+            priority=priority or 0,
+            body_encoding="base64",
+            delivery_tag=str(uuid4()),
+        )
+        message = {
+            "body": base64.b64encode(data).decode("ascii"),
+            "content-encoding": content_encoding,
+            "content-type": content_type,
+            "headers": headers,
+            "properties": properties,
+        }
+        distributask.metrics.inc(
+            "distributask_tasks_submitted_total", {"function": func_name}
+        )
+        blob_key = reference["__distributask_blob__"] if reference else None
+        return (
+            distributask.get_queue_key(queue, priority),
+            kombu_dumps(message),
+            blob_key,
+        )
+
+    async def add_task(
+        self,
+        pipe,
+        func_name: str,
+        args: dict,
+        task_id: str,
+        queue: str = None,
+        priority: int = None,
+    ) -> None:
+        """
+        Add the commands that publish a call_function_task message to a Redis pipeline. The message is encoded in
+        a worker thread, serialization and blob store writes don't block the event loop.
+
+        Args:
+            pipe (redis.asyncio.client.Pipeline): The pipeline.
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            task_id (str): ID of the task.
+            queue (str): Queue the task is sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the task, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+        """
+        encoded = await asyncio.to_thread(
+            self.encode_task, func_name, args, task_id, queue, priority
+        )
+        self.add_encoded_task(pipe, task_id, *encoded)
+
+    def add_encoded_task(
+        self, pipe, task_id: str, queue_key: str, message: str, blob_key: str
+    ) -> None:
+        """
+        Add the commands that publish a message built by encode_task to a Redis pipeline.
+
+        Args:
+            pipe (redis.asyncio.client.Pipeline): The pipeline.
+            task_id (str): ID of the task.
+            queue_key (str): The Redis key of the queue.
+            message (str): The encoded message.
+            blob_key (str): The key of the blob the arguments were offloaded to, or None.
+        """
+        if blob_key is not None:
+            pipe.sadd(f"distributask-blob:{task_id}", blob_key)
+        pipe.lpush(queue_key, message)
+
+    async def execute_function(
+        self, func_name: str, args: dict, queue: str = None, priority: int = None
+    ) -> AsyncResult:
+        """
+        Execute a registered function as a Celery task with provided arguments.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            queue (str): Queue the task is sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the task, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+
+        Returns:
+            celery.result.AsyncResult: The task. Await its result with get_result, its own methods block.
+        """
+        task_id = str(uuid4())
+        async with self.get_redis_connection().pipeline(transaction=False) as pipe:
+            await self.add_task(pipe, func_name, args, task_id, queue, priority)
+            await pipe.execute()
+        return AsyncResult(task_id, app=self.distributask.app)
+
+    async def execute_many(
+        self,
+        func_name: str,
+        iterable_of_args,
+        chunk_size: int = 500,
+        queue: str = None,
+        priority: int = None,
+    ) -> TaskBatch:
+        """
+        Execute a registered function once for every set of arguments in iterable_of_args. The messages of each
+        chunk are published in one Redis pipeline.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            iterable_of_args (Iterable[dict]): Arguments for each task.
+            chunk_size (int): Number of messages published per pipeline. Defaults to 500.
+            queue (str): Queue the tasks are sent to. Defaults to None (the queue passed to register_function).
+            priority (int): Priority of the tasks, from 0 (highest) to 9 (lowest). Defaults to None (the priority
+            passed to register_function).
+
+        Returns:
+            TaskBatch: A handle containing the IDs of all submitted tasks.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        batch = TaskBatch(
+            self.distributask.app, result_loader=self.distributask.load_payload
+        )
+        iterator = iter(iterable_of_args)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                break
+
+            task_ids = [str(uuid4()) for _ in chunk]
+            # one thread hop per chunk, the messages keep their order
+            encoded = await asyncio.to_thread(
+                lambda: [
+                    self.encode_task(func_name, args, task_id, queue, priority)
+                    for args, task_id in zip(chunk, task_ids)
+                ]
+            )
+            async with self.get_redis_connection().pipeline(transaction=False) as pipe:
+                for task_id, task in zip(task_ids, encoded):
+                    self.add_encoded_task(pipe, task_id, *task)
+                await pipe.execute()
+            batch.task_ids.extend(task_ids)
+        return batch
+
+    async def get_ready_task_meta(
+        self, task_ids, chunk_size: int = 1000
+    ) -> Dict[str, Dict]:
+        """
+        Look up the result metadata of the given tasks with pipelined MGET calls and return the tasks that have
+        finished.
 
+        Args:
+            task_ids (Iterable[str]): The IDs of the tasks to check.
+            chunk_size (int): Number of keys requested per MGET. Defaults to 1000.
+
+        Returns:
+            Dict[str, Dict]: Maps the ID of every finished task to its decoded result metadata.
+        """
+        backend = self.distributask.app.backend
+        task_ids = list(task_ids)
+        async with self.get_redis_connection().pipeline(transaction=False) as pipe:
+            for i in range(0, len(task_ids), chunk_size):
+                pipe.mget(
+                    [
+                        backend.get_key_for_task(task_id)
+                        for task_id in task_ids[i : i + chunk_size]
+                    ]
+                )
+            values = itertools.chain.from_iterable(await pipe.execute())
+
+        ready = {}
+        for task_id, value in zip(task_ids, values):
+            if value is None:
+                continue
+            meta = backend.decode_result(value)
+            if meta["status"] in states.READY_STATES:
+                ready[task_id] = meta
+        return ready
+
+    async def start_listener(self) -> None:
+        """
+        Start the pub/sub listener that receives the completions of all tasks, unless it is running, and wait
+        until it is subscribed. It is started by iter_ready_tasks and runs until close is called or its
+        connection fails, then the next call starts it again.
+        """
+        loop = asyncio.get_running_loop()
+        if (
+            self.listener is None
+            or self.listener.done()
+            or self.listener.get_loop() is not loop
+        ):
+            # set before awaiting, so concurrent callers share the listener
+            self.listener_subscribed = loop.create_future()
+            self.listener = asyncio.ensure_future(self.listen(self.listener_subscribed))
+        await asyncio.shield(self.listener_subscribed)
+
+    async def stop_listener(self) -> None:
+        """
+        Stop the pub/sub listener and close its connection.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        repo_id = self.settings.get("HF_REPO_ID")
+        listener, self.listener = self.listener, None
+        if listener is None or listener.done():
+            return
+        listener.cancel()
+        try:
+            await listener
+        except asyncio.CancelledError:
+            pass
 
-        api = HfApi(token=hf_token)
+    async def listen(self, subscribed: asyncio.Future) -> None:
+        """
+        Read completions from the result backend's pub/sub channel and put the finished tasks in the queues of
+        the coroutines waiting for them, see iter_ready_tasks.
 
+        Args:
+            subscribed (asyncio.Future): Resolved once the channel is subscribed, or set to the exception if
+            subscribing fails.
+        """
+        backend = self.distributask.app.backend
+        prefix = backend.task_keyprefix
+        pubsub = self.get_redis_connection().pubsub(ignore_subscribe_messages=True)
         try:
-            self.log(f"Uploading {file_path} to Hugging Face repo {repo_id}")
-            api.upload_file(
-                path_or_fileobj=file_path,
-                path_in_repo=os.path.basename(file_path),
-                repo_id=repo_id,
-                token=hf_token,
-                repo_type="dataset",
-            )
-            self.log(f"Uploaded {file_path} to Hugging Face repo {repo_id}")
+            try:
+                await pubsub.psubscribe(prefix + backend.key_t("*"))
+            except Exception as e:
+                subscribed.set_exception(e)
+                return
+            subscribed.set_result(None)
+            async for message in pubsub.listen():
+                if message is None or message["type"] != "pmessage":
+                    continue
+                task_id = bytes_to_str(backend.key_t(message["channel"])[len(prefix) :])
+                queues = self.waiters.get(task_id)
+                if not queues:
+                    continue
+                meta = backend.decode_result(message["data"])
+                if meta["status"] in states.READY_STATES:
+                    for queue in queues:
+                        queue.put_nowait((task_id, meta))
         except Exception as e:
-            self.log(
-                f"Failed to upload {file_path} to Hugging Face repo {repo_id}: {e}",
-                "error",
-            )
-
-    def upload_directory(self, dir_path: str) -> None:
+            # waiters fall back to their MGET checks until the listener is started again
+            self.distributask.log(f"Error in the task result listener: {e}", "error")
+        finally:
+            if not subscribed.done():
+                subscribed.cancel()
+            await pubsub.aclose()
+
+    async def iter_ready_tasks(
+        self, task_ids, timeout: float = None, resync_interval: float = 30
+    ):
         """
-        Upload a directory to a Hugging Face repository. Can be used to reduce frequency of Hugging Face API
-        calls if you are rate limited while using the upload_file function.
+        Track a set of tasks until all of them have finished, yielding each one as it finishes. Completions are
+        received from the result backend's pub/sub channel by the shared listener, see start_listener, and the
+        unfinished tasks are re-checked with MGET at the start and every resync_interval seconds, like
+        Distributask.iter_ready_tasks.
 
         Args:
-            dir_path (str): The path of the directory to upload.
+            task_ids (Iterable[str]): The IDs of the tasks to track.
+            timeout (float): Seconds to wait for all tasks to finish. Defaults to None (wait forever).
+            resync_interval (float): Seconds between MGET checks of the unfinished tasks. Defaults to 30.
 
-        Raises:
-            Exception: If an error occurs during the upload process.
+        Yields:
+            Tuple[str, Dict]: The task ID and its decoded result metadata.
 
+        Raises:
+            celery.exceptions.TimeoutError: If the tasks have not all finished within timeout seconds.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        repo_id = self.settings.get("HF_REPO_ID")
-
+        pending = set(task_ids)
+        start = time.monotonic()
+        queue = asyncio.Queue()
+
+        def stop_waiting(task_id):
+            queues = self.waiters.get(task_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.waiters[task_id]
+
+        # register and subscribe before the first check so no completion falls in between
+        for task_id in pending:
+            self.waiters.setdefault(task_id, set()).add(queue)
         try:
-            self.log(f"Uploading {dir_path} to Hugging Face repo {repo_id}")
-
-            api = HfApi(token=hf_token)
-            api.upload_folder(
-                folder_path=dir_path,
-                repo_id=repo_id,
-                repo_type="dataset",
-            )
-            self.log(f"Uploaded {dir_path} to Hugging Face repo {repo_id}")
-        except Exception as e:
-            self.log(
-                f"Failed to upload {dir_path} to Hugging Face repo {repo_id}: {e}",
-                "error",
-            )
+            await self.start_listener()
+            ready = await self.get_ready_task_meta(pending)
+            last_resync = time.monotonic()
+            while True:
+                for task_id, meta in ready.items():
+                    pending.discard(task_id)
+                    stop_waiting(task_id)
+                    yield task_id, meta
+                if not pending:
+                    return
+
+                now = time.monotonic()
+                if timeout is not None and now - start >= timeout:
+                    raise TaskTimeoutError(
+                        f"{len(pending)} tasks did not finish within {timeout} seconds"
+                    )
+                if now - last_resync >= resync_interval:
+                    # completions published while the listener was down are only seen here
+                    await self.start_listener()
+                    ready = await self.get_ready_task_meta(pending)
+                    last_resync = now
+                    continue
 
-    def delete_file(self, repo_id: str, path_in_repo: str) -> None:
+                wait_time = resync_interval - (now - last_resync)
+                if timeout is not None:
+                    wait_time = min(wait_time, timeout - (now - start))
+                ready = {}
+                try:
+                    task_id, meta = await asyncio.wait_for(queue.get(), wait_time)
+                except asyncio.TimeoutError:
+                    continue
+                while True:
+                    if task_id in pending:
+                        ready[task_id] = meta
+                    if queue.empty():
+                        break
+                    task_id, meta = queue.get_nowait()
+        finally:
+            for task_id in pending:
+                stop_waiting(task_id)
+
+    async def as_completed(self, tasks, timeout: float = None):
         """
-        Delete a file from a Hugging Face repository.
+        Yield the result of each task as soon as it finishes, in order of completion.
 
         Args:
-            repo_id (str): The ID of the repository.
-            path_in_repo (str): The path of the file to delete within the repository.
+            tasks (List | TaskBatch): The tasks to wait for, as returned by execute_function or execute_many.
+            timeout (float): Seconds to wait for all tasks to finish. Defaults to None (wait forever).
 
-        Raises:
-            Exception: If an error occurs during the deletion process.
+        Yields:
+            Tuple[str, any]: The task ID and the return value of the task, or the exception it raised.
 
+        Raises:
+            celery.exceptions.TimeoutError: If the tasks have not all finished within timeout seconds.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
-
-        try:
-            api.delete_file(
-                repo_id=repo_id,
-                path_in_repo=path_in_repo,
-                repo_type="dataset",
-                token=hf_token,
-            )
-            self.log(f"Deleted {path_in_repo} from Hugging Face repo {repo_id}")
-        except Exception as e:
-            self.log(
-                f"Failed to delete {path_in_repo} from Hugging Face repo {repo_id}: {e}",
-                "error",
-            )
+        task_ids = self.distributask.get_task_ids(tasks)
+        async for task_id, meta in self.iter_ready_tasks(task_ids, timeout):
+            yield task_id, self.distributask.load_payload(meta["result"])
 
-    def file_exists(self, repo_id: str, path_in_repo: str) -> bool:
+    async def get_result(self, task, timeout: float = None) -> any:
         """
-        Check if a file exists in a Hugging Face repository.
+        Wait for a task and return its result.
 
         Args:
-            repo_id (str): The ID of the repository.
-            path_in_repo (str): The path of the file to check within the repository.
+            task (AsyncResult | str): The task or its ID.
+            timeout (float): Seconds to wait. Defaults to None (wait forever).
 
         Returns:
-            bool: True if the file exists in the repository, False otherwise.
+            any: The return value of the task.
 
         Raises:
-            Exception: If an error occurs while checking the existence of the file.
+            celery.exceptions.TimeoutError: If the task has not finished within timeout seconds.
+            Exception: The exception raised by the task.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
+        task_id = task if isinstance(task, str) else task.id
+        async for _, meta in self.iter_ready_tasks([task_id], timeout):
+            if meta["status"] != states.SUCCESS:
+                raise meta["result"]
+            return self.distributask.load_payload(meta["result"])
+
+    async def monitor_tasks(
+        self, tasks, timeout: float = None, print_statements: bool = True
+    ) -> None:
+        """
+        Monitor the status of the tasks with a progress bar until all of them have finished.
 
+        Args:
+            tasks (List | TaskBatch): The tasks to monitor, as returned by execute_function or execute_many.
+            timeout (float): Seconds to wait for all tasks to finish. Defaults to None (wait forever).
+            print_statements (bool): Allow printing of status of task queue. Defaults to True.
+        """
+        task_ids = self.distributask.get_task_ids(tasks)
+        completed = 0
         try:
-            repo_files = api.list_repo_files(
-                repo_id=repo_id, repo_type="dataset", token=hf_token
-            )
-            return path_in_repo in repo_files
+            if print_statements:
+                print("Tasks submitted to queue. Starting queue...")
+            with tqdm(total=len(task_ids), unit="task") as pbar:
+                async for _ in self.iter_ready_tasks(task_ids, timeout):
+                    completed += 1
+                    pbar.update(1)
         except Exception as e:
-            self.log(
-                f"Failed to check if {path_in_repo} exists in Hugging Face repo {repo_id}: {e}",
-                "error",
-            )
-            return False
+            self.distributask.log(f"Error in executing tasks on nodes, {str(e)}")
 
-    def list_files(self, repo_id: str) -> list:
+        if completed == len(task_ids):
+            print("All tasks completed.")
+
+    async def vast_request(self, method: str, url: str, **kwargs):
         """
-        Get a list of files from a Hugging Face repository.
+        Call the Vast.ai API within the rate limit of the Distributask object, for every attempt. Calls are
+        retried like the sync client does, see VastRetry.
 
         Args:
-            repo_id (str): The ID of the repository.
+            method (str): The HTTP method.
+            url (str): The URL.
+            kwargs: Passed to aiohttp.ClientSession.request.
 
         Returns:
-            list: A list of file paths in the repository.
+            aiohttp.ClientResponse: The response, with its body already read.
 
         Raises:
-            Exception: If an error occurs while retrieving the list of files.
+            aiohttp.ClientError: If the API can't be reached.
+            asyncio.TimeoutError: If the last attempt timed out.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
+        import aiohttp
+
+        session = self.get_http_session()
+        retry = self.distributask.get_vast_retry()
+        for attempt in range(retry.total + 1):
+            if attempt > 0:
+                await asyncio.sleep(wait_time)
+            await self.distributask.vast_rate_limiter.acquire_async()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                connect = isinstance(e, aiohttp.ClientConnectorError)
+                if attempt == retry.total or not retry.is_retryable_error(
+                    method, connect
+                ):
+                    raise
+                wait_time = retry.get_wait_time(attempt)
+                continue
+
+            if attempt < retry.total and retry.is_retry(method, response.status):
+                wait_time = retry.get_wait_time(
+                    attempt, response.headers.get("Retry-After")
+                )
+                continue
+            return response
 
-        try:
-            repo_files = api.list_repo_files(
-                repo_id=repo_id, repo_type="dataset", token=hf_token
-            )
-            return repo_files
-        except Exception as e:
-            self.log(
-                f"Failed to get the list of files from Hugging Face repo {repo_id}: {e}",
-                "error",
-            )
-            return []
+    def get_vast_headers(self) -> Dict:
+        """
+        Returns:
+            Dict: Headers for Vast.ai API requests.
+        """
+        return {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.distributask.get_env('VAST_API_KEY')}",
+        }
 
-    def search_offers(self, max_price: float) -> List[Dict]:
+    async def search_offers(
+        self,
+        max_price: float,
+        min_gpu_ram: float = 4,
+        regions: List[str] = None,
+        min_cuda: float = None,
+        filters: Dict = None,
+        use_cache: bool = True,
+    ) -> List[Dict]:
         """
-        Search for available offers to rent a node as an instance on the Vast.ai platform.
+        Search for available offers on Vast.ai, see Distributask.search_offers. Shares its cache of results.
 
         Args:
             max_price (float): The maximum price per hour for the instance.
+            min_gpu_ram (float): The minimum GPU RAM in GB. Defaults to 4.
+            regions (List[str]): Country codes the instance must be located in. Defaults to None (any region).
+            min_cuda (float): The minimum CUDA version supported by the host. Defaults to None.
+            filters (Dict): Additional Vast.ai search filters. Defaults to None.
+            use_cache (bool): Return cached results of the same search if they are recent enough. Defaults to True.
 
         Returns:
             List[Dict]: A list of dictionaries representing the available offers.
 
         Raises:
-            requests.exceptions.RequestException: If there is an error while making the API request.
+            aiohttp.ClientResponseError: If the API returns an error.
         """
-        api_key = self.get_env("VAST_API_KEY")
-        base_url = "https://console.vast.ai/api/v0/bundles/"
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
-        url = (
-            base_url
-            + '?q={"gpu_ram":">=4","rentable":{"eq":true},"dph_total":{"lte":'
-            + str(max_price)
-            + '},"sort_option":{"0":["dph_total","asc"],"1":["total_flops","asc"]}}'
+        distributask = self.distributask
+        base_url = f"{distributask.settings['VAST_API_URL']}/bundles/"
+        query = distributask.get_offer_query(
+            max_price, min_gpu_ram, regions, min_cuda, filters
         )
+        params = {"q": json.dumps(query, sort_keys=True)}
 
-        try:
-            response = requests.get(url, headers=headers)
+        cache_key = (base_url, params["q"])
+        cached = distributask.offer_cache.get(cache_key)
+        ttl = float(distributask.settings["OFFER_CACHE_TTL"])
+        if use_cache and cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+
+        response = await self.vast_request(
+            "GET", base_url, params=params, headers=self.get_vast_headers()
+        )
+        if response.status != 200:
+            distributask.log(f"Error searching offers: {await response.text()}")
             response.raise_for_status()
-            json_response = response.json()
-            return json_response["offers"]
+        offers = (await response.json())["offers"]
+        distributask.offer_cache[cache_key] = (time.monotonic(), offers)
+        return offers
 
-        except requests.exceptions.RequestException as e:
-            self.log(
-                f"Error: {e}\nResponse: {response.text if response else 'No response'}"
-            )
-            raise
+    async def get_gpu_durations(self) -> Dict[str, float]:
+        """
+        Get the average measured task duration per GPU model, see Distributask.get_gpu_durations.
 
-    def create_instance(
-        self, offer_id: str, image: str, module_name: str, env_settings: Dict, command: str
+        Returns:
+            Dict[str, float]: Average task duration in seconds per GPU model.
+        """
+        stats = await self.get_redis_connection().hgetall("distributask-gpu-durations")
+        return self.distributask.average_gpu_durations(stats)
+
+    async def create_instance(
+        self,
+        offer_id: str,
+        image: str,
+        module_name: str,
+        env_settings: Dict = None,
+        command: str = None,
+        queues: List[str] = None,
     ) -> Dict:
         """
-        Create an instance on the Vast.ai platform. Passes in some useful Celery settings by default.
+        Create an instance on the Vast.ai platform, see Distributask.create_instance.
 
         Args:
             offer_id (str): The ID of the offer to create the instance from.
-            image (str): The image to use for the instance. (example: RaccoonResearch/distributask-test-worker)
-            module_name (str): The name of the module to run on the instance, configured to be a docker file (example: distributask.example.worker)
-            command (str): Command that initializes celery worker. Has default command with specific settings if not passed in. These settings have
-            been found to be beneficial to the stability and simplicity of a Distributask run. 
-            env_settings (Dict): Used to pass in environment variables to the Vast.ai instance. This is a dictionary with keys of the 
-            environment variable name and values of the desired value of the environment variable.
+            image (str): The image to use for the instance.
+            module_name (str): The name of the module to run on the instance.
+            env_settings (Dict): Environment variables passed to the instance. Defaults to None (the settings).
+            command (str): Command that starts the Celery worker. Defaults to None (the default command).
+            queues (List[str]): Queues the worker started by the default command consumes. Defaults to None.
 
         Returns:
             Dict: A dictionary representing the created instance.
@@ -536,53 +5904,56 @@ class Distributask:
             ValueError: If the Vast.ai API key is not set in the environment.
             Exception: If there is an error while creating the instance.
         """
-        if self.get_env("VAST_API_KEY") is None:
-            self.log("VAST_API_KEY is not set in the environment", "error")
-            raise ValueError("VAST_API_KEY is not set in the environment")
-
-        if command is None:
-            command = f"celery -A {module_name} worker --loglevel=info --concurrency=1 --without-heartbeat --prefetch-multiplier=1"
-
-        if env_settings is None:
-            env_settings = self.settings
+        distributask = self.distributask
+        json_blob = distributask.get_instance_request(
+            offer_id, image, module_name, env_settings, command, queues
+        )
+        url = f"{distributask.settings['VAST_API_URL']}/asks/{offer_id}/?api_key={distributask.get_env('VAST_API_KEY')}"
+        response = await self.vast_request(
+            "PUT", url, headers=self.get_vast_headers(), json=json_blob
+        )
+        if response.status != 200:
+            text = await response.text()
+            distributask.log(f"Failed to create instance: {text}", "error")
+            raise Exception(f"Failed to create instance: {text}")
+        return await response.json()
 
-        json_blob = {
-            "client_id": "me",
-            "image": image,
-            "env": env_settings,
-            "disk": 32,  # Set a non-zero value for disk
-            "onstart": f"export PATH=$PATH:/ && cd ../ && {command}",
-            "runtype": "ssh ssh_proxy",
-        }
-        url = f"https://console.vast.ai/api/v0/asks/{offer_id}/?api_key={self.get_env('VAST_API_KEY')}"
-        headers = {"Authorization": f"Bearer {self.get_env('VAST_API_KEY')}"}
-        response = requests.put(url, headers=headers, json=json_blob)
+    async def destroy_instance(self, instance_id: str):
+        """
+        Destroy an instance on the Vast.ai platform.
 
-        if response.status_code != 200:
-            self.log(f"Failed to create instance: {response.text}", "error")
-            raise Exception(f"Failed to create instance: {response.text}")
+        Args:
+            instance_id (str): The ID of the instance to destroy.
 
-        return response.json()
+        Returns:
+            aiohttp.ClientResponse: The response of the destroy operation.
+        """
+        api_key = self.distributask.get_env("VAST_API_KEY")
+        url = f"{self.distributask.settings['VAST_API_URL']}/instances/{instance_id}/?api_key={api_key}"
+        return await self.vast_request("DELETE", url, headers=self.get_vast_headers())
 
-    def destroy_instance(self, instance_id: str) -> Dict:
+    async def get_instance(self, instance_id: str) -> Dict:
         """
-        Destroy an instance on the Vast.ai platform.
+        Get an instance on the Vast.ai platform.
 
         Args:
-            instance_id (str): The ID of the instance to destroy.
+            instance_id (str): The ID of the instance.
 
         Returns:
-            Dict: A dictionary representing the result of the destroy operation.
+            Dict: A dictionary representing the instance, or None if the instance doesn't exist.
+
+        Raises:
+            aiohttp.ClientResponseError: If the API returns an error.
         """
-        api_key = self.get_env("VAST_API_KEY")
-        headers = {"Authorization": f"Bearer {api_key}"}
-        url = (
-            f"https://console.vast.ai/api/v0/instances/{instance_id}/?api_key={api_key}"
-        )
-        response = requests.delete(url, headers=headers)
-        return response
+        api_key = self.distributask.get_env("VAST_API_KEY")
+        url = f"{self.distributask.settings['VAST_API_URL']}/instances/{instance_id}/?api_key={api_key}"
+        response = await self.vast_request("GET", url, headers=self.get_vast_headers())
+        if response.status == 404:
+            return None
+        response.raise_for_status()
+        return (await response.json()).get("instances") or None
 
-    def rent_nodes(
+    async def rent_nodes(
         self,
         max_price: float,
         max_nodes: int,
@@ -590,157 +5961,197 @@ class Distributask:
         module_name: str,
         env_settings: Dict = None,
         command: str = None,
+        concurrency: int = 8,
+        queues: List[str] = None,
+        **search_options,
     ) -> List[Dict]:
         """
-        Rent nodes as an instance on the Vast.ai platform.
+        Rent nodes as instances on the Vast.ai platform, trying up to concurrency offers at the same time, best
+        first. See Distributask.rent_nodes.
 
         Args:
             max_price (float): The maximum price per hour for the nodes.
             max_nodes (int): The maximum number of nodes to rent.
             image (str): The image to use for the nodes.
             module_name (str): The name of the module to run on the nodes.
+            env_settings (Dict): Environment variables passed to the nodes. Defaults to the settings.
+            command (str): Command that starts the Celery worker. Defaults to the command of create_instance.
+            concurrency (int): Maximum number of offers tried at the same time. Defaults to 8.
+            queues (List[str]): Queues the workers consume, see create_instance. Defaults to None.
+            search_options: Filters passed to search_offers (min_gpu_ram, regions, min_cuda, filters).
 
         Returns:
-            List[Dict]: A list of dictionaries representing the rented nodes. If error is encountered
-            trying to rent, it will retry every 5 seconds.
+            List[Dict]: A list of dictionaries representing the rented nodes.
         """
+        distributask = self.distributask
         rented_nodes: List[Dict] = []
+        tried_offers = set()
         while len(rented_nodes) < max_nodes:
-            search_retries = 10
-            while search_retries > 0:
+            offers = []
+            for _ in range(10):
                 try:
-                    offers = self.search_offers(max_price)
-                    break
-                except Exception as e:
-                    self.log(
-                        f"Error searching for offers: {str(e)} - retrying in 5 seconds...",
-                        "error",
+                    # cached offers are fine for the first search, later searches look for new offers
+                    offers = await self.search_offers(
+                        max_price, use_cache=not tried_offers, **search_options
                     )
-                    search_retries -= 1
-                    # sleep for 10 seconds before retrying
-                    time.sleep(10)
-                    continue
-
-            offers = sorted(
-                offers, key=lambda offer: offer["dph_total"]
-            )  # Sort offers by price, lowest to highest
-            for offer in offers:
-                time.sleep(5)
-                if len(rented_nodes) >= max_nodes:
                     break
-                try:
-                    instance = self.create_instance(
-                        offer["id"], image, module_name, env_settings=env_settings, command=command
-                    )
-                    rented_nodes.append(
-                        {
-                            "offer_id": offer["id"],
-                            "instance_id": instance["new_contract"],
-                        }
-                    )
                 except Exception as e:
-                    self.log(
-                        f"Error renting node: {str(e)} - searching for new offers",
+                    distributask.log(
+                        f"Error searching for offers: {str(e)} - retrying in 10 seconds...",
                         "error",
                     )
-                    break  # Break out of the current offer iteration
-            else:
-                # If the loop completes without breaking, all offers have been tried
-                self.log("No more offers available - stopping node rental", "warning")
+                    await asyncio.sleep(10)
+
+            offers = distributask.rank_offers(
+                [offer for offer in offers if offer["id"] not in tried_offers],
+                await self.get_gpu_durations(),
+            )
+            if not offers:
+                distributask.log(
+                    "No more offers available - stopping node rental", "warning"
+                )
                 break
 
-        atexit.register(self.terminate_nodes, rented_nodes)
+            offers = iter(offers)
+            pending = {}
+            try:
+                while len(rented_nodes) < max_nodes:
+                    # only try as many offers as there are nodes left to rent
+                    needed = max_nodes - len(rented_nodes)
+                    while len(pending) < min(concurrency, needed):
+                        offer = next(offers, None)
+                        if offer is None:
+                            break
+                        tried_offers.add(offer["id"])
+                        # the GPU model lets workers record task durations per model
+                        node_env = dict(
+                            env_settings
+                            if env_settings is not None
+                            else distributask.settings
+                        )
+                        if offer.get("gpu_name"):
+                            node_env["GPU_NAME"] = offer["gpu_name"]
+                        task = asyncio.ensure_future(
+                            self.create_instance(
+                                offer["id"],
+                                image,
+                                module_name,
+                                node_env,
+                                command,
+                                queues,
+                            )
+                        )
+                        pending[task] = offer
+                    if not pending:
+                        break  # all offers have been tried, search for new ones
+
+                    done, _ = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        node = distributask.get_rented_node(
+                            pending.pop(task), task, command
+                        )
+                        if node is None:
+                            continue
+                        if len(rented_nodes) < max_nodes:
+                            rented_nodes.append(node)
+                            distributask.rented_nodes[node["instance_id"]] = node
+                        else:
+                            await self.destroy_instance(node["instance_id"])
+            finally:
+                # requests that were already sent may still create instances, destroy the surplus ones
+                if pending:
+                    await asyncio.wait(pending)
+                    for task, offer in pending.items():
+                        node = distributask.get_rented_node(offer, task, command)
+                        if node is not None:
+                            await self.destroy_instance(node["instance_id"])
+
+        atexit.register(distributask.terminate_nodes, rented_nodes)
         return rented_nodes
 
-    def get_node_log(self, node: Dict, wait_time: int = 2):
-        """
-        Get the log of the Vast.ai instance that is passed in. Makes an api call to tell the instance to send the log,
-        and another one to actually retrive the log
-        Args:
-            node (Dict): the node that corresponds to the Vast.ai instance you want the log from
-            wait_time (int): how long to wait in between the two api calls described above
-
-        Returns:
-            str: the log of the instance requested. If anything else other than a code 200 is received, return None
-        """
-        node_id = node["instance_id"]
-        url = f"https://console.vast.ai/api/v0/instances/request_logs/{node_id}/"
-
-        payload = {"tail": "1000"}
-        headers = {
-            "Accept": "application/json",
-            "Authorization": f"Bearer {self.settings['VAST_API_KEY']}",
-        }
-
-        response = requests.request(
-            "PUT", url, headers=headers, json=payload, timeout=5
-        )
-
-        if response.status_code == 200:
-            log_url = response.json()["result_url"]
-            time.sleep(wait_time)
-            log_response = requests.get(log_url, timeout=5)
-            if log_response.status_code == 200:
-                return log_response
-            else:
-                return None
-        else:
-            return None
-
-    def terminate_nodes(self, nodes: List[Dict]) -> None:
+    async def terminate_nodes(
+        self,
+        nodes: List[Dict],
+        concurrency: int = 8,
+        max_retries: int = 4,
+        backoff: float = 1.0,
+    ) -> List[Dict]:
         """
-        Terminate the instances of rented nodes on Vast.ai.
+        Terminate the instances of rented nodes on Vast.ai concurrently, checking that each one is gone and
+        retrying with exponential backoff. See Distributask.terminate_nodes.
 
         Args:
             nodes (List[Dict]): A list of dictionaries representing the rented nodes.
+            concurrency (int): Maximum number of instances destroyed at the same time. Defaults to 8.
+            max_retries (int): Number of times a destroy is retried. Defaults to 4.
+            backoff (float): Seconds to wait before the first retry, doubled for every later retry. Defaults to 1.
 
-        Raises:
-            Exception: If error in destroying instances.
+        Returns:
+            List[Dict]: A report for every node, in the order of nodes, with the instance_id, whether the
+            instance was confirmed terminated, the number of attempts and the last error.
         """
-        print("Terminating nodes...")
-        for node in nodes:
-            time.sleep(1)
-            try:
-                response = self.destroy_instance(node["instance_id"])
-                if response.status_code != 200:
-                    time.sleep(5)
-                    self.destroy_instance(node["instance_id"])
-            except Exception as e:
-                self.log(
-                    f"Error terminating node: {node['instance_id']}, {str(e)}", "error"
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def terminate(node):
+            async with semaphore:
+                return await self.terminate_node(node, max_retries, backoff)
+
+        reports = await asyncio.gather(*(terminate(node) for node in nodes))
+        for report in reports:
+            if not report["terminated"]:
+                self.distributask.log(
+                    f"Error terminating node: {report['instance_id']}, {report['error']}",
+                    "error",
                 )
+        return list(reports)
 
-    def monitor_tasks(
-        self, tasks, update_interval=1, show_time_left=True, print_statements=True
-    ):
+    async def terminate_node(
+        self, node: Dict, max_retries: int = 4, backoff: float = 1.0
+    ) -> Dict:
         """
-        Monitor the status of the tasks on the Vast.ai nodes.
+        Destroy the instance of a rented node and confirm that it is gone, retrying with exponential backoff.
 
         Args:
-            tasks (List): A list of the tasks to monitor. Should be a list of the results of execute_function.
-            update_interval (bool): Number of seconds the status of tasks are updated.
-            show_time_left (bool): Show the estimated time left to complete tasks using the tqdm progress bar
-            print_statments (bool): Allow printing of status of task queue
+            node (Dict): The rented node.
+            max_retries (int): Number of times the destroy is retried. Defaults to 4.
+            backoff (float): Seconds to wait before the first retry, doubled for every later retry. Defaults to 1.
 
-        Raises:
-            Exception: If error in the process of executing the tasks
+        Returns:
+            Dict: The instance_id, whether the instance was confirmed terminated, the number of attempts and the
+            last error.
         """
+        instance_id = node["instance_id"]
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                response = await self.destroy_instance(instance_id)
+                # 404 means the instance is already gone
+                if response.status not in (200, 404):
+                    raise Exception(
+                        f"destroy returned {response.status}: {await response.text()}"
+                    )
+                if await self.get_instance(instance_id) is None:
+                    self.distributask.rented_nodes.pop(instance_id, None)
+                    return {
+                        "instance_id": instance_id,
+                        "terminated": True,
+                        "attempts": attempt + 1,
+                        "error": None,
+                    }
+                error = "instance still exists after destroy"
+            except Exception as e:
+                error = str(e)
 
-        try:
-            # Wait for the tasks to complete
-            if print_statements:
-                print("Tasks submitted to queue. Starting queue...")
-                print("Elapsed time<Estimated time to completion")
-            with tqdm(total=len(tasks), unit="task") as pbar:
-                while not all(task.ready() for task in tasks):
-                    current_tasks = sum([task.ready() for task in tasks])
-                    pbar.update(current_tasks - pbar.n)
-                    time.sleep(update_interval)
-        except Exception as e:
-            self.log(f"Error in executing tasks on nodes, {str(e)}")
-
-        if all(task.ready() for task in tasks):
-            print("All tasks completed.")
+        return {
+            "instance_id": instance_id,
+            "terminated": False,
+            "attempts": max_retries + 1,
+            "error": error,
+        }
 
 
 distributask = None
@@ -791,6 +6202,39 @@ def create_from_config(config_path="config.json", env_path=".env") -> Distributa
         redis_port=settings.get("REDIS_PORT"),
         redis_username=settings.get("REDIS_USER"),
         broker_pool_limit=int(settings.get("BROKER_POOL_LIMIT", 1)),
+        redis_pool_size=int(settings.get("REDIS_POOL_SIZE", 10)),
+        redis_pool_timeout=float(settings.get("REDIS_POOL_TIMEOUT", 20)),
+        redis_health_check_interval=int(
+            settings.get("REDIS_HEALTH_CHECK_INTERVAL", 30)
+        ),
+        redis_idle_timeout=float(settings.get("REDIS_IDLE_TIMEOUT", 300)),
+        task_serializer=settings.get("TASK_SERIALIZER", "json"),
+        payload_offload_threshold=int(
+            settings.get("PAYLOAD_OFFLOAD_THRESHOLD", 262144)
+        ),
+        blob_store_path=settings.get("BLOB_STORE_PATH"),
+        dedup_ttl=int(settings.get("DEDUP_TTL", 86400)),
+        vast_api_url=settings.get("VAST_API_URL", "https://console.vast.ai/api/v0"),
+        vast_api_rate=float(settings.get("VAST_API_RATE", 2)),
+        vast_api_burst=int(settings.get("VAST_API_BURST", 5)),
+        vast_api_timeout=float(settings.get("VAST_API_TIMEOUT", 30)),
+        vast_api_retries=int(settings.get("VAST_API_RETRIES", 3)),
+        vast_api_backoff=float(settings.get("VAST_API_BACKOFF", 0.5)),
+        offer_cache_ttl=float(settings.get("OFFER_CACHE_TTL", 30)),
+        telemetry=settings.get("TELEMETRY", False),
+        telemetry_max_len=int(settings.get("TELEMETRY_MAX_LEN", 100000)),
+        metrics_port=settings.get("METRICS_PORT"),
+        dead_letter_max_len=int(settings.get("DEAD_LETTER_MAX_LEN", 10000)),
+        upload_batch_files=int(settings.get("UPLOAD_BATCH_FILES", 100)),
+        upload_batch_bytes=int(settings.get("UPLOAD_BATCH_BYTES", 67108864)),
+        upload_batch_delay=float(settings.get("UPLOAD_BATCH_DELAY", 10)),
+        upload_queue_bytes=int(settings.get("UPLOAD_QUEUE_BYTES", 268435456)),
+        upload_memory_bytes=int(settings.get("UPLOAD_MEMORY_BYTES", 8388608)),
+        upload_threads=int(settings.get("UPLOAD_THREADS", 4)),
+        upload_retries=int(settings.get("UPLOAD_RETRIES", 3)),
+        upload_backoff=float(settings.get("UPLOAD_BACKOFF", 1)),
+        upload_wait=settings.get("UPLOAD_WAIT", False),
+        repo_index_ttl=float(settings.get("REPO_INDEX_TTL", 60)),
     )
 
     return distributask
@@ -93,7 +93,10 @@ if __name__ == "__main__":
         params = job_config["task_params"]
 
         # Each task executes the function "example_function", defined in shared.py
-        task = distributask.execute_function(example_function.__name__, params)
+        # Tasks whose outputs are already in the repository are skipped, so a restarted run resumes
+        task = distributask.execute_function(
+            example_function.__name__, params, outputs=job_config["outputs"]
+        )
 
         # Add the task to the list of tasks
         tasks.append(task)
@@ -19,8 +19,9 @@ def example_function(index, arg1, arg2):
     with open(f"result_{index}.txt", "w") as f:
         f.write(f"{str(arg1)} plus {str(arg2)} is {str(result)}")
 
-    # Write the file to huggingface
-    distributask.upload_file(f"result_{index}.txt")
+    # Write the file to huggingface, the upload is committed in the background together with the results of
+    # other tasks (small files are read right away, so the local file can be deleted)
+    distributask.upload_file(f"result_{index}.txt", wait=False)
 
     # Delete local file
     os.remove(f"result_{index}.txt")
@@ -1,14 +1,46 @@
+import asyncio
+import atexit
 import json
 import pytest
+import requests
 import time
 import os
 import tempfile
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
-
-from huggingface_hub import HfApi
-
-from ..distributask import create_from_config
-from .worker import example_test_function
+from urllib.parse import parse_qs, urlparse
+
+from celery import states
+from celery.exceptions import TimeoutError
+from celery.result import AsyncResult
+from celery.signals import worker_process_shutdown
+from huggingface_hub import (
+    CommitOperationAdd,
+    CommitOperationCopy,
+    CommitOperationDelete,
+    HfApi,
+)
+from kombu.serialization import dumps as serialize
+from kombu.serialization import loads as deserialize
+from kombu.serialization import prepare_accept_content
+from requests.exceptions import HTTPError
+
+from ..distributask import (
+    AsyncDistributask,
+    Autoscaler,
+    Distributask,
+    LocalBlobStore,
+    LocalCommitBackend,
+    PriceScorer,
+    Speculator,
+    ThroughputPerDollarScorer,
+    TokenBucket,
+    create_from_config,
+)
+from .worker import example_test_function, slow_test_function
 
 
 @pytest.fixture
@@ -48,7 +80,7 @@ def test_execute_function(mock_delay, mock_task_function):
     params = {"arg1": 1, "arg2": 2}
     distributask.execute_function(mock_task_function.__name__, params)
 
-    mock_delay.assert_called_once_with(mock_task_function.__name__, json.dumps(params))
+    mock_delay.assert_called_once_with(mock_task_function.__name__, params)
     print("Test passed")
 
 
@@ -74,6 +106,440 @@ def test_execute_function():
     print("Task execution test passed")
 
 
+def test_execute_many():
+    distributask = create_from_config()
+
+    distributask.register_function(example_test_function)
+    distributask.app.control.purge()
+    redis_client = distributask.get_redis_connection()
+
+    task_params = ({"arg1": i, "arg2": 20} for i in range(5))
+    batch = distributask.execute_many(
+        "example_test_function", task_params, chunk_size=2
+    )
+
+    assert len(batch) == 5
+    assert len(set(batch.task_ids)) == 5
+    assert [task.id for task in batch] == batch.task_ids
+    assert redis_client.llen("celery") == 5
+
+    distributask.app.control.purge()
+    print("Batch execution test passed")
+
+
+def test_queues_and_priorities():
+    distributask = create_from_config()
+
+    @distributask.register_function(queue="light", priority=5)
+    def light_test_function(index):
+        return index
+
+    redis_client = distributask.get_redis_connection()
+    redis_client.delete(*[f"light\x06\x16{priority}" for priority in range(1, 10)])
+    redis_client.delete("light")
+
+    default = distributask.execute_function("light_test_function", {"index": 0})
+    urgent = distributask.execute_function(
+        "light_test_function", {"index": 1}, priority=0
+    )
+    batch = distributask.execute_many(
+        "light_test_function", ({"index": i} for i in range(2, 4)), priority=9
+    )
+    distributask.execute_function("light_test_function", {"index": 4}, queue="celery")
+
+    assert distributask.get_queue_length("light") == 4
+    assert redis_client.llen("light\x06\x165") == 1
+    assert redis_client.llen("light\x06\x169") == 2
+
+    # workers take the highest priority first
+    with distributask.app.connection_for_read() as connection:
+        channel = connection.default_channel
+        order = [
+            channel.basic_get("light", no_ack=True).headers["id"] for _ in range(4)
+        ]
+    assert order[:2] == [urgent.id, default.id]
+    assert set(order[2:]) == set(batch.task_ids)
+
+    distributask.app.control.purge()
+
+
+def test_execute_function_dedup_key():
+    distributask = create_from_config()
+    distributask.register_function(example_test_function)
+    distributask.app.control.purge()
+    redis_client = distributask.get_redis_connection()
+    redis_client.delete("distributask-dedup:dedup_test")
+
+    task_params = {"arg1": 10, "arg2": 20}
+    task1 = distributask.execute_function(
+        "example_test_function", task_params, dedup_key="dedup_test"
+    )
+    task2 = distributask.execute_function(
+        "example_test_function", task_params, dedup_key="dedup_test"
+    )
+    assert task1.id == task2.id
+    assert redis_client.llen("celery") == 1
+
+    # a failed task can be submitted again
+    distributask.app.backend.mark_as_failure(task1.id, ValueError("boom"))
+    task3 = distributask.execute_function(
+        "example_test_function", task_params, dedup_key="dedup_test"
+    )
+    assert task3.id != task1.id
+    assert redis_client.llen("celery") == 2
+
+    # another client replacing the same failed task first wins the key
+    distributask.app.backend.mark_as_failure(task3.id, ValueError("boom"))
+    get_ready_task_meta = distributask.get_ready_task_meta
+
+    def replaced_meanwhile(task_ids):
+        redis_client.set("distributask-dedup:dedup_test", "rival")
+        return get_ready_task_meta(task_ids)
+
+    with patch.object(distributask, "get_ready_task_meta", replaced_meanwhile):
+        task4 = distributask.execute_function(
+            "example_test_function", task_params, dedup_key="dedup_test"
+        )
+    assert task4.id == "rival"
+    assert redis_client.llen("celery") == 2
+
+    # the key is released when publishing fails
+    redis_client.delete("distributask-dedup:dedup_test")
+    with patch.object(distributask, "send_task", side_effect=ConnectionError):
+        with pytest.raises(ConnectionError):
+            distributask.execute_function(
+                "example_test_function", task_params, dedup_key="dedup_test"
+            )
+        with pytest.raises(ConnectionError):
+            distributask.execute_many(
+                "example_test_function", [task_params], dedup_key=lambda _: "dedup_test"
+            )
+    assert not redis_client.exists("distributask-dedup:dedup_test")
+    task5 = distributask.execute_function(
+        "example_test_function", task_params, dedup_key="dedup_test"
+    )
+    assert redis_client.get("distributask-dedup:dedup_test").decode() == task5.id
+
+    for task in (task1, task3):
+        distributask.app.backend.forget(task.id)
+    redis_client.delete("distributask-dedup:dedup_test")
+    distributask.app.control.purge()
+
+
+def test_execute_many_dedup_key():
+    distributask = create_from_config()
+    distributask.register_function(example_test_function)
+    distributask.app.control.purge()
+    redis_client = distributask.get_redis_connection()
+
+    task_params = [{"arg1": i % 3, "arg2": 20} for i in range(6)]
+    for params in task_params:
+        key = distributask.get_dedup_key("example_test_function", params, True)
+        redis_client.delete(f"distributask-dedup:{key}")
+
+    batch1 = distributask.execute_many(
+        "example_test_function", task_params, dedup_key=True
+    )
+    batch2 = distributask.execute_many(
+        "example_test_function", task_params, dedup_key=True
+    )
+
+    assert len(set(batch1.task_ids)) == 3
+    assert batch1.task_ids == batch2.task_ids
+    assert redis_client.llen("celery") == 3
+
+    for params in task_params:
+        key = distributask.get_dedup_key("example_test_function", params, True)
+        redis_client.delete(f"distributask-dedup:{key}")
+    distributask.app.control.purge()
+
+
+def test_iter_ready_tasks():
+    distributask = create_from_config()
+    backend = distributask.app.backend
+
+    task_ids = ["monitor_test_1", "monitor_test_2"]
+    backend.store_result(task_ids[0], 1, states.SUCCESS)
+
+    tracker = distributask.iter_ready_tasks(task_ids, update_interval=0.1)
+    assert set(next(tracker)) == {task_ids[0]}
+
+    # the second completion is received through the result backend's pub/sub channel
+    backend.store_result(task_ids[1], 2, states.SUCCESS)
+    ready = {}
+    for finished in tracker:
+        ready.update(finished)
+
+    assert ready[task_ids[1]]["result"] == 2
+    assert set(distributask.get_ready_task_meta(task_ids)) == set(task_ids)
+
+    for task_id in task_ids:
+        backend.forget(task_id)
+    print("Task tracking test passed")
+
+
+def test_as_completed():
+    distributask = create_from_config()
+    backend = distributask.app.backend
+
+    task_ids = ["as_completed_test_1", "as_completed_test_2"]
+    backend.store_result(task_ids[0], "done", states.SUCCESS)
+    backend.mark_as_failure(task_ids[1], ValueError("boom"))
+
+    results = dict(
+        distributask.as_completed([AsyncResult(task_id) for task_id in task_ids])
+    )
+
+    assert results[task_ids[0]] == "done"
+    assert isinstance(results[task_ids[1]], ValueError)
+
+    with pytest.raises(TimeoutError):
+        list(
+            distributask.as_completed([AsyncResult("as_completed_test_3")], timeout=0.2)
+        )
+
+    for task_id in task_ids:
+        backend.forget(task_id)
+    print("As completed test passed")
+
+
+def test_pickle5_serializer():
+    payload = {"vertices": bytearray(b"\x00\x01" * 1024), "index": 3}
+
+    content_type, content_encoding, data = serialize(payload, serializer="pickle5")
+    decoded = deserialize(
+        data, content_type, content_encoding, accept=prepare_accept_content(["pickle5"])
+    )
+
+    assert decoded == payload
+    assert len(data) < 2 * 1024 + 200
+
+
+def test_unavailable_serializer():
+    with pytest.raises(ValueError):
+        Distributask(
+            hf_repo_id="repo",
+            hf_token="token",
+            vast_api_key="key",
+            task_serializer="unknown",
+        )
+
+
+def test_local_blob_store():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        blob_store = LocalBlobStore(temp_dir)
+        key = blob_store.put(b"payload")
+
+        assert blob_store.put(b"payload") == key
+        assert blob_store.get(key) == b"payload"
+
+        blob_store.delete(key)
+        blob_store.delete(key)
+        assert os.listdir(temp_dir) == []
+
+
+def test_offload_payload():
+    distributask = create_from_config()
+    redis_client = distributask.get_redis_connection()
+    threshold = distributask.settings["PAYLOAD_OFFLOAD_THRESHOLD"]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributask.blob_store = LocalBlobStore(temp_dir)
+        distributask.settings["PAYLOAD_OFFLOAD_THRESHOLD"] = 1024
+
+        try:
+            small_args = {"values": [1, 2, 3]}
+            large_args = {"values": list(range(1000))}
+            payload, size = distributask.offload_payload(small_args, "offload_test")
+            assert payload is small_args
+            assert 0 < size <= 1024
+
+            reference, size = distributask.offload_payload(large_args, "offload_test")
+            assert "__distributask_blob__" in reference
+            assert size > 1024
+            assert distributask.load_payload(reference) == large_args
+            assert redis_client.scard("distributask-blob:offload_test") == 1
+
+            # a worker without the blob store can't resolve the reference
+            blob_store, distributask.blob_store = distributask.blob_store, None
+            with pytest.raises(ValueError, match="BLOB_STORE_PATH"):
+                distributask.load_payload(reference)
+            distributask.blob_store = blob_store
+
+            distributask.cleanup_payloads()
+            assert os.listdir(temp_dir) == []
+            assert not redis_client.exists("distributask-blob:offload_test")
+        finally:
+            distributask.blob_store = None
+            distributask.settings["PAYLOAD_OFFLOAD_THRESHOLD"] = threshold
+
+
+def test_cached_function():
+    distributask = create_from_config()
+    calls = []
+
+    @distributask.register_function(cache=True, ttl=60, cache_max_entries=2)
+    def cached_test_function(value):
+        calls.append(value)
+        time.sleep(0.2)
+        return value * 2
+
+    distributask.clear_cache("cached_test_function")
+
+    # concurrent calls with identical arguments run the function once
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(
+            executor.map(
+                lambda _: distributask.call_cached_function(
+                    "cached_test_function", {"value": 1}, poll_interval=0.05
+                ),
+                range(3),
+            )
+        )
+    assert results == [2, 2, 2]
+    assert calls == [1]
+
+    # the least recently used result is evicted beyond cache_max_entries
+    distributask.call_cached_function("cached_test_function", {"value": 2})
+    distributask.call_cached_function("cached_test_function", {"value": 3})
+    hit, _ = distributask.get_cached_result(
+        "cached_test_function", distributask.get_args_hash({"value": 1})
+    )
+    assert not hit
+    assert calls == [1, 2, 3]
+
+    distributask.clear_cache("cached_test_function")
+
+
+def test_cache_max_bytes():
+    distributask = create_from_config()
+    distributask.register_function(
+        example_test_function, cache=True, cache_max_bytes=10
+    )
+    args_hash = distributask.get_args_hash({"arg1": 1, "arg2": 2})
+
+    assert not distributask.store_cached_result(
+        "example_test_function", args_hash, "x" * 100
+    )
+    assert distributask.store_cached_result("example_test_function", args_hash, "x")
+    assert distributask.get_cached_result("example_test_function", args_hash) == (
+        True,
+        "x",
+    )
+
+    distributask.clear_cache("example_test_function")
+    distributask.register_function(example_test_function)
+
+
+def test_args_hash_large_arrays():
+    np = pytest.importorskip("numpy")
+    distributask = create_from_config()
+    first = np.zeros(2000)
+    second = first.copy()
+    second[1000] = 1
+
+    serializer = distributask.settings["TASK_SERIALIZER"]
+    distributask.settings["TASK_SERIALIZER"] = "pickle5"
+    try:
+        # the arrays have the same truncated repr but must not share a hash
+        assert repr(first) == repr(second)
+        assert distributask.get_args_hash({"v": first}) != distributask.get_args_hash(
+            {"v": second}
+        )
+        assert distributask.get_args_hash(
+            {"v": first, "k": 1}
+        ) == distributask.get_args_hash({"k": 1, "v": first.copy()})
+    finally:
+        distributask.settings["TASK_SERIALIZER"] = serializer
+
+    # the json serializer can't encode arrays
+    if serializer == "json":
+        with pytest.raises(TypeError):
+            distributask.get_args_hash({"v": first})
+
+
+def test_retry_policy():
+    distributask = create_from_config()
+    calls = []
+
+    @distributask.register_function(
+        retry_on=(ConnectionError,), max_retries=3, retry_backoff=0
+    )
+    def flaky_retry_function(fail_times):
+        calls.append(fail_times)
+        if len(calls) <= fail_times:
+            raise ConnectionError("unavailable")
+        return len(calls)
+
+    # eager retries run immediately
+    result = distributask.call_function_task.apply(
+        ("flaky_retry_function", {"fail_times": 2})
+    )
+    assert result.get() == 3
+    assert 'distributask_tasks_retried_total{function="flaky_retry_function"} 2' in (
+        distributask.get_metrics().splitlines()
+    )
+
+    calls.clear()
+    result = distributask.call_function_task.apply(
+        ("flaky_retry_function", {"fail_times": 10})
+    )
+    assert result.failed()
+    assert isinstance(result.result, ConnectionError)
+    assert len(calls) == 4
+
+
+def test_dead_letters():
+    distributask = create_from_config()
+    distributask.clear_dead_letters()
+
+    @distributask.register_function(
+        retry_on=(ConnectionError,), max_retries=1, retry_backoff=0
+    )
+    def dead_letter_function(error):
+        raise {"value": ValueError, "connection": ConnectionError}[error]("failed")
+
+    distributask.call_function_task.apply(("dead_letter_function", {"error": "value"}))
+    distributask.call_function_task.apply(
+        ("dead_letter_function", {"error": "connection"})
+    )
+    distributask.call_function_task.apply(("example_test_function", {"index": "x"}))
+
+    letters = distributask.get_dead_letters()
+    assert [letter["function"] for letter in letters] == [
+        "dead_letter_function",
+        "dead_letter_function",
+        "example_test_function",
+    ]
+    # exceptions that aren't in retry_on fail immediately
+    assert letters[0]["retries"] == 0
+    assert letters[0]["exception"] == "ValueError('failed')"
+    assert letters[1]["retries"] == 1
+    assert letters[1]["args"] == {"error": "connection"}
+
+    # entries that couldn't be published stay in the list
+    with patch.object(distributask, "send_task", side_effect=ConnectionError):
+        with pytest.raises(ConnectionError):
+            distributask.replay_dead_letters(chunk_size=2)
+    assert distributask.get_dead_letters() == letters
+
+    distributask.app.control.purge()
+    batch = distributask.replay_dead_letters(func_name="dead_letter_function", count=1)
+    assert len(batch) == 1
+    assert distributask.get_queue_length() == 1
+    assert [letter["function"] for letter in distributask.get_dead_letters()] == [
+        "dead_letter_function",
+        "example_test_function",
+    ]
+
+    batch = distributask.replay_dead_letters()
+    assert len(batch) == 2
+    assert distributask.get_queue_length() == 3
+    assert distributask.get_dead_letters() == []
+
+    distributask.app.control.purge()
+
+
 # def test_worker_task_execution():
 #     distributask = create_from_config()
 
@@ -190,6 +656,285 @@ def test_upload_directory():
         api.delete_repo(repo_id=repo_id, repo_type="dataset", token=hf_token)
 
 
+def test_upload_buffer():
+    distributask = create_from_config()
+    distributask.close_upload_buffer()
+    settings = dict(distributask.settings)
+    backend = distributask.commit_backend
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributask.commit_backend = LocalCommitBackend(os.path.join(temp_dir, "repo"))
+        distributask.settings.update(
+            UPLOAD_BATCH_FILES=3,
+            UPLOAD_BATCH_BYTES=1024,
+            UPLOAD_BATCH_DELAY=0.5,
+            UPLOAD_MEMORY_BYTES=1024,
+        )
+        try:
+
+            def write_file(name, content):
+                path = os.path.join(temp_dir, name)
+                with open(path, "w") as f:
+                    f.write(content)
+                return path
+
+            # full batches are committed right away
+            futures = [
+                distributask.upload_file(
+                    write_file(f"result_{i}.txt", str(i)), wait=False
+                )
+                for i in range(7)
+            ]
+            commits = distributask.commit_backend.commits
+            # the two full batches are committed in parallel, in any order
+            commit_ids = {futures[0].result(timeout=5), futures[5].result(timeout=5)}
+            assert commit_ids == {commits[0]["id"], commits[1]["id"]}
+            assert not futures[6].done()
+            # the rest waits for UPLOAD_BATCH_DELAY
+            assert futures[6].result(timeout=5) == commits[2]["id"]
+            assert [len(commit["paths"]) for commit in commits] == [3, 3, 1]
+            with open(os.path.join(temp_dir, "repo", "result_4.txt")) as f:
+                assert f.read() == "4"
+
+            # so is a batch over UPLOAD_BATCH_BYTES
+            future = distributask.upload_file(
+                write_file("large.txt", "x" * 2048), "data/large.txt", wait=False
+            )
+            assert future.result(timeout=5) == commits[3]["id"]
+            assert commits[3]["paths"] == ["data/large.txt"]
+            with open(os.path.join(temp_dir, "repo", "data", "large.txt")) as f:
+                assert f.read() == "x" * 2048
+            # files over UPLOAD_MEMORY_BYTES are committed from their path, not read into memory
+            distributask.commit_backend.commit = MagicMock(
+                wraps=distributask.commit_backend.commit
+            )
+            distributask.upload_file(
+                write_file("large.txt", "y" * 2048), "data/large.txt", wait=False
+            ).result(timeout=5)
+            operation = distributask.commit_backend.commit.call_args[0][0][0]
+            assert operation.path_or_fileobj == os.path.join(temp_dir, "large.txt")
+            del distributask.commit_backend.commit
+
+            # a file uploaded twice is committed once with its latest content
+            first = distributask.upload_file(
+                write_file("status.txt", "started"), wait=False
+            )
+            second = distributask.upload_file(
+                write_file("status.txt", "done"), wait=False
+            )
+            distributask.flush_uploads()
+            assert first.result() == second.result() == commits[5]["id"]
+            assert commits[5]["paths"] == ["status.txt"]
+            with open(os.path.join(temp_dir, "repo", "status.txt")) as f:
+                assert f.read() == "done"
+
+            # by default upload_file returns once the file is committed, and logs errors
+            assert distributask.upload_file(write_file("sync.txt", "sync")) is None
+            assert commits[6]["paths"] == ["sync.txt"]
+            distributask.upload_file(os.path.join(temp_dir, "missing.txt"))
+            assert len(commits) == 7
+
+            # new buffers don't pile up exit handlers, the buffer in use is closed at exit
+            with patch("atexit.register") as register:
+                distributask.close_upload_buffer()
+                distributask.get_upload_buffer()
+            register.assert_not_called()
+
+            # a failed commit fails the futures of its files
+            distributask.commit_backend.commit = MagicMock(
+                side_effect=HTTPError("429 Too Many Requests")
+            )
+            distributask.close_upload_buffer()
+            future = distributask.upload_file(
+                write_file("failed.txt", "failed"), wait=False
+            )
+            distributask.close_upload_buffer()
+            with pytest.raises(HTTPError):
+                future.result(timeout=0)
+        finally:
+            distributask.close_upload_buffer()
+            distributask.commit_backend = backend
+            distributask.settings.update(settings)
+
+
+def test_background_uploads():
+    distributask = create_from_config()
+    distributask.close_upload_buffer()
+    settings = dict(distributask.settings)
+    backend = distributask.commit_backend
+
+    class SlowCommitBackend(LocalCommitBackend):
+        def __init__(self, root):
+            super().__init__(root)
+            self.attempts = 0
+            self.failures = []
+            self.max_queued_bytes = 0
+
+        def commit(self, operations, message, parent_commit=None):
+            self.attempts += 1
+            buffer = distributask.upload_buffer
+            if buffer is not None:
+                self.max_queued_bytes = max(self.max_queued_bytes, buffer.queued_bytes)
+            if self.failures:
+                response = requests.Response()
+                response.status_code = self.failures.pop(0)
+                raise HTTPError(f"{response.status_code} error", response=response)
+            time.sleep(0.05)
+            return super().commit(operations, message, parent_commit)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repo_dir = os.path.join(temp_dir, "repo")
+        distributask.commit_backend = SlowCommitBackend(repo_dir)
+        distributask.settings.update(
+            UPLOAD_BATCH_FILES=1,
+            UPLOAD_BATCH_DELAY=60,
+            UPLOAD_QUEUE_BYTES=30,
+            UPLOAD_THREADS=2,
+            UPLOAD_BACKOFF=0.01,
+            UPLOAD_WAIT=True,
+        )
+
+        def write_file(name, content):
+            path = os.path.join(temp_dir, name)
+            with open(path, "w") as f:
+                f.write(content)
+            return path
+
+        try:
+            # upload_file blocks while UPLOAD_QUEUE_BYTES bytes wait to be committed
+            futures = [
+                distributask.upload_file(
+                    write_file(f"part_{i}.txt", "x" * 10), wait=False
+                )
+                for i in range(8)
+            ]
+            distributask.wait_for_uploads(futures)
+            assert len(distributask.commit_backend.commits) == 8
+            assert distributask.commit_backend.max_queued_bytes <= 30
+
+            # server errors and rate limits are retried, other errors are not
+            distributask.commit_backend.failures = [503, 429]
+            attempts = distributask.commit_backend.attempts
+            future = distributask.upload_file(
+                write_file("retried.txt", "retried"), wait=False
+            )
+            distributask.wait_for_uploads([future])
+            assert distributask.commit_backend.attempts - attempts == 3
+
+            distributask.commit_backend.failures = [401]
+            attempts = distributask.commit_backend.attempts
+            future = distributask.upload_file(
+                write_file("denied.txt", "denied"), wait=False
+            )
+            with pytest.raises(HTTPError):
+                distributask.wait_for_uploads([future])
+            assert distributask.commit_backend.attempts - attempts == 1
+
+            # tasks return once the files they uploaded are committed
+            distributask.settings["UPLOAD_BATCH_FILES"] = 100
+
+            def upload_test_function(index):
+                distributask.upload_file(
+                    write_file(f"output_{index}.txt", str(index)),
+                    f"outputs/output_{index}.txt",
+                    wait=False,
+                )
+                return index
+
+            distributask.register_function(upload_test_function)
+            distributask.close_upload_buffer()
+            result = distributask.call_function_task.apply(
+                args=("upload_test_function", {"index": 1})
+            )
+            assert result.get() == 1
+            assert os.path.exists(os.path.join(repo_dir, "outputs", "output_1.txt"))
+
+            # tasks run one at a time, as in a prefork worker, make one commit each
+            commits = len(distributask.commit_backend.commits)
+            for index in range(3):
+                distributask.call_function_task.apply(
+                    args=("upload_test_function", {"index": index})
+                )
+            assert len(distributask.commit_backend.commits) == commits + 3
+
+            # concurrent tasks, as in a threads pool, share one commit
+            barrier = threading.Barrier(4)
+
+            def slow_upload_test_function(index):
+                # every task is running before any of them finishes
+                barrier.wait(timeout=10)
+                return upload_test_function(index)
+
+            distributask.register_function(slow_upload_test_function)
+            commits = len(distributask.commit_backend.commits)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(
+                    executor.map(
+                        lambda index: distributask.call_function_task.apply(
+                            args=("slow_upload_test_function", {"index": index})
+                        ).get(),
+                        range(4),
+                    )
+                )
+            assert results == list(range(4))
+            assert len(distributask.commit_backend.commits) == commits + 1
+
+            # a task that waits for its own uploads doesn't wait for itself
+            def waiting_upload_test_function(index):
+                distributask.upload_file(write_file(f"output_{index}.txt", str(index)))
+                return index
+
+            distributask.register_function(waiting_upload_test_function)
+            start = time.monotonic()
+            distributask.call_function_task.apply(
+                args=("waiting_upload_test_function", {"index": 0})
+            )
+            assert time.monotonic() - start < 5
+
+            # the calls of a chunk share one commit
+            commits = len(distributask.commit_backend.commits)
+            result = distributask.call_function_chunk_task.apply(
+                args=("upload_test_function", [{"index": i} for i in range(5)])
+            )
+            assert [value for _, value in result.get()] == list(range(5))
+            assert len(distributask.commit_backend.commits) == commits + 1
+
+            # and a call fails if its output can't be committed
+            distributask.commit_backend.failures = [403]
+            result = distributask.call_function_task.apply(
+                args=("upload_test_function", {"index": 2})
+            )
+            assert result.state == states.FAILURE
+            assert isinstance(result.result, HTTPError)
+
+            # by default tasks return before their outputs are committed, so consecutive tasks, as in a prefork
+            # worker, share a commit, made when the worker process exits at the latest
+            distributask.close_upload_buffer()
+            distributask.settings["UPLOAD_WAIT"] = False
+            commits = len(distributask.commit_backend.commits)
+            for index in range(3):
+                result = distributask.call_function_task.apply(
+                    args=("upload_test_function", {"index": index})
+                )
+                assert result.get() == index
+            assert len(distributask.commit_backend.commits) == commits
+            worker_process_shutdown.send(sender=None, pid=os.getpid(), exitcode=0)
+            assert len(distributask.commit_backend.commits) == commits + 1
+            assert distributask.commit_backend.commits[-1]["paths"] == [
+                f"outputs/output_{index}.txt" for index in range(3)
+            ]
+            # closing the buffer stopped its threads, no commit or retry is left running
+            assert not any(
+                thread.name.startswith("distributask-upload")
+                for thread in threading.enumerate()
+            )
+        finally:
+            distributask.close_upload_buffer()
+            distributask.commit_backend = backend
+            distributask.settings.update(settings)
+            distributask.clear_dead_letters()
+
+
 def test_delete_file():
     distributask = create_from_config()
     distributask.initialize_dataset()
@@ -249,6 +994,9 @@ def test_file_exists():
     # delete the file on disk
     os.remove(test_file)
 
+    # the file was committed by another client, list the files again
+    distributask.refresh_repo_index(force=True)
+
     # Check if the file exists in the repository
     assert distributask.file_exists(repo_id, test_file)
 
@@ -282,6 +1030,7 @@ def test_list_files():
         )
 
     # List the files in the repository
+    distributask.refresh_repo_index(force=True)
     repo_files = distributask.list_files(repo_id)
 
     for file in test_files:
@@ -295,6 +1044,287 @@ def test_list_files():
     api.delete_repo(repo_id=repo_id, repo_type="dataset", token=hf_token)
 
 
+def test_repo_index():
+    distributask = create_from_config()
+    distributask.close_upload_buffer()
+    settings = dict(distributask.settings)
+    backend = distributask.commit_backend
+    repo_id = distributask.settings["HF_REPO_ID"]
+    key = distributask.get_repo_index_key()
+    redis_client = distributask.get_redis_connection()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributask.commit_backend = LocalCommitBackend(os.path.join(temp_dir, "repo"))
+        distributask.settings.update(REPO_INDEX_TTL=60, UPLOAD_BATCH_DELAY=0)
+        redis_client.delete(key, f"{key}:info", f"{key}:commits")
+        try:
+            # files committed by another client
+            distributask.commit_backend.commit(
+                [
+                    CommitOperationAdd("a.txt", b"a"),
+                    CommitOperationAdd("data/b.txt", b"b"),
+                ],
+                "Add files",
+            )
+            with patch.object(
+                distributask.commit_backend,
+                "list_files",
+                wraps=distributask.commit_backend.list_files,
+            ) as list_files:
+                assert distributask.file_exists(repo_id, "data/b.txt")
+                assert not distributask.file_exists(repo_id, "c.txt")
+                assert distributask.list_files(repo_id) == ["a.txt", "data/b.txt"]
+                assert list_files.call_count == 1
+
+                # uploads and deletes update the index without listing the files again
+                file_path = os.path.join(temp_dir, "c.txt")
+                with open(file_path, "w") as f:
+                    f.write("c")
+                distributask.upload_file(file_path)
+                assert distributask.file_exists(repo_id, "c.txt")
+                distributask.delete_file(repo_id, "a.txt")
+                assert not distributask.file_exists(repo_id, "a.txt")
+                assert list_files.call_count == 1
+                # and the index moves on to their commits once REPO_INDEX_TTL has passed
+                head = distributask.commit_backend.get_revision()
+                distributask.settings["REPO_INDEX_TTL"] = 0
+                assert distributask.refresh_repo_index() == head
+                assert distributask.file_exists(repo_id, "c.txt")
+                assert list_files.call_count == 1
+
+                # other commits are seen once the index has been used for REPO_INDEX_TTL seconds
+                distributask.settings["REPO_INDEX_TTL"] = 60
+                distributask.commit_backend.commit(
+                    [CommitOperationAdd("d.txt", b"d")], "Add d.txt"
+                )
+                assert not distributask.file_exists(repo_id, "d.txt")
+                distributask.settings["REPO_INDEX_TTL"] = 0
+                assert distributask.file_exists(repo_id, "d.txt")
+                assert distributask.list_files(repo_id) == [
+                    "c.txt",
+                    "d.txt",
+                    "data/b.txt",
+                ]
+                assert list_files.call_count == 2
+
+                # commits made in parallel, finishing in any order, don't cause a listing either
+                distributask.close_upload_buffer()
+                distributask.settings.update(UPLOAD_BATCH_FILES=1, UPLOAD_THREADS=4)
+                futures = []
+                for i in range(8):
+                    file_path = os.path.join(temp_dir, f"e_{i}.txt")
+                    with open(file_path, "w") as f:
+                        f.write(str(i))
+                    futures.append(distributask.upload_file(file_path, wait=False))
+                distributask.wait_for_uploads(futures)
+                assert all(distributask.files_exist([f"e_{i}.txt" for i in range(8)]))
+                assert distributask.refresh_repo_index() == (
+                    distributask.commit_backend.get_revision()
+                )
+                assert list_files.call_count == 2
+        finally:
+            distributask.close_upload_buffer()
+            distributask.commit_backend = backend
+            distributask.settings.update(settings)
+            redis_client.delete(key, f"{key}:info", f"{key}:commits")
+
+
+def test_skip_existing_outputs():
+    distributask = create_from_config()
+    backend = distributask.commit_backend
+    key = distributask.get_repo_index_key()
+    redis_client = distributask.get_redis_connection()
+    calls = []
+
+    def output_test_function(index):
+        calls.append(index)
+        return index
+
+    distributask.register_function(output_test_function)
+    distributask.app.control.purge()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributask.commit_backend = LocalCommitBackend(temp_dir)
+        redis_client.delete(key, f"{key}:info", f"{key}:commits")
+        try:
+            distributask.commit_backend.commit(
+                [
+                    CommitOperationAdd("out_0.txt", b"0"),
+                    CommitOperationAdd("out_1.txt", b"1"),
+                ],
+                "Add outputs",
+            )
+            assert distributask.files_exist(["out_1.txt", "out_2.txt"]) == [True, False]
+
+            # tasks whose outputs all exist are not published
+            result = distributask.execute_function(
+                "output_test_function", {"index": 0}, outputs=["out_0.txt"]
+            )
+            assert result.successful() and result.get() is None
+            assert distributask.get_queue_length() == 0
+            result = distributask.execute_function(
+                "output_test_function",
+                {"index": 0},
+                outputs=["out_0.txt", "out_2.txt"],
+            )
+            assert not result.ready()
+            assert distributask.get_queue_length() == 1
+            distributask.app.control.purge()
+
+            batch = distributask.execute_many(
+                "output_test_function",
+                [{"index": i} for i in range(4)],
+                chunk_size=3,
+                outputs=lambda args: [f"out_{args['index']}.txt"],
+            )
+            assert len(batch) == 4
+            assert [task.ready() for task in batch] == [True, True, False, False]
+            assert distributask.get_queue_length() == 2
+
+            # the worker checks the outputs again before it calls the function
+            for index in (1, 2):
+                result = distributask.call_function_task.apply(
+                    args=("output_test_function", {"index": index}),
+                    headers={"outputs": [f"out_{index}.txt"]},
+                )
+                assert result.successful()
+            assert calls == [2]
+        finally:
+            distributask.app.control.purge()
+            distributask.commit_backend = backend
+            redis_client.delete(key, f"{key}:info", f"{key}:commits")
+
+
+def test_commit_with_retries():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        backend = LocalCommitBackend(temp_dir)
+        backend.commit([CommitOperationAdd("a.txt", b"a")], "Add a.txt")
+        commit = backend.commit
+        errors = [503]
+
+        def flaky_commit(operations, message, parent_commit=None):
+            if parent_commit is None and errors:
+                response = requests.Response()
+                response.status_code = errors.pop(0)
+                raise HTTPError(f"{response.status_code} Failed", response=response)
+            return commit(operations, message, parent_commit)
+
+        backend.commit = flaky_commit
+        # a conflict with the parent doesn't use up a retry
+        commit_id, parent_commit = backend.commit_with_retries(
+            [CommitOperationAdd("b.txt", b"b")],
+            "Add b.txt",
+            max_retries=1,
+            retry_backoff=0.01,
+            parent_commit="stale",
+        )
+        assert parent_commit is None
+        assert commit_id == backend.get_revision()
+        assert errors == []
+
+
+def test_batch_operations():
+    distributask = create_from_config()
+    settings = dict(distributask.settings)
+    backend = distributask.commit_backend
+    repo_id = distributask.settings["HF_REPO_ID"]
+    key = distributask.get_repo_index_key()
+    redis_client = distributask.get_redis_connection()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributask.commit_backend = LocalCommitBackend(temp_dir)
+        distributask.settings.update(UPLOAD_BACKOFF=0.01, REPO_INDEX_TTL=60)
+        redis_client.delete(key, f"{key}:info", f"{key}:commits")
+        try:
+            distributask.commit_backend.commit(
+                [CommitOperationAdd(f"bad_{i}.txt", b"bad") for i in range(10)],
+                "Add files",
+            )
+            paths = [f"bad_{i}.txt" for i in range(10)] + ["unknown.txt"]
+
+            # a dry run only reports the commits, paths missing from the index are left out
+            summaries = distributask.delete_files(paths, chunk_size=4, dry_run=True)
+            assert [len(summary["delete"]) for summary in summaries] == [4, 4, 2]
+            assert [summary["commit"] for summary in summaries] == [None] * 3
+            assert summaries[2]["missing"] == ["unknown.txt"]
+            assert len(distributask.commit_backend.commits) == 1
+
+            summaries = distributask.delete_files(paths, chunk_size=4)
+            assert len(distributask.commit_backend.commits) == 4
+            assert all(summary["commit"] for summary in summaries)
+            assert summaries[2]["missing"] == ["unknown.txt"]
+            assert distributask.list_files(repo_id) == []
+            assert os.listdir(temp_dir) == []
+
+            # adds, copies and deletes are combined, and transient errors are retried
+            commit = distributask.commit_backend.commit
+            attempts = []
+
+            def flaky_commit(operations, message, parent_commit=None):
+                attempts.append(message)
+                if len(attempts) <= 2:
+                    # a server error, then a conflict with a concurrent commit
+                    response = requests.Response()
+                    response.status_code = 503 if len(attempts) == 1 else 409
+                    raise HTTPError(f"{response.status_code} Failed", response=response)
+                return commit(operations, message)
+
+            distributask.commit_backend.commit = flaky_commit
+            summaries = distributask.batch_operations(
+                [
+                    CommitOperationAdd("a.txt", b"a"),
+                    CommitOperationAdd("b.txt", b"b"),
+                    CommitOperationCopy("a.txt", "data/a.txt"),
+                    CommitOperationDelete("b.txt"),
+                ],
+                chunk_size=2,
+                concurrency=1,
+            )
+            assert summaries[1]["copy"] == [("a.txt", "data/a.txt")]
+            assert len(attempts) == 4
+            assert distributask.list_files(repo_id) == ["a.txt", "data/a.txt"]
+            distributask.commit_backend.commit = commit
+
+            # a failed commit changes nothing and is reported without stopping the others
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                f.write(b"d")
+            add = CommitOperationAdd("d.txt", f.name)
+            os.remove(f.name)
+            summaries = distributask.batch_operations(
+                [
+                    CommitOperationDelete("data/a.txt"),
+                    add,
+                    CommitOperationCopy("a.txt", "e.txt"),
+                ],
+                chunk_size=2,
+            )
+            assert isinstance(summaries[0]["error"], FileNotFoundError)
+            assert summaries[1]["commit"]
+            assert distributask.list_files(repo_id) == ["a.txt", "data/a.txt", "e.txt"]
+
+            # a file deleted since the index was listed is left out once the Hub rejects the commit
+            commit([CommitOperationDelete("e.txt")], "Delete e.txt")
+            assert distributask.file_exists(repo_id, "e.txt")
+            summaries = distributask.delete_files(["e.txt", "a.txt"], chunk_size=2)
+            assert summaries[0]["missing"] == ["e.txt"]
+            assert summaries[0]["delete"] == ["a.txt"]
+            assert summaries[0]["commit"]
+            assert distributask.list_files(repo_id) == ["data/a.txt"]
+
+            # a file added since the index was listed is found by listing the files again, not left out
+            commit([CommitOperationAdd("f.txt", b"f")], "Add f.txt")
+            assert not distributask.file_exists(repo_id, "f.txt")
+            summaries = distributask.delete_files(["f.txt"])
+            assert summaries[0]["delete"] == ["f.txt"]
+            assert summaries[0]["missing"] == []
+            assert summaries[0]["commit"]
+            assert distributask.list_files(repo_id) == ["data/a.txt"]
+        finally:
+            distributask.commit_backend = backend
+            distributask.settings.update(settings)
+            redis_client.delete(key, f"{key}:info", f"{key}:commits")
+
+
 @pytest.fixture(scope="module")
 def rented_nodes():
     distributask = create_from_config()
@@ -315,6 +1345,28 @@ def test_rent_run_terminate(rented_nodes):
     time.sleep(3)  # sleep for 3 seconds to simulate runtime
 
 
+def test_get_instance_request():
+    distributask = create_from_config()
+    settings = dict(distributask.settings)
+    distributask.settings.update(
+        METRICS_PORT=None, BLOB_STORE_PATH=None, TELEMETRY=False, UPLOAD_WAIT=True
+    )
+    try:
+        request = distributask.get_instance_request(
+            "1", "test_image", "distributask.example.worker", None, None
+        )
+    finally:
+        distributask.settings.update(settings)
+
+    # unset settings are left out so workers keep their defaults
+    env = request["env"]
+    assert "METRICS_PORT" not in env
+    assert "BLOB_STORE_PATH" not in env
+    assert env["TELEMETRY"] == "false"
+    assert env["UPLOAD_WAIT"] == "true"
+    assert all(isinstance(value, str) for value in env.values())
+
+
 def test_get_redis_url():
     distributask = create_from_config()
     redis_url = distributask.get_redis_url()
@@ -342,6 +1394,44 @@ def test_get_redis_connection_force_new():
     assert redis_client1 is not redis_client2
 
 
+def test_redis_connection_pool():
+    distributask = create_from_config()
+    redis_client1 = distributask.get_redis_connection()
+    redis_client2 = distributask.get_redis_connection(force_new=True)
+
+    # every client shares one pool sized from the settings
+    assert redis_client1.connection_pool is redis_client2.connection_pool
+    assert redis_client1.connection_pool.max_connections == int(
+        distributask.settings["REDIS_POOL_SIZE"]
+    )
+
+    redis_client2.delete("pool_test_counter")
+
+    def increment(_):
+        for _ in range(50):
+            redis_client2.incr("pool_test_counter")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(increment, range(8)))
+
+    assert int(redis_client2.get("pool_test_counter")) == 400
+    redis_client2.delete("pool_test_counter")
+
+
+def test_reap_idle_connections():
+    distributask = create_from_config()
+    redis_client = distributask.get_redis_connection()
+    redis_client.ping()
+
+    pool = redis_client.connection_pool
+    free_connections = [c for c in pool.pool.queue if c is not None]
+    for connection in free_connections:
+        connection.last_released -= pool.idle_timeout
+
+    assert pool.reap_idle_connections() == len(free_connections)
+    assert redis_client.ping()
+
+
 def test_get_env_with_default():
     distributask = create_from_config()
     default_value = "default"
@@ -350,7 +1440,7 @@ def test_get_env_with_default():
     assert value == default_value
 
 
-@patch("requests.get")
+@patch("requests.Session.request")
 def test_search_offers(mock_get):
     distributask = create_from_config()
     max_price = 1.0
@@ -366,7 +1456,7 @@ def test_search_offers(mock_get):
     assert offers[1]["id"] == "offer2"
 
 
-@patch("requests.put")
+@patch("requests.Session.request")
 def test_create_instance(mock_put):
     distributask = create_from_config()
     offer_id = "offer1"
@@ -383,8 +1473,697 @@ def test_create_instance(mock_put):
 
     assert instance["new_contract"] == "instance1"
 
+    distributask.create_instance(
+        offer_id,
+        image,
+        module_name,
+        distributask.settings,
+        None,
+        queues=["light", "celery"],
+    )
+    onstart = mock_put.call_args.kwargs["json"]["onstart"]
+    assert onstart.endswith(f"--hostname=celery@vast-{offer_id} -Q light,celery")
+
+
+@pytest.fixture
+def vast_api_server():
+    """
+    Fixture that runs a local HTTP server standing in for the Vast.ai API. Offers 2 and 4 can't be rented,
+    the first destroy of instances in "flaky" fails and instances in "stuck" are never destroyed. The next
+    "throttled" requests are rate limited, and "connections" records the client port of every request.
+    """
+    state = {
+        "created": [],
+        "destroyed": [],
+        "failing": {2, 4},
+        "flaky": set(),
+        "stuck": set(),
+        "searches": [],
+        "throttled": 0,
+        "connections": [],
+    }
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        # keeps connections alive
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def handle_one_request(self):
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.raw_requestline or not self.parse_request():
+                self.close_connection = True
+                return
+            state["connections"].append(self.client_address[1])
+            with lock:
+                throttled = state["throttled"] > 0
+                state["throttled"] -= throttled
+            if throttled:
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            getattr(self, f"do_{self.command}")()
+            self.wfile.flush()
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/instances/"):
+                instance_id = int(self.path.split("/")[2])
+                if instance_id in state["destroyed"]:
+                    return self.reply(404, {"error": "no_such_instance"})
+                return self.reply(200, {"instances": {"id": instance_id}})
+            state["searches"].append(parse_qs(urlparse(self.path).query)["q"][0])
+            offers = [{"id": i, "dph_total": 0.1 * i} for i in range(1, 9)]
+            self.reply(200, {"offers": offers})
+
+        def do_PUT(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            offer_id = int(self.path.split("/")[2])
+            time.sleep(0.2)
+            if offer_id in state["failing"]:
+                return self.reply(400, {"error": "no_such_ask"})
+            with lock:
+                state["created"].append(offer_id)
+            self.reply(200, {"success": True, "new_contract": offer_id * 100})
+
+        def do_DELETE(self):
+            instance_id = int(self.path.split("/")[2])
+            with lock:
+                if instance_id in state["flaky"]:
+                    state["flaky"].remove(instance_id)
+                    return self.reply(500, {"error": "internal_error"})
+                if instance_id not in state["stuck"]:
+                    state["destroyed"].append(instance_id)
+            self.reply(200, {"success": True})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_rent_nodes(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setattr(distributask, "vast_rate_limiter", TokenBucket(1000, 1000))
+
+    start = time.time()
+    nodes = distributask.rent_nodes(
+        1.0, 4, "test_image", "distributask.example.worker", concurrency=4
+    )
+    elapsed = time.time() - start
+    atexit.unregister(distributask.terminate_nodes)
+
+    # the cheapest offers that can be rented, tried concurrently
+    assert sorted(node["offer_id"] for node in nodes) == [1, 3, 5, 6]
+    assert sorted(node["instance_id"] for node in nodes) == [100, 300, 500, 600]
+    assert sorted(vast_api_server["created"]) == [1, 3, 5, 6]
+    assert vast_api_server["destroyed"] == []
+    # six offers are tried with 0.2s of latency each, sequentially this takes over 1.2s
+    assert elapsed < 1
+
+
+def test_terminate_nodes(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setattr(distributask, "vast_rate_limiter", TokenBucket(1000, 1000))
+    vast_api_server["flaky"].add(300)
+    vast_api_server["stuck"].add(500)
+
+    nodes = [{"offer_id": i, "instance_id": i * 100} for i in (1, 3, 5)]
+    reports = distributask.terminate_nodes(nodes, max_retries=2, backoff=0.01)
+
+    assert [report["instance_id"] for report in reports] == [100, 300, 500]
+    assert [report["terminated"] for report in reports] == [True, True, False]
+    # the server error of the flaky destroy is retried by the session
+    assert [report["attempts"] for report in reports] == [1, 1, 3]
+    assert reports[2]["error"] == "instance still exists after destroy"
+    assert sorted(vast_api_server["destroyed"]) == [100, 300]
+
+
+def test_terminate_nodes_at_exit():
+    # terminate_nodes is registered with atexit, where a ThreadPoolExecutor can't schedule work anymore
+    script = """
+import atexit, json, threading, time
+from distributask.distributask import create_from_config
+
+distributask = create_from_config()
+
+def terminate_node(node, max_retries, backoff):
+    time.sleep(0.1)
+    return {"instance_id": node["instance_id"], "terminated": True, "thread": threading.current_thread().name}
+
+distributask.terminate_node = terminate_node
+nodes = [{"instance_id": i} for i in range(8)]
+atexit.register(lambda: print(json.dumps(distributask.terminate_nodes(nodes, concurrency=4))))
+"""
+    process = subprocess.run(
+        ["python", "-c", script], capture_output=True, text=True, timeout=60
+    )
+    assert process.returncode == 0, process.stderr
+    assert "Traceback" not in process.stderr
+    reports = json.loads(
+        next(line for line in process.stdout.splitlines() if line.startswith("["))
+    )
+    assert [report["instance_id"] for report in reports] == list(range(8))
+    assert all(report["terminated"] for report in reports)
+    assert len({report["thread"] for report in reports}) > 1
+
+
+def test_vast_session(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setattr(distributask, "vast_rate_limiter", TokenBucket(1000, 1000))
+    monkeypatch.setattr(distributask, "vast_session", None)
+
+    # one kept-alive connection for sequential calls
+    for instance_id in range(5):
+        distributask.get_instance(instance_id)
+    assert len(set(vast_api_server["connections"])) == 1
+
+    # rate limited calls are retried, including instance creation
+    vast_api_server["throttled"] = 2
+    assert distributask.search_offers(1.0, use_cache=False)
+    vast_api_server["throttled"] = 2
+    assert distributask.create_instance(1, "test_image", "module", {}, None)
+    assert vast_api_server["created"] == [1]
+
+    # the last response is returned once the retries are used up
+    vast_api_server["throttled"] = 10
+    assert distributask.destroy_instance(100).status_code == 429
+    vast_api_server["throttled"] = 0
+
+    # every attempt waits for the rate limiter, not only the first one
+    acquired = []
+    monkeypatch.setattr(
+        distributask.vast_rate_limiter, "acquire", lambda: acquired.append(1)
+    )
+    vast_api_server["throttled"] = 2
+    distributask.get_instance(1)
+    assert len(acquired) == 3
+
+
+def test_vast_retry():
+    retry = Distributask.get_vast_retry(
+        MagicMock(settings={"VAST_API_RETRIES": 3, "VAST_API_BACKOFF": 0.5})
+    )
+    assert retry.get_wait_time(2) == 2
+    # Retry-After in seconds or as an HTTP date, in the past here
+    assert retry.get_wait_time(0, "7") == 7
+    assert retry.get_wait_time(0, "Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry.get_wait_time(1, "soon") == 1
+
+    assert retry.is_retry("PUT", 429) and not retry.is_retry("PUT", 503)
+    assert retry.is_retry("GET", 503)
+    # timeouts are only retried for requests that are safe to repeat
+    assert retry.is_retryable_error("GET", connect=False)
+    assert not retry.is_retryable_error("PUT", connect=False)
+    assert retry.is_retryable_error("PUT", connect=True)
+
+
+def test_autoscaler(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setattr(distributask, "vast_rate_limiter", TokenBucket(1000, 1000))
+    # stand-ins for the workers of the rented nodes, "celery@vast-3" is still running a task
+    inspector = MagicMock()
+    inspector.active.side_effect = [{"celery@vast-3": [{"id": "task1"}]}, {}]
+    inspector.reserved.return_value = {}
+    monkeypatch.setattr(distributask.app.control, "cancel_consumer", MagicMock())
+    monkeypatch.setattr(
+        distributask.app.control, "inspect", MagicMock(return_value=inspector)
+    )
+    redis_client = distributask.get_redis_connection()
+    queue = "autoscaler_test"
+    redis_client.delete(queue)
+
+    autoscaler = Autoscaler(
+        distributask,
+        max_price=1.0,
+        image="test_image",
+        module_name="distributask.example.worker",
+        min_nodes=1,
+        max_nodes=3,
+        target_backlog=5,
+        queue=queue,
+        scale_down_delay=0,
+        inspect_timeout=0.1,
+    )
+
+    # 20 queued tasks need 4 nodes, capped at max_nodes
+    redis_client.rpush(queue, *range(20))
+    status = autoscaler.step()
+    assert status["queued"] == 20
+    assert status["desired"] == 3
+    assert sorted(node["offer_id"] for node in autoscaler.nodes) == [1, 3, 5]
+
+    # the queue tail only needs one node, the most expensive ones are drained first
+    redis_client.ltrim(queue, 0, 3)
+    status = autoscaler.step()
+    assert status["desired"] == 1
+    assert [node["offer_id"] for node in autoscaler.nodes] == [1]
+    assert sorted(node["offer_id"] for node in autoscaler.draining) == [3, 5]
+    assert vast_api_server["destroyed"] == []
+    destination = distributask.app.control.cancel_consumer.call_args.kwargs[
+        "destination"
+    ]
+    assert sorted(destination) == ["celery@vast-3", "celery@vast-5"]
+
+    # the idle worker is destroyed, the busy one keeps draining until it is idle
+    autoscaler.step()
+    assert [node["offer_id"] for node in autoscaler.draining] == [3]
+    assert vast_api_server["destroyed"] == [500]
+    autoscaler.step()
+    assert autoscaler.draining == []
+    assert sorted(vast_api_server["destroyed"]) == [300, 500]
+
+    autoscaler.stop()
+    autoscaler.run()
+    assert sorted(vast_api_server["destroyed"]) == [100, 300, 500]
+    redis_client.delete(queue)
+    atexit.unregister(distributask.terminate_nodes)
+
+
+def test_search_offers_filters_and_cache(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setitem(distributask.settings, "OFFER_CACHE_TTL", 30)
+
+    offers = distributask.search_offers(
+        0.5, min_gpu_ram=16, regions=["US", "CA"], min_cuda=12.1
+    )
+    assert len(offers) == 8
+    query = json.loads(vast_api_server["searches"][0])
+    assert query["gpu_ram"] == {"gte": 16 * 1024}
+    assert query["geolocation"] == {"in": ["US", "CA"]}
+    assert query["cuda_max_good"] == {"gte": 12.1}
+    assert query["dph_total"] == {"lte": 0.5}
+
+    # the same search is answered from the cache, unless the cache is bypassed
+    distributask.search_offers(0.5, min_gpu_ram=16, regions=["US", "CA"], min_cuda=12.1)
+    assert len(vast_api_server["searches"]) == 1
+    distributask.search_offers(
+        0.5, min_gpu_ram=16, regions=["US", "CA"], min_cuda=12.1, use_cache=False
+    )
+    assert len(vast_api_server["searches"]) == 2
+
+
+def test_get_offer_query():
+    distributask = create_from_config()
+
+    # GPU RAM is given in GB and searched in MB
+    query = distributask.get_offer_query(0.5)
+    assert query["gpu_ram"] == {"gte": 4096}
+    query = distributask.get_offer_query(0.5, min_gpu_ram=24, filters={"num_gpus": 1})
+    assert query["gpu_ram"] == {"gte": 24576}
+    assert query["num_gpus"] == 1
+    assert "geolocation" not in query
+
+
+def test_rank_offers(monkeypatch):
+    distributask = create_from_config()
+    offers = [
+        {"id": 1, "gpu_name": "RTX 3060", "total_flops": 12, "dph_total": 0.1},
+        {"id": 2, "gpu_name": "RTX 4090", "total_flops": 80, "dph_total": 0.4},
+        {"id": 3, "gpu_name": "RTX 3090", "total_flops": 35, "dph_total": 0.2},
+        {
+            "id": 4,
+            "gpu_name": "RTX 4090",
+            "total_flops": 80,
+            "dph_total": 0.4,
+            "reliability2": 0.5,
+            "inet_down": 50,
+        },
+    ]
+
+    assert [offer["id"] for offer in PriceScorer().rank(offers)] == [1, 3, 2, 4]
+
+    # without measurements flops per dollar decides, unreliable and slow hosts are penalized
+    ranked = ThroughputPerDollarScorer().rank(offers)
+    assert [offer["id"] for offer in ranked] == [2, 3, 1, 4]
+
+    # measured durations override the flops estimate and calibrate the other models
+    redis_client = distributask.get_redis_connection()
+    redis_client.delete("distributask-gpu-durations")
+    for _ in range(2):
+        distributask.record_gpu_duration("RTX 4090", 10.0)
+    distributask.record_gpu_duration("RTX 3060", 8.0)
+    assert distributask.get_gpu_durations() == {"RTX 4090": 10.0, "RTX 3060": 8.0}
+    ranked = distributask.rank_offers(offers)
+    assert [offer["id"] for offer in ranked] == [1, 3, 2, 4]
+    redis_client.delete("distributask-gpu-durations")
+
+    monkeypatch.setattr(distributask, "offer_scorer", PriceScorer())
+    assert distributask.rank_offers(offers)[0]["id"] == 1
+
+
+def test_task_telemetry(monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "TELEMETRY", True)
+
+    def telemetry_function(duration):
+        time.sleep(duration)
+        return "x" * 1000
+
+    def failing_telemetry_function():
+        raise RuntimeError("failed")
+
+    distributask.register_function(telemetry_function)
+    distributask.register_function(failing_telemetry_function)
+
+    since = time.time()
+    for _ in range(3):
+        # the task waited one second in the queue
+        distributask.call_function_task.apply(
+            ("telemetry_function", {"duration": 0.05}),
+            headers={"sent_at": time.time() - 1, "args_bytes": 20},
+        )
+    distributask.call_function_task.apply(("failing_telemetry_function", {}))
+
+    # payload sizes are only measured when offload_payload serializes them for a blob store
+    stats = distributask.get_task_stats(since=since)
+    assert stats["telemetry_function"]["result_bytes"] is None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        distributask.blob_store = LocalBlobStore(temp_dir)
+        try:
+            distributask.call_function_task.apply(
+                ("telemetry_function", {"duration": 0.05}),
+                headers={"sent_at": time.time() - 1, "args_bytes": 20},
+            )
+        finally:
+            distributask.blob_store = None
+
+    stats = distributask.get_task_stats(since=since)
+    assert stats["telemetry_function"]["tasks"] == 4
+    assert stats["telemetry_function"]["failures"] == 0
+    assert stats["telemetry_function"]["wait_p50"] >= 1
+    assert 0.05 <= stats["telemetry_function"]["execution_p99"] < 1
+    assert stats["telemetry_function"]["result_bytes"] > 1000
+    assert stats["telemetry_function"]["args_bytes"] == 20
+    assert stats["telemetry_function"]["tasks_per_second"] > 0
+    assert stats["failing_telemetry_function"]["failures"] == 1
+    assert stats["failing_telemetry_function"]["wait_p50"] is None
+
+    by_node = distributask.get_task_stats(since=since, group_by="node")
+    assert sum(node["tasks"] for node in by_node.values()) == 5
+
+
+def test_metrics(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setattr(distributask, "vast_rate_limiter", TokenBucket(1000, 1000))
+    monkeypatch.setattr(distributask, "rented_nodes", {})
+
+    def metrics_function(x):
+        return x
+
+    def failing_metrics_function():
+        raise RuntimeError("failed")
+
+    distributask.register_function(metrics_function)
+    distributask.register_function(failing_metrics_function)
+    distributask.app.control.purge()
+    distributask.execute_function("metrics_function", {"x": 1})
+    distributask.call_function_task.apply(("metrics_function", {"x": 1}))
+    distributask.call_function_task.apply(("failing_metrics_function", {}))
+    nodes = distributask.rent_nodes(
+        1.0, 2, "test_image", "distributask.example.worker", concurrency=2
+    )
+    atexit.unregister(distributask.terminate_nodes)
+
+    server = distributask.start_metrics_server(port=0, host="127.0.0.1")
+    try:
+        response = requests.get(f"http://127.0.0.1:{server.server_port}/metrics")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+
+    assert 'distributask_tasks_submitted_total{function="metrics_function"} 1' in lines
+    assert 'distributask_tasks_succeeded_total{function="metrics_function"} 1' in lines
+    assert (
+        'distributask_tasks_failed_total{function="failing_metrics_function"} 1'
+        in lines
+    )
+    assert (
+        'distributask_task_duration_seconds_bucket{function="metrics_function",le="+Inf"} 1'
+        in lines
+    )
+    assert 'distributask_queue_length{queue="celery"} 1' in lines
+    assert "distributask_rented_nodes 2" in lines
+    assert "distributask_rented_nodes_hourly_cost 0.4" in lines
+    assert "distributask_redis_up 1" in lines
+
+    distributask.terminate_nodes(nodes, backoff=0.01)
+    assert "distributask_rented_nodes 0" in distributask.get_metrics().splitlines()
+    distributask.app.control.purge()
+
+
+def start_worker(name, delay):
+    """
+    Start a Celery worker for distributask.tests.worker in which slow_test_function sleeps for delay seconds.
+    """
+    env = dict(os.environ, SLOW_WORKER_DELAY=str(delay), TELEMETRY="true")
+    command = [
+        "celery",
+        "-A",
+        "distributask.tests.worker",
+        "worker",
+        "--concurrency=1",
+        "--prefetch-multiplier=1",
+        "--without-heartbeat",
+        "--without-gossip",
+        "--without-mingle",
+        f"--hostname={name}@%h",
+    ]
+    return subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def test_speculative_execution():
+    distributask = create_from_config()
+    distributask.app.control.purge()
+
+    # the slow worker simulates a bad node, its task would take a minute
+    slow_worker = start_worker("slow", 60)
+    time.sleep(5)
+    fast_worker = start_worker("fast", 0.1)
+    try:
+        batch = distributask.execute_many(
+            slow_test_function.__name__, ({"index": i} for i in range(12))
+        )
+        speculator = Speculator(
+            distributask, multiplier=3, min_samples=5, min_runtime=1, interval=0.5
+        )
+
+        since = time.time()
+        start = time.monotonic()
+        results = dict(
+            distributask.as_completed(batch, timeout=50, speculate=speculator)
+        )
+        elapsed = time.monotonic() - start
+
+        assert sorted(results.values()) == list(range(12))
+        assert elapsed < 30
+        # every result came from the fast worker, including the duplicate of the task stuck on the slow worker
+        nodes = distributask.get_task_stats(since=since, group_by="node")
+        assert [node.split("@")[0] for node in nodes] == ["fast"]
+        assert nodes[next(iter(nodes))]["tasks"] == 12
+    finally:
+        for worker in (slow_worker, fast_worker):
+            worker.terminate()
+        for worker in (slow_worker, fast_worker):
+            worker.wait(timeout=30)
+
+
+def test_execute_chunked():
+    distributask = create_from_config()
+    distributask.register_function(slow_test_function)
+    distributask.get_redis_connection().delete("distributask-function-durations")
+    distributask.app.control.purge()
+
+    # without recorded durations the default chunk size is used
+    assert distributask.get_chunk_size("slow_test_function", max_chunk_size=50) == 50
+
+    worker = start_worker("chunked", 0.01)
+    try:
+        # the last call misses its argument and fails
+        args = [{"index": i} for i in range(20)] + [{}]
+        batch = distributask.execute_chunked(
+            "slow_test_function", args, chunk_size=8, threads=2
+        )
+        assert len(batch.task_ids) == 3
+        assert len(batch) == 21
+
+        items = list(batch)
+        assert [item.get(timeout=30) for item in items[:20]] == list(range(20))
+        assert items[0].successful()
+        assert items[20].failed()
+        with pytest.raises(TypeError):
+            items[20].get()
+        with pytest.raises(TypeError):
+            batch.results()
+        assert batch[-2].get() == 19
+
+        # about one second of calls per task
+        assert 50 <= distributask.get_chunk_size("slow_test_function") <= 100
+    finally:
+        worker.terminate()
+        worker.wait(timeout=30)
+
+
+def test_async_distributask(vast_api_server, monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "VAST_API_URL", vast_api_server["url"])
+    monkeypatch.setattr(distributask, "vast_rate_limiter", TokenBucket(1000, 1000))
+    distributask.register_function(slow_test_function)
+    distributask.app.control.purge()
+
+    async def submit(client):
+        task = await client.execute_function("slow_test_function", {"index": 0})
+        batch = await client.execute_many(
+            "slow_test_function", ({"index": i} for i in range(1, 6)), priority=9
+        )
+        return task, batch
+
+    async def run():
+        async with AsyncDistributask(distributask) as client:
+            # submission and rental run concurrently in the event loop
+            start = time.monotonic()
+            (task, batch), nodes = await asyncio.gather(
+                submit(client),
+                client.rent_nodes(
+                    1.0, 4, "test_image", "distributask.example.worker", concurrency=4
+                ),
+            )
+            elapsed = time.monotonic() - start
+            assert distributask.get_queue_length() == 6
+
+            worker = start_worker("async", 0.01)
+            try:
+                assert await client.get_result(task, timeout=30) == 0
+                results = dict(
+                    [item async for item in client.as_completed(batch, timeout=30)]
+                )
+            finally:
+                worker.terminate()
+                worker.wait(timeout=30)
+            reports = await client.terminate_nodes(nodes, backoff=0.01)
+
+            # retries are rate limited like the sync client's
+            acquired = []
+
+            async def acquire_async():
+                acquired.append(1)
+
+            monkeypatch.setattr(
+                distributask.vast_rate_limiter, "acquire_async", acquire_async
+            )
+            vast_api_server["throttled"] = 2
+            await client.get_instance(1)
+            assert len(acquired) == 3
+        return elapsed, batch, results, nodes, reports
+
+    elapsed, batch, results, nodes, reports = asyncio.run(run())
+    atexit.unregister(distributask.terminate_nodes)
+
+    assert results == {task_id: i for i, task_id in enumerate(batch.task_ids, 1)}
+    assert sorted(node["offer_id"] for node in nodes) == [1, 3, 5, 6]
+    assert elapsed < 1
+    assert all(report["terminated"] for report in reports)
+    assert sorted(vast_api_server["destroyed"]) == [100, 300, 500, 600]
+
+
+def test_async_results_beyond_pool_size(monkeypatch):
+    distributask = create_from_config()
+    monkeypatch.setitem(distributask.settings, "REDIS_POOL_SIZE", 3)
+    monkeypatch.setitem(distributask.settings, "REDIS_POOL_TIMEOUT", 3)
+    distributask.register_function(slow_test_function)
+    distributask.app.control.purge()
+
+    async def run():
+        async with AsyncDistributask(distributask) as client:
+            batch = await client.execute_many(
+                "slow_test_function", ({"index": i} for i in range(15))
+            )
+            # more awaiters than pool connections share one pub/sub listener
+            results = asyncio.gather(
+                *(client.get_result(task_id, timeout=60) for task_id in batch.task_ids)
+            )
+            await asyncio.sleep(0.5)
+            assert len(client.waiters) == 15
+            worker = start_worker("async-pool", 0.01)
+            try:
+                results = await results
+            finally:
+                worker.terminate()
+                worker.wait(timeout=30)
+            assert client.waiters == {}
+            return results
+
+    assert asyncio.run(run()) == list(range(15))
+
+
+def test_async_encoding_off_event_loop(monkeypatch):
+    distributask = create_from_config()
+    distributask.register_function(slow_test_function)
+    distributask.app.control.purge()
+
+    threads = []
+    store_payload = distributask.store_payload
+
+    def recording_store_payload(payload):
+        threads.append(threading.current_thread())
+        return store_payload(payload)
+
+    monkeypatch.setattr(distributask, "store_payload", recording_store_payload)
+
+    async def submit():
+        async with AsyncDistributask(distributask) as client:
+            await client.execute_function("slow_test_function", {"index": 0})
+            await client.execute_many(
+                "slow_test_function", ({"index": i} for i in range(1, 4))
+            )
+
+    asyncio.run(submit())
+    # the messages are serialized in worker threads, not in the event loop's thread
+    assert len(threads) == 4
+    assert threading.main_thread() not in threads
+    assert distributask.get_queue_length() == 4
+    distributask.app.control.purge()
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+
+    # a burst of two, then one call every 50ms
+    assert 0.15 <= elapsed < 0.5
+
+
 # def test_get_node_log(): 
- 
+
 #     distributask = create_from_config()
 
 #     max_price = 0.5
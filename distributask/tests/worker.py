@@ -1,3 +1,6 @@
+import os
+import time
+
 from ..distributask import create_from_config
 
 distributaur = create_from_config()
@@ -8,6 +11,14 @@ def example_test_function(arg1, arg2):
     return f"Result: arg1+arg2={arg1+arg2}"
 
 
+# Workers started with SLOW_WORKER_DELAY set simulate a slow node
+def slow_test_function(index):
+    time.sleep(float(os.getenv("SLOW_WORKER_DELAY", 0.1)))
+    return index
+
+
+distributaur.register_function(slow_test_function)
+
 celery = distributaur.app
 
 
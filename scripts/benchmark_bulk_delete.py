@@ -0,0 +1,104 @@
+import argparse
+import tempfile
+import time
+
+from huggingface_hub import CommitOperationAdd
+
+from distributask.distributask import LocalCommitBackend, create_from_config
+
+# Compares deleting files one commit at a time (delete_file) with chunked commits (delete_files). The Hub API is
+# replaced by a LocalCommitBackend that waits a fixed time per commit and per operation, so the benchmark needs
+# no Hugging Face account. Point REDIS_HOST at a local Redis server, it holds the repository index.
+
+
+class SimulatedHubBackend(LocalCommitBackend):
+    def __init__(
+        self, root: str, commit_latency: float, operation_latency: float
+    ) -> None:
+        super().__init__(root)
+        self.commit_latency = commit_latency
+        self.operation_latency = operation_latency
+
+    def commit(self, operations, message, parent_commit=None):
+        time.sleep(self.commit_latency + self.operation_latency * len(operations))
+        return super().commit(operations, message, parent_commit)
+
+
+def add_files(backend: LocalCommitBackend, count: int) -> list:
+    paths = [f"bad/output_{i}.txt" for i in range(count)]
+    # setting up the files isn't measured, skip the simulated latency
+    LocalCommitBackend.commit(
+        backend, [CommitOperationAdd(path, b"bad") for path in paths], "Add files"
+    )
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk deletes")
+    parser.add_argument(
+        "--number_of_files",
+        type=int,
+        default=200,
+        help="Number of files to delete (default: 200)",
+    )
+    parser.add_argument(
+        "--commit_latency",
+        type=float,
+        default=0.05,
+        help="Seconds each commit takes (default: 0.05)",
+    )
+    parser.add_argument(
+        "--operation_latency",
+        type=float,
+        default=0.0005,
+        help="Seconds each operation adds to a commit (default: 0.0005)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=50,
+        help="Files deleted per commit by delete_files (default: 50)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Commits made at the same time by delete_files (default: 4)",
+    )
+    args = parser.parse_args()
+
+    distributask = create_from_config()
+    repo_id = distributask.get_settings()["HF_REPO_ID"]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        backend = SimulatedHubBackend(
+            temp_dir, args.commit_latency, args.operation_latency
+        )
+        distributask.commit_backend = backend
+
+        paths = add_files(backend, args.number_of_files)
+        distributask.refresh_repo_index(force=True)
+        start = time.perf_counter()
+        for path in paths:
+            distributask.delete_file(repo_id, path)
+        single_time = time.perf_counter() - start
+        single_commits = len(backend.commits) - 1
+        assert not any(distributask.files_exist(paths))
+
+        paths = add_files(backend, args.number_of_files)
+        distributask.refresh_repo_index(force=True)
+        commits = len(backend.commits)
+        start = time.perf_counter()
+        summaries = distributask.delete_files(
+            paths, chunk_size=args.chunk_size, concurrency=args.concurrency
+        )
+        bulk_time = time.perf_counter() - start
+        assert not any("error" in summary for summary in summaries)
+        assert not any(distributask.files_exist(paths))
+
+    print(
+        f"Files: {args.number_of_files}, {args.commit_latency * 1000:.0f} ms per commit"
+    )
+    print(f"delete_file: {single_time:.2f}s ({single_commits} commits)")
+    print(f"delete_files: {bulk_time:.2f}s ({len(backend.commits) - commits} commits)")
+    print(f"Speedup: {single_time / bulk_time:.1f}x")
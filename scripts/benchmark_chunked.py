@@ -0,0 +1,96 @@
+import argparse
+import os
+import subprocess
+import time
+
+from distributask.distributask import create_from_config
+from distributask.tests.worker import slow_test_function
+
+# Compares one task per call (execute_many) with chunked execution (execute_chunked) for a function that only
+# takes a few milliseconds. Starts a local worker, so point REDIS_HOST at a local Redis server.
+
+
+def start_worker(concurrency: int, delay: float) -> subprocess.Popen:
+    env = dict(os.environ, SLOW_WORKER_DELAY=str(delay))
+    return subprocess.Popen(
+        [
+            "celery",
+            "-A",
+            "distributask.tests.worker",
+            "worker",
+            f"--concurrency={concurrency}",
+            "--without-heartbeat",
+            "--without-gossip",
+            "--without-mingle",
+            "--loglevel=warning",
+        ],
+        env=env,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunked execution")
+    parser.add_argument(
+        "--number_of_calls",
+        type=int,
+        default=5000,
+        help="Number of function calls (default: 5000)",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.001,
+        help="Seconds each call takes (default: 0.001)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Worker processes (default: 4)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="Calls per task (default: chosen from the measured call duration)",
+    )
+    args = parser.parse_args()
+
+    distributask = create_from_config()
+    distributask.register_function(slow_test_function)
+    distributask.app.control.purge()
+
+    def job_params():
+        for i in range(args.number_of_calls):
+            yield {"index": i}
+
+    worker = start_worker(args.concurrency, args.delay)
+    try:
+        # wait for the worker, and record a call duration for the automatic chunk size
+        distributask.execute_chunked(
+            "slow_test_function", job_params(), chunk_size=100
+        ).results(timeout=120)
+
+        start = time.perf_counter()
+        batch = distributask.execute_many("slow_test_function", job_params())
+        assert len(batch.results()) == args.number_of_calls
+        task_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunked = distributask.execute_chunked(
+            "slow_test_function", job_params(), chunk_size=args.chunk_size
+        )
+        assert len(chunked.results()) == args.number_of_calls
+        chunked_time = time.perf_counter() - start
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    print(f"Calls: {args.number_of_calls}, {args.delay * 1000:.1f} ms each")
+    print(
+        f"One task per call: {task_time:.2f}s ({args.number_of_calls / task_time:.0f} calls/s)"
+    )
+    print(
+        f"Chunked ({len(chunked.task_ids)} tasks): {chunked_time:.2f}s ({args.number_of_calls / chunked_time:.0f} calls/s)"
+    )
+    print(f"Speedup: {task_time / chunked_time:.1f}x")
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+from distributask.distributask import create_from_config
+
+# Compares the per-call submission loop used in distributask/example/distributed.py with execute_many.
+# Only enqueueing is measured, so no worker needs to be running. Point REDIS_HOST at a local Redis server.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark task submission")
+    parser.add_argument(
+        "--number_of_tasks",
+        type=int,
+        default=10000,
+        help="Number of tasks to submit (default: 10000)",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=500,
+        help="Chunk size used by execute_many (default: 500)",
+    )
+    args = parser.parse_args()
+
+    distributask = create_from_config()
+
+    def job_params():
+        for i in range(args.number_of_tasks):
+            yield {"index": i, "arg1": 1, "arg2": 2}
+
+    distributask.app.control.purge()
+    start = time.perf_counter()
+    tasks = []
+    for params in job_params():
+        tasks.append(distributask.execute_function("example_function", params))
+    loop_time = time.perf_counter() - start
+
+    distributask.app.control.purge()
+    start = time.perf_counter()
+    batch = distributask.execute_many(
+        "example_function", job_params(), chunk_size=args.chunk_size
+    )
+    batch_time = time.perf_counter() - start
+
+    distributask.app.control.purge()
+
+    print(f"Tasks submitted: {args.number_of_tasks}")
+    print(
+        f"execute_function loop: {loop_time:.2f}s ({args.number_of_tasks / loop_time:.0f} tasks/s)"
+    )
+    print(
+        f"execute_many (chunk_size={args.chunk_size}): {batch_time:.2f}s ({len(batch) / batch_time:.0f} tasks/s)"
+    )
+    print(f"Speedup: {loop_time / batch_time:.1f}x")
@@ -0,0 +1,64 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from redis import BlockingConnectionPool, Redis
+
+from distributask.distributask import create_from_config
+
+# Compares a single-connection Redis pool, which is what get_redis_connection used to build, with the shared
+# connection pool when many threads issue commands at the same time. Point REDIS_HOST at a local Redis server.
+
+
+def run(client: Redis, threads: int, operations: int) -> float:
+    def worker(index):
+        for i in range(operations):
+            client.set(f"benchmark_pool:{index}", i)
+            client.get(f"benchmark_pool:{index}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start
+
+    for index in range(threads):
+        client.delete(f"benchmark_pool:{index}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Redis connection pools")
+    parser.add_argument(
+        "--threads", type=int, default=16, help="Number of threads (default: 16)"
+    )
+    parser.add_argument(
+        "--operations",
+        type=int,
+        default=1000,
+        help="SET/GET pairs per thread (default: 1000)",
+    )
+    args = parser.parse_args()
+
+    distributask = create_from_config()
+    settings = distributask.get_settings()
+    total = args.threads * args.operations * 2
+
+    single_pool = BlockingConnectionPool(
+        host=settings["REDIS_HOST"],
+        port=settings["REDIS_PORT"],
+        password=settings["REDIS_PASSWORD"],
+        max_connections=1,
+    )
+    single_time = run(Redis(connection_pool=single_pool), args.threads, args.operations)
+    single_pool.disconnect()
+
+    shared_time = run(
+        distributask.get_redis_connection(), args.threads, args.operations
+    )
+
+    print(f"Threads: {args.threads}, commands: {total}")
+    print(f"Single connection: {single_time:.2f}s ({total / single_time:.0f} commands/s)")
+    print(
+        f"Shared pool (REDIS_POOL_SIZE={settings['REDIS_POOL_SIZE']}): {shared_time:.2f}s ({total / shared_time:.0f} commands/s)"
+    )
+    print(f"Speedup: {single_time / shared_time:.1f}x")
@@ -0,0 +1,87 @@
+import argparse
+import json
+import random
+import time
+
+from kombu.exceptions import EncodeError
+from kombu.serialization import (
+    SerializerNotInstalled,
+    dumps,
+    loads,
+    prepare_accept_content,
+)
+
+import distributask  # registers the pickle5 serializer
+
+# Measures encode/decode time and message size of the task serializers for typical payloads. "json (double)"
+# is the old behaviour, where the arguments were JSON encoded into a string that Celery encoded again.
+
+SERIALIZERS = ["json (double)", "json", "msgpack", "pickle", "pickle5"]
+
+
+def make_payloads(size: int) -> dict:
+    payloads = {
+        "small args": {"index": 1, "arg1": 1, "arg2": 2},
+        "vertex list": {
+            "vertices": [[random.random() for _ in range(3)] for _ in range(size)]
+        },
+        "camera path": {
+            "frames": [
+                {"position": [random.random()] * 3, "rotation": [random.random()] * 4}
+                for _ in range(size // 10)
+            ]
+        },
+    }
+    try:
+        import numpy as np
+
+        payloads["numpy array"] = {"vertices": np.random.rand(size, 3)}
+    except ImportError:
+        pass
+    return payloads
+
+
+def measure(payload, serializer: str, repeat: int):
+    double = serializer == "json (double)"
+    name = "json" if double else serializer
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = json.dumps(payload) if double else payload
+        content_type, content_encoding, data = dumps(body, serializer=name)
+    encode_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decoded = loads(
+            data, content_type, content_encoding, accept=prepare_accept_content([name])
+        )
+        if double:
+            decoded = json.loads(decoded)
+    decode_time = (time.perf_counter() - start) / repeat
+
+    return encode_time, decode_time, len(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark task serializers")
+    parser.add_argument(
+        "--size", type=int, default=100000, help="Number of vertices (default: 100000)"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Repetitions per measurement (default: 5)"
+    )
+    args = parser.parse_args()
+
+    print(f"{'payload':<14}{'serializer':<16}{'encode ms':>12}{'decode ms':>12}{'size KB':>12}")
+    for payload_name, payload in make_payloads(args.size).items():
+        for serializer in SERIALIZERS:
+            try:
+                encode_time, decode_time, size = measure(payload, serializer, args.repeat)
+            except (SerializerNotInstalled, EncodeError, TypeError):
+                # serializer not installed, or it cannot encode this payload
+                print(f"{payload_name:<14}{serializer:<16}{'n/a':>12}{'n/a':>12}{'n/a':>12}")
+                continue
+            print(
+                f"{payload_name:<14}{serializer:<16}{encode_time * 1000:>12.2f}{decode_time * 1000:>12.2f}{size / 1024:>12.1f}"
+            )